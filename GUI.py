@@ -1,43 +1,44 @@
 import tkinter as tk
 import json
-from tkinter import filedialog
-from PIL import Image, ImageTk
+import logging
+import os
+import queue
+import threading
+from tkinter import filedialog, messagebox, simpledialog, ttk
 from image_manager import ImageManager
+from image_cache import ImageCache
+from image_ingest import scan_images
+from image_list_view import ImageListView
+from image_metadata import format_exif_datetime
+from preview_cache import PreviewCache
+from project_file import PROJECT_FILE_SUFFIX
 
+# 處理過的照片快取位置及大小上限
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ReportGenerator")
+CACHE_MAX_BYTES = 2 * 1024**3
 
-class DragDropListbox(tk.Listbox):
-    """A Tkinter listbox with drag'n'drop reordering of entries."""
-
-    def __init__(self, master, **kw):
-        kw["selectmode"] = tk.SINGLE
-        tk.Listbox.__init__(self, master, kw)
-        self.bind("<Button-1>", self.setCurrent)
-        self.bind("<B1-Motion>", self.shiftSelection)
-        self.curIndex = None
-
-    def setCurrent(self, event):
-        self.curIndex = self.nearest(event.y)
-
-    def shiftSelection(self, event):
-        i = self.nearest(event.y)
-        if i < self.curIndex:
-            x = self.get(i)
-            self.delete(i)
-            self.insert(i + 1, x)
-            self.curIndex = i
-        elif i > self.curIndex:
-            x = self.get(i)
-            self.delete(i)
-            self.insert(i - 1, x)
-            self.curIndex = i
+# 預覽圖快取大小, 及前後預先載入的張數
+PREVIEW_CACHE_MAX_BYTES = 256 * 1024**2
+PREVIEW_PREFETCH_COUNT = 3
 
 
 class GUI:
     def __init__(self):
         self._image_manager = ImageManager()
+        self._image_cache = ImageCache(CACHE_DIR, CACHE_MAX_BYTES)
+        # Word 報告的大小上限 (MB), 0 表示不限制
+        self._report_size_limit = 0
         self._max_width = 800
         self._max_height = 560
+        self._preview_cache = PreviewCache(
+            self._max_width, self._max_height, PREVIEW_CACHE_MAX_BYTES
+        )
         self._init_window()
+        # 視窗顯示後才在背景載入產生報告用的模組
+        self._warm_up_thread = threading.Thread(
+            target=self._image_manager.warm_up, daemon=True
+        )
+        self._window.after_idle(self._warm_up_thread.start)
 
     def start(self):
         self._window.mainloop()
@@ -61,9 +62,38 @@ class GUI:
         self._file_menu = tk.Menu(self._main_menu, tearoff=0)
         self._main_menu.add_cascade(label="File", menu=self._file_menu)
         self._file_menu.add_command(label="Save Report", command=self._save_report)
+        self._file_menu.add_command(
+            label="Append to Report", command=self._append_report
+        )
+        self._file_menu.add_command(label="Add Folder", command=self._add_folder)
+        self._file_menu.add_command(label="Open Project", command=self._open_project)
+        self._file_menu.add_command(label="Save Project As", command=self._save_project)
+        self._file_menu.add_command(
+            label="Report Template", command=self._set_report_template
+        )
+        self._file_menu.add_command(
+            label="Report Size Limit", command=self._set_report_size_limit
+        )
         self._file_menu.add_command(label="Import Data", command=self._import_data)
         self._file_menu.add_command(label="Export Data", command=self._export_data)
 
+        self._edit_menu = tk.Menu(self._main_menu, tearoff=0)
+        self._main_menu.add_cascade(label="Edit", menu=self._edit_menu)
+        self._edit_menu.add_command(
+            label="Use Image Time for All",
+            command=lambda: self._update_all_use_image_time(True),
+        )
+        self._edit_menu.add_command(
+            label="Use Typed Time for All",
+            command=lambda: self._update_all_use_image_time(False),
+        )
+        self._edit_menu.add_command(
+            label="Rotate All", command=lambda: self._update_all_rotate_image(True)
+        )
+        self._edit_menu.add_command(
+            label="Rotate None", command=lambda: self._update_all_rotate_image(False)
+        )
+
     def _create_frames(self):
         # arrange main frames
         self._left_frame = tk.Frame(self._window, width="400", height="600")
@@ -122,23 +152,20 @@ class GUI:
         self._set_report_title_entry.grid(column=1, row=0, sticky="ew")
 
     def _create_image_list_box(self):
-        self._image_list_box = DragDropListbox(
-            self._image_list_frame, height=32, width=50
-        )
-        self._image_list_box.grid(column=0, row=0, sticky="nsew")
-        y_scrollbar = tk.Scrollbar(
-            self._image_list_frame, command=self._image_list_box.yview
-        )
-        x_scrollbar = tk.Scrollbar(
+        # 清單直接讀取 ImageManager 中的順序, 只繪製看得到的列
+        y_scrollbar = tk.Scrollbar(self._image_list_frame)
+        self._image_list_box = ImageListView(
             self._image_list_frame,
-            orient="horizontal",
-            command=self._image_list_box.xview,
-        )
-        self._image_list_box.config(
-            yscrollcommand=y_scrollbar.set, xscrollcommand=x_scrollbar.set
+            get_count=self._image_manager.get_image_count,
+            get_file_path=self._image_manager.get_file_path,
+            on_move=self._image_manager.move_image,
+            yscrollcommand=y_scrollbar.set,
+            height=520,
+            width=380,
         )
-        y_scrollbar.grid(row=0, column=1, rowspan=2, sticky="ns")
-        x_scrollbar.grid(row=1, column=0, sticky="ew")
+        y_scrollbar.config(command=self._image_list_box.yview)
+        self._image_list_box.grid(column=0, row=0, sticky="nsew")
+        y_scrollbar.grid(row=0, column=1, sticky="ns")
 
         self._image_list_box.bind("<<ListboxSelect>>", self._select_image)
         self._image_list_box.bind("<Down>", self._click_down)
@@ -261,18 +288,54 @@ class GUI:
         ).grid(column=13, row=0)
         self._is_rotate_image.trace("w", update_rotate_image)
 
+        self._image_time_variable = tk.StringVar()
+        self._image_time_label = tk.Label(
+            self._insert_date_frame, textvariable=self._image_time_variable
+        ).grid(column=14, row=0)
+
     def _add_image(self, event=None):
         files = filedialog.askopenfilenames(parent=self._window, title="Choose image")
         file_path = self._window.tk.splitlist(files)
         self._image_manager.add_image(file_path)
-        for path in file_path:
-            self._image_list_box.insert(tk.END, path)
+        self._image_list_box.refresh()
+
+    def _add_folder(self):
+        directory = filedialog.askdirectory(parent=self._window, title="Choose folder")
+        if not directory:
+            return
+        # 背景執行緒只掃描資料夾, 完成後在 Tk 執行緒加入清單
+        self._window.config(cursor="watch")
+        known_files = self._image_manager.get_file_paths()
+        results = queue.Queue()
+
+        def scan_folder():
+            try:
+                results.put(scan_images(directory, known_files))
+            except Exception as e:
+                results.put(e)
+
+        threading.Thread(target=scan_folder, daemon=True).start()
+        self._window.after(100, self._poll_add_folder, results)
+
+    def _poll_add_folder(self, results):
+        try:
+            images = results.get_nowait()
+        except queue.Empty:
+            self._window.after(100, self._poll_add_folder, results)
+            return
+        self._window.config(cursor="")
+        if isinstance(images, Exception):
+            messagebox.showerror("Add Folder", f"Add failed: {images}")
+        else:
+            self._image_manager.add_scanned_images(images)
+            self._image_list_box.refresh()
 
     def _delete_image(self, event=None):
         cur_index = self._image_list_box.curIndex
         file_path = self._image_list_box.get(cur_index)
         self._image_manager.delete_iamge(file_path)
-        self._image_list_box.delete(cur_index)
+        self._preview_cache.remove(file_path)
+        self._image_list_box.refresh()
         self._image_canvas.delete("all")
 
     def _select_image(self, envet):
@@ -283,62 +346,161 @@ class GUI:
         cur_index = self._image_list_box.curIndex
         file_path = self._image_list_box.get(cur_index)
         cur_image_info = self._image_manager.get_image_info(file_path)
-        self._year_varialbe.set(cur_image_info["time"]["year"])
-        self._month_varialbe.set(cur_image_info["time"]["month"])
-        self._day_varialbe.set(cur_image_info["time"]["day"])
-        self._hour_varialbe.set(cur_image_info["time"]["hour"])
-        self._minute_varialbe.set(cur_image_info["time"]["minute"])
-        self._second_varialbe.set(cur_image_info["time"]["second"])
-        self._is_use_image_time.set(cur_image_info["use_image_time"])
-        self._is_rotate_image.set(cur_image_info["rotate_image"])
+        self._year_varialbe.set(cur_image_info.year)
+        self._month_varialbe.set(cur_image_info.month)
+        self._day_varialbe.set(cur_image_info.day)
+        self._hour_varialbe.set(cur_image_info.hour)
+        self._minute_varialbe.set(cur_image_info.minute)
+        self._second_varialbe.set(cur_image_info.second)
+        self._is_use_image_time.set(cur_image_info.use_image_time)
+        self._is_rotate_image.set(cur_image_info.rotate_image)
+
+        metadata = self._image_manager.get_image_metadata(file_path)
+        image_time = format_exif_datetime(metadata and metadata["datetime"])
+        self._image_time_variable.set(f"Image Time: {image_time}")
 
     def _show_image(self):
-        def resize_to_fit_height(img_width, img_height):
-            img_width = int(img_width * (self._max_height / img_height))
-            img_height = self._max_height
-            return img_width, img_height
-
-        def resize_to_fit_width(img_width, img_height):
-            img_height = int(img_height * (self._max_width / img_width))
-            img_width = self._max_width
-            return img_width, img_height
-
         index = self._image_list_box.curIndex
         filename = self._image_list_box.get(index)
-        img = Image.open(filename)
-        img_width, img_height = img.size
-        height_ratio = None
-        if img_height > self._max_height:
-            height_ratio = img_height / self._max_height
-        width_ratio = None
-        if img_width > self._max_width:
-            width_ratio = img_width / self._max_width
-
-        if height_ratio and width_ratio:
-            if height_ratio > width_ratio:
-                img_width, img_height = resize_to_fit_height(img_width, img_height)
-            else:
-                img_width, img_height = resize_to_fit_width(img_width, img_height)
-        elif height_ratio:
-            img_width, img_height = resize_to_fit_height(img_width, img_height)
-        elif width_ratio:
-            img_width, img_height = resize_to_fit_width
-        img = img.resize((img_width, img_height), Image.ANTIALIAS)
-        img = ImageTk.PhotoImage(img)
+        from PIL import ImageTk
+
+        img = ImageTk.PhotoImage(self._preview_cache.get(filename))
         self._image_canvas.image = img
+        self._image_canvas.delete("all")
         self._image_canvas.create_image(
             self._max_width / 2, self._max_height / 2, image=img, anchor=tk.CENTER
         )
 
+        # 預先載入前後幾張, 下一張優先
+        list_box_size = self._image_list_box.size()
+        prefetch_paths = []
+        for offset in range(1, PREVIEW_PREFETCH_COUNT + 1):
+            for neighbor in [index + offset, index - offset]:
+                if 0 <= neighbor < list_box_size:
+                    prefetch_paths.append(self._image_list_box.get(neighbor))
+        self._preview_cache.prefetch(prefetch_paths)
+
     def _save_report(self):
-        save_file_name = filedialog.asksaveasfile(mode="wb", defaultextension=".docx")
-        file_path_list = self._image_list_box.get(0, tk.END)
-        self._image_manager.generate_report(save_file_name, file_path_list)
+        # 依副檔名產生 Word 或 PDF 報告
+        save_file_name = filedialog.asksaveasfilename(
+            defaultextension=".docx",
+            filetypes=[("Word Document", "*.docx"), ("PDF", "*.pdf")],
+        )
+        if not save_file_name:
+            return
+        options = {}
+        if self._report_size_limit and not save_file_name.lower().endswith(".pdf"):
+            options["max_output_bytes"] = int(self._report_size_limit * 1024**2)
+        self._generate_report_in_background(
+            self._image_manager.generate_report,
+            save_file_name,
+            streaming=True,
+            **options,
+        )
+
+    def _append_report(self):
+        # 把清單中的照片加到既有報告的最後
+        report_file_name = filedialog.askopenfilename(
+            filetypes=[("Word Document", "*.docx")]
+        )
+        if not report_file_name:
+            return
+        self._generate_report_in_background(
+            self._image_manager.append_report, report_file_name
+        )
+
+    def _update_all_use_image_time(self, value):
+        self._image_manager.update_all_use_image_time(value)
+        if self._image_list_box.curIndex is not None:
+            self._show_time_info()
+
+    def _update_all_rotate_image(self, value):
+        self._image_manager.update_all_rotate_image(value)
+        if self._image_list_box.curIndex is not None:
+            self._show_time_info()
+
+    def _generate_report_in_background(self, generate, file_name, **options):
+        self._create_progress_window()
+
+        # 在背景執行緒產生報告, 進度透過 queue 傳回主執行緒
+        self._report_events = queue.Queue()
+        self._cancel_report = threading.Event()
+
+        def progress(finished_pages, num_pages):
+            self._report_events.put(("progress", finished_pages, num_pages))
+
+        def generate_report():
+            # 背景載入模組時不 fork 處理圖片的行程, 先等待載入完成
+            if self._warm_up_thread.is_alive():
+                self._warm_up_thread.join()
+            from report_controller import GenerationCancelled
+
+            try:
+                generate(
+                    file_name,
+                    progress=progress,
+                    cancel_event=self._cancel_report,
+                    workers=os.cpu_count(),
+                    cache=self._image_cache,
+                    **options,
+                )
+            except GenerationCancelled:
+                self._report_events.put(("cancelled",))
+            except Exception as e:
+                self._report_events.put(("error", e))
+            else:
+                self._report_events.put(("finished",))
+
+        threading.Thread(target=generate_report, daemon=True).start()
+        self._window.after(100, self._poll_report_events)
+
+    def _create_progress_window(self):
+        self._progress_window = tk.Toplevel(self._window)
+        self._progress_window.title("Generating Report")
+        self._progress_window.resizable(False, False)
+        self._progress_window.protocol("WM_DELETE_WINDOW", self._cancel_save_report)
+        self._progress_bar = ttk.Progressbar(
+            self._progress_window, length=300, mode="determinate"
+        )
+        self._progress_label = tk.Label(self._progress_window, text="Preparing...")
+        self._cancel_button = tk.Button(
+            self._progress_window, text="Cancel", command=self._cancel_save_report
+        )
+        self._progress_bar.grid(column=0, row=0, padx=10, pady=10)
+        self._progress_label.grid(column=0, row=1, padx=10)
+        self._cancel_button.grid(column=0, row=2, pady=10)
+        self._progress_window.transient(self._window)
+        self._progress_window.grab_set()
+
+    def _cancel_save_report(self):
+        self._cancel_report.set()
+        self._cancel_button.config(state=tk.DISABLED)
+        self._progress_label.config(text="Cancelling...")
+
+    def _poll_report_events(self):
+        while True:
+            try:
+                event = self._report_events.get_nowait()
+            except queue.Empty:
+                break
+
+            if event[0] == "progress":
+                _, finished_pages, num_pages = event
+                self._progress_bar.config(maximum=num_pages, value=finished_pages)
+                self._progress_label.config(text=f"Page {finished_pages}/{num_pages}")
+                continue
+
+            self._progress_window.grab_release()
+            self._progress_window.destroy()
+            if event[0] == "error":
+                messagebox.showerror("Generate Report", f"Generate failed: {event[1]}")
+            return
+
+        self._window.after(100, self._poll_report_events)
 
     def _export_data(self):
         save_file_name = filedialog.asksaveasfilename(defaultextension=".json")
-        file_path_list = self._image_list_box.get(0, tk.END)
-        sorted_image_date = self._image_manager.export_data(file_path_list)
+        sorted_image_date = self._image_manager.export_data()
 
         with open(save_file_name, "w") as fp:
             json.dump(sorted_image_date, fp, indent=4)
@@ -354,14 +516,67 @@ class GUI:
             except:
                 print("Please insert json file")
 
-        self._image_list_box.delete(0, tk.END)
+        self._image_manager.import_data(import_data)
+        self._image_list_box.curIndex = None
+        self._image_list_box.refresh()
+
+    def _open_project(self):
+        project_path = filedialog.askopenfilename(
+            parent=self._window,
+            title="Open Project",
+            filetypes=[("Project", "*" + PROJECT_FILE_SUFFIX)],
+        )
+        if not project_path:
+            return
         try:
-            for data in import_data:
-                self._image_list_box.insert(tk.END, data["file_path"])
-        except KeyError:
-            print("Import data format error")
+            self._image_manager.open_project(project_path)
+        except ValueError as e:
+            messagebox.showerror("Open Project", str(e))
+            return
+        self._window.title(f"照片黏貼紀錄表 - {os.path.basename(project_path)}")
+        self._report_title_variable.set(self._image_manager.get_report_title())
+        self._image_list_box.curIndex = None
+        self._image_list_box.refresh()
+        self._image_canvas.delete("all")
 
-        self._image_manager.import_data(import_data)
+    def _set_report_template(self):
+        # 取消選擇時改回預設範本
+        template_path = filedialog.askopenfilename(
+            parent=self._window,
+            title="Report Template",
+            filetypes=[("Word", "*.docx")],
+        )
+        try:
+            self._image_manager.set_report_template(template_path or None)
+        except ValueError as e:
+            messagebox.showerror("Report Template", str(e))
+
+    def _set_report_size_limit(self):
+        # 降低照片解析度及畫質讓 Word 報告不超過上限, 0 表示不限制
+        size_limit = simpledialog.askfloat(
+            "Report Size Limit",
+            "Maximum size of Word reports in MB (0 for no limit):",
+            parent=self._window,
+            initialvalue=self._report_size_limit,
+            minvalue=0,
+        )
+        if size_limit is not None:
+            self._report_size_limit = size_limit
+
+    def _save_project(self):
+        # 之後的修改會自動儲存到專案檔
+        project_path = filedialog.asksaveasfilename(
+            defaultextension=PROJECT_FILE_SUFFIX,
+            filetypes=[("Project", "*" + PROJECT_FILE_SUFFIX)],
+        )
+        if not project_path:
+            return
+        try:
+            self._image_manager.save_project(project_path)
+        except ValueError as e:
+            messagebox.showerror("Save Project", str(e))
+            return
+        self._window.title(f"照片黏貼紀錄表 - {os.path.basename(project_path)}")
 
     def _set_page_up_down_button(self):
         self._window.bind("<Prior>", self._click_up)
@@ -382,6 +597,7 @@ class GUI:
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
     print("Report Generator is starting....")
     GUI = GUI()
     GUI.start()
@@ -0,0 +1,506 @@
+"""
+Benchmarks of the report pipeline.
+
+Synthesizes photo sets, times ReportController.generate_doc and save (or
+generate_streaming, or PdfReportController), ImageManager.import_data /
+export_data, project files, folder ingestion, the GUI startup and preview
+decoding, and writes the results as JSON so runs can be compared between commits.
+Every report case runs in a fresh process to measure its peak memory.
+
+    python benchmark.py --counts 10,100,1000 --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+TIME_UNITS = ["year", "month", "day", "hour", "minute", "second"]
+
+
+def make_photo(file_path, width, height, image_format, index):
+    """
+    Write a synthetic photo with content unique to index, so no two photos
+    share an image part in the report.
+    """
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(index)
+    img = Image.effect_noise((width // 16, height // 16), 64).convert("RGB")
+    img = img.resize((width, height), Image.BICUBIC)
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, x1 = sorted(rng.randrange(width) for _ in range(2))
+        y0, y1 = sorted(rng.randrange(height) for _ in range(2))
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle([x0, y0, x1, y1], fill=color)
+
+    hour, minute, second = index // 3600 % 24, index // 60 % 60, index % 60
+    exif = Image.Exif()
+    exif[0x8769] = {36867: f"2019:09:29 {hour:02d}:{minute:02d}:{second:02d}"}
+    img.save(file_path, image_format, exif=exif.tobytes())
+    return file_path
+
+
+def make_photo_set(work_dir, count, width, height, image_format):
+    """
+    Return the paths of count synthetic photos, creating the missing ones.
+    Photos are kept in work_dir for later runs.
+    """
+    ext = "jpg" if image_format == "JPEG" else image_format.lower()
+    photo_dir = os.path.join(work_dir, f"{width}x{height}_{ext}")
+    os.makedirs(photo_dir, exist_ok=True)
+    paths = [os.path.join(photo_dir, f"{i:05d}.{ext}") for i in range(count)]
+    missing = [(i, path) for i, path in enumerate(paths) if not os.path.exists(path)]
+    if missing:
+        print(f"Creating {len(missing)} photos in {photo_dir}", file=sys.stderr)
+        with ProcessPoolExecutor() as executor:
+            futures = [
+                executor.submit(make_photo, path, width, height, image_format, i)
+                for i, path in missing
+            ]
+            for future in futures:
+                future.result()
+    return paths
+
+
+def make_image_data(paths, rotate_ratio, exif_ratio, seed=0):
+    rng = random.Random(seed)
+    image_data = []
+    for path in paths:
+        image_data.append(
+            {
+                "file_path": path,
+                "time": {unit: "1" for unit in TIME_UNITS},
+                "use_image_time": rng.random() < exif_ratio,
+                "rotate_image": rng.random() < rotate_ratio,
+            }
+        )
+    return image_data
+
+
+def read_peak_rss_kb(pid="self"):
+    """
+    Return VmHWM, the peak resident memory in KB of process pid since it
+    started or its peak was reset, None if it can't be read (not Linux, or
+    the process ended).
+    """
+    try:
+        with open(f"/proc/{pid}/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class PeakMemory:
+    """
+    Track the peak memory of this process and of its child processes, e.g.
+    the image workers, while a report case runs.
+
+    ru_maxrss can't be used on Linux: a process started with spawn begins
+    with the high-water mark of its parent, so every case would report the
+    peak of the driver. VmHWM of each process starts from its own memory,
+    the peak of this process is also reset when tracking starts. Children
+    are sampled while they run, since VmHWM is gone once they exit.
+    """
+
+    def __init__(self, interval=0.05):
+        import threading
+
+        self._interval = interval
+        self._children_kb = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._sample_children, daemon=True)
+
+    def __enter__(self):
+        try:
+            # 5: 重設 VmHWM 為目前的用量
+            with open("/proc/self/clear_refs", "w") as fp:
+                fp.write("5")
+        except OSError:
+            pass
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _sample_children(self):
+        import multiprocessing
+
+        while True:
+            for child in multiprocessing.active_children():
+                peak = read_peak_rss_kb(child.pid)
+                if peak is not None:
+                    self._children_kb = max(self._children_kb, peak)
+            if self._stop_event.wait(self._interval):
+                break
+
+    def peak_rss_mb(self):
+        """
+        Return the peak memory in MB of this process and the largest peak of
+        its child processes, None where the platform can't tell.
+        """
+        own = read_peak_rss_kb()
+        if own is not None:
+            children = self._children_kb or None
+            return round(own / 1024, 1), children and round(children / 1024, 1)
+
+        try:
+            import resource
+        except ImportError:
+            # Windows 沒有 resource 模組, 有 psutil 時改用它, 但無法得知子行程的峰值
+            try:
+                import psutil
+            except ImportError:
+                return None, None
+            memory_info = psutil.Process().memory_info()
+            peak = getattr(memory_info, "peak_wset", None)
+            return (None if peak is None else round(peak / 1024**2, 1)), None
+
+        # macOS 以 bytes 回報
+        scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+        return round(own, 1), round(children, 1)
+
+
+def run_report_case(case, image_data, output_path):
+    """
+    Generate one report and return its measurements, run in a fresh process.
+    """
+    from pdf_report import PdfReportController
+    from project_store import ImageRecord
+    from report_controller import ReportController
+
+    with PeakMemory() as peak_memory:
+        start_time = time.perf_counter()
+        if case["mode"] == "pdf":
+            report_generator = PdfReportController(**case["report_options"])
+        else:
+            report_generator = ReportController(**case["report_options"])
+        records = [ImageRecord.from_dict(data) for data in image_data]
+        report_generator.set_data(records, "Benchmark")
+        result = {"init_s": time.perf_counter() - start_time}
+
+        if case["mode"] in ("streaming", "pdf"):
+            start_time = time.perf_counter()
+            report_generator.generate_streaming(output_path)
+            result["generate_s"] = time.perf_counter() - start_time
+            result["save_s"] = 0.0
+        else:
+            start_time = time.perf_counter()
+            report_generator.generate_doc()
+            result["generate_s"] = time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            report_generator.save(output_path)
+            result["save_s"] = time.perf_counter() - start_time
+
+        result["output_bytes"] = os.path.getsize(output_path)
+        record = report_generator.metrics.record()
+        result["phases"] = record["phases"]
+        result["counters"] = record["counters"]
+    result["peak_rss_mb"], result["peak_children_rss_mb"] = peak_memory.peak_rss_mb()
+    return result
+
+
+def bench_report(case, image_data, output_dir):
+    ext = ".pdf" if case["mode"] == "pdf" else ".docx"
+    output_path = os.path.join(output_dir, "report" + ext)
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=get_context("spawn")
+    ) as executor:
+        result = executor.submit(
+            run_report_case, case, image_data, output_path
+        ).result()
+    os.unlink(output_path)
+    return result
+
+
+def bench_import_export(count):
+    from image_manager import ImageManager
+
+    export = make_image_data([f"/photos/{i:06d}.jpg" for i in range(count)], 0.3, 0.5)
+    image_manager = ImageManager()
+    start_time = time.perf_counter()
+    image_manager.import_data(json.loads(json.dumps(export)))
+    import_s = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    image_manager.export_data()
+    export_s = time.perf_counter() - start_time
+
+    # 專案資料所佔的記憶體
+    import_data = json.loads(json.dumps(export))
+    tracemalloc.start()
+    image_manager = ImageManager()
+    image_manager.import_data(import_data)
+    del import_data
+    memory_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # 專案檔: 另存, 開啟, 及每次修改自動儲存的時間
+    with tempfile.TemporaryDirectory() as work_dir:
+        project_path = os.path.join(work_dir, "project.rgproj")
+        start_time = time.perf_counter()
+        image_manager.save_project(project_path)
+        save_project_s = time.perf_counter() - start_time
+
+        file_paths = image_manager.get_file_paths()[:1000]
+        start_time = time.perf_counter()
+        for i, file_path in enumerate(file_paths):
+            image_manager.update_time(file_path, "minute", str(i % 60))
+        autosave_us = (time.perf_counter() - start_time) / len(file_paths) * 1e6
+        image_manager.close_project()
+
+        image_manager = ImageManager()
+        start_time = time.perf_counter()
+        image_manager.open_project(project_path)
+        open_project_s = time.perf_counter() - start_time
+        image_manager.close_project()
+    return {
+        "count": count,
+        "import_s": import_s,
+        "export_s": export_s,
+        "memory_mb": round(memory_bytes / 1024**2, 2),
+        "save_project_s": save_project_s,
+        "open_project_s": open_project_s,
+        "autosave_us": round(autosave_us, 1),
+    }
+
+
+def bench_ingest(paths, work_dir):
+    from image_manager import ImageManager
+
+    # 模擬記憶卡的資料夾結構, 以硬連結放入照片
+    with tempfile.TemporaryDirectory(dir=work_dir) as card_dir:
+        for i, path in enumerate(paths):
+            folder = os.path.join(card_dir, "DCIM", f"{100 + i // 500}CANON")
+            os.makedirs(folder, exist_ok=True)
+            os.link(
+                path, os.path.join(folder, f"IMG_{i:05d}{os.path.splitext(path)[1]}")
+            )
+        image_manager = ImageManager()
+        start_time = time.perf_counter()
+        added_paths = image_manager.add_folder(card_dir)
+        add_folder_s = time.perf_counter() - start_time
+    return {
+        "count": len(paths),
+        "images": len(added_paths),
+        "add_folder_s": add_folder_s,
+    }
+
+
+def bench_preview(paths, max_width=800, max_height=560):
+    from PIL import Image
+    from preview_cache import PreviewCache, load_preview
+
+    paths = paths[:20]
+    # 未使用快取前的做法: 完整解碼後縮放
+    start_time = time.perf_counter()
+    for path in paths:
+        img = Image.open(path)
+        scale = min(max_width / img.width, max_height / img.height, 1)
+        img.resize((int(img.width * scale), int(img.height * scale)), Image.LANCZOS)
+    full_decode_s = (time.perf_counter() - start_time) / len(paths)
+
+    start_time = time.perf_counter()
+    for path in paths:
+        load_preview(path, max_width, max_height)
+    draft_decode_s = (time.perf_counter() - start_time) / len(paths)
+
+    preview_cache = PreviewCache(max_width, max_height)
+    for path in paths:
+        preview_cache.get(path)
+    start_time = time.perf_counter()
+    for path in paths:
+        preview_cache.get(path)
+    cache_hit_s = (time.perf_counter() - start_time) / len(paths)
+
+    return {
+        "full_decode_s": full_decode_s,
+        "draft_decode_s": draft_decode_s,
+        "cache_hit_s": cache_hit_s,
+    }
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start_time = time.perf_counter()
+import GUI
+result = {"import_s": time.perf_counter() - start_time, "window_s": None}
+try:
+    gui = GUI.GUI()
+    gui._window.update()
+    result["window_s"] = time.perf_counter() - start_time
+    gui._window.destroy()
+except Exception:
+    pass
+result["loaded"] = [
+    name for name in ("docx", "lxml", "PIL", "multiprocessing") if name in sys.modules
+]
+print(json.dumps(result))
+"""
+
+
+def bench_startup(runs):
+    """
+    Time starting the GUI in fresh interpreters: until GUI is imported,
+    until the window is drawn (None without a display) and the whole
+    process. The first run is the cold start. The heavy modules already
+    loaded when the window shows are listed.
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        output = subprocess.check_output(
+            [sys.executable, "-c", STARTUP_SCRIPT], cwd=package_dir, text=True
+        )
+        result = json.loads(output)
+        result["process_s"] = time.perf_counter() - start_time
+        results.append(result)
+    warm = results[1:] or results
+    return {
+        "cold": results[0],
+        "warm_import_s": min(result["import_s"] for result in warm),
+        "warm_process_s": min(result["process_s"] for result in warm),
+        "runs": runs,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_list(value, item_type=str):
+    return [item_type(item) for item in value.split(",") if item]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the report pipeline.")
+    parser.add_argument(
+        "--counts", default="10,100", help="photo counts, e.g. 10,100,1000,5000"
+    )
+    parser.add_argument(
+        "--resolutions",
+        default="4000x3000",
+        help="photo sizes, e.g. 4000x3000,1600x1200",
+    )
+    parser.add_argument(
+        "--formats", default="JPEG", help="photo formats, e.g. JPEG,PNG"
+    )
+    parser.add_argument("--modes", default="save", help="save, streaming and/or pdf")
+    parser.add_argument("--workers", default="1", help="image workers, e.g. 1,4")
+    parser.add_argument("--dpi", type=int, default=200, help="0 embeds original files")
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--rotate-ratio", type=float, default=0.3)
+    parser.add_argument("--exif-ratio", type=float, default=0.5)
+    parser.add_argument(
+        "--work-dir",
+        default=os.path.join(tempfile.gettempdir(), "report_benchmark"),
+        help="directory of the synthetic photos, kept between runs",
+    )
+    parser.add_argument(
+        "--startup-runs", type=int, default=5, help="GUI starts timed, 0 skips"
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    counts = parse_list(args.counts, int)
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "reports": [],
+        "import_export": [],
+        "preview": [],
+        "ingest": [],
+        "startup": None,
+    }
+
+    if args.startup_runs:
+        results["startup"] = bench_startup(args.startup_runs)
+        print(
+            f"startup: import {results['startup']['cold']['import_s']:.3f}s cold"
+            f" {results['startup']['warm_import_s']:.3f}s warm",
+            file=sys.stderr,
+        )
+
+    for resolution in parse_list(args.resolutions):
+        width, height = (int(size) for size in resolution.split("x"))
+        for image_format in parse_list(args.formats):
+            image_format = image_format.upper()
+            paths = make_photo_set(
+                args.work_dir, max(counts), width, height, image_format
+            )
+            preview = bench_preview(paths, 800, 560)
+            preview.update(resolution=resolution, format=image_format)
+            results["preview"].append(preview)
+            ingest = bench_ingest(paths, args.work_dir)
+            ingest.update(resolution=resolution, format=image_format)
+            results["ingest"].append(ingest)
+
+            for count in counts:
+                image_data = make_image_data(
+                    paths[:count], args.rotate_ratio, args.exif_ratio
+                )
+                for mode in parse_list(args.modes):
+                    for workers in parse_list(args.workers, int):
+                        case = {
+                            "count": count,
+                            "resolution": resolution,
+                            "format": image_format,
+                            "mode": mode,
+                            "report_options": {
+                                "image_dpi": args.dpi or None,
+                                "jpeg_quality": args.quality,
+                                "workers": workers,
+                            },
+                        }
+                        result = bench_report(case, image_data, args.work_dir)
+                        result.update(case)
+                        results["reports"].append(result)
+                        print(
+                            f"{count:5d} x {resolution} {image_format} {mode} "
+                            f"workers={workers}: generate {result['generate_s']:.2f}s "
+                            f"save {result['save_s']:.2f}s "
+                            f"{result['output_bytes'] / 1024**2:.1f} MB "
+                            f"peak {result['peak_rss_mb']} MB",
+                            file=sys.stderr,
+                        )
+
+    for count in counts:
+        results["import_export"].append(bench_import_export(count))
+
+    with open(args.output, "w") as fp:
+        json.dump(results, fp, indent=4)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
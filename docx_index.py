@@ -0,0 +1,91 @@
+from docx.opc.packuri import PackURI
+from docx.opc.rel import Relationships
+from docx.package import ImageParts
+from docx.parts.document import DocumentPart
+
+
+class IndexedImageParts(ImageParts):
+    """
+    Image parts of a package, looked up by hash in a dict. python-docx hashes
+    the blob of every image part on each lookup and scans all part names for
+    a new one, which is quadratic in the number of pictures.
+    """
+
+    def __init__(self, image_parts=()):
+        super().__init__()
+        self._parts_by_sha1 = {}
+        self._used_numbers = set()
+        self._max_number = 0
+        for image_part in image_parts:
+            self.append(image_part)
+
+    def append(self, item):
+        super().append(item)
+        self._parts_by_sha1.setdefault(item.sha1, item)
+        self._used_numbers.add(item.partname.idx)
+        self._max_number = max(self._max_number, item.partname.idx or 0)
+
+    def _get_by_sha1(self, sha1):
+        return self._parts_by_sha1.get(sha1)
+
+    def _next_image_partname(self, ext):
+        if len(self._used_numbers) != len(self) or self._max_number != len(self):
+            # 編號不連續時沿用 python-docx 的做法, 填補空缺的編號
+            return super()._next_image_partname(ext)
+        return PackURI("/word/media/image%d.%s" % (len(self) + 1, ext))
+
+
+class IndexedDocumentPart(DocumentPart):
+    """
+    Document part handing out shape ids from a counter. python-docx searches
+    the whole document for the largest id on every picture, and reuses ids
+    of content already removed by StreamingDocxWriter.
+    """
+
+    @property
+    def next_id(self):
+        last_id = getattr(self, "_last_id", None)
+        if last_id is None:
+            next_id = super().next_id
+        else:
+            next_id = last_id + 1
+        self._last_id = next_id
+        return next_id
+
+
+class IndexedRelationships(Relationships):
+    """
+    Relationships of a part, looked up by type and target in a dict instead
+    of comparing every relationship.
+    """
+
+    def add_relationship(self, reltype, target, rId, is_external=False):
+        rel = super().add_relationship(reltype, target, rId, is_external)
+        self._rels_by_target.setdefault((reltype, target, is_external), rel)
+        return rel
+
+    @property
+    def _rels_by_target(self):
+        # 類別替換後第一次使用時才建立索引
+        try:
+            return self.__rels_by_target
+        except AttributeError:
+            self.__rels_by_target = {}
+            for rel in self.values():
+                target = rel.target_ref if rel.is_external else rel.target_part
+                key = (rel.reltype, target, rel.is_external)
+                self.__rels_by_target.setdefault(key, rel)
+            return self.__rels_by_target
+
+    def _get_matching(self, reltype, target, is_external=False):
+        return self._rels_by_target.get((reltype, target, is_external))
+
+
+def index_document(document):
+    """
+    Make adding pictures to document take constant time per picture.
+    """
+    package = document.part.package
+    package._image_parts = IndexedImageParts(package.image_parts)
+    document.part.__class__ = IndexedDocumentPart
+    document.part.rels.__class__ = IndexedRelationships
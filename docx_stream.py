@@ -0,0 +1,186 @@
+import re
+import shutil
+import struct
+import tempfile
+from copy import copy
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED, sizeFileHeader
+from lxml import etree
+from docx.image.image import Image
+from docx.opc.constants import CONTENT_TYPE as CT
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml.ns import qn
+from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+from docx.opc.pkgwriter import _ContentTypesItem
+from docx.parts.image import ImagePart
+
+
+class _WrittenImagePart(ImagePart):
+    """
+    An image part whose blob is already written to the package. The hash and
+    image header are kept, so later pictures of the same image still share
+    the part.
+    """
+
+    @property
+    def sha1(self):
+        return self._sha1
+
+
+# 命名空間宣告 ex: xmlns:w="http://..."
+NAMESPACE_DECLARATION = re.compile(rb' xmlns:(\w+)="([^"]*)"')
+
+# 已經壓縮過的圖片格式, 再壓縮幾乎不會變小, 只會花時間
+STORED_CONTENT_TYPES = {CT.JPEG, CT.PNG, CT.GIF}
+
+
+class StreamingDocxWriter:
+    """
+    Write a python-docx document to a .docx file while it's being built.
+
+    flush() writes the new image parts and the finished body content to the
+    file and releases them from memory, close() writes the document body and
+    the remaining parts. The document can't be saved again afterwards.
+
+    source: the .docx file the document was opened from. Its image parts are
+    copied to file as they are, without compressing them again.
+    JPEG, PNG and GIF images are stored without compression.
+    """
+
+    def __init__(self, document, file, source=None):
+        self._document = document
+        self._zipf = ZipFile(file, "w", compression=ZIP_DEFLATED)
+        # 已完成的內文先寫入暫存檔, 關閉時才知道完整的 document.xml
+        self._body_file = tempfile.TemporaryFile()
+        self._source_zipf = None
+        self._source_image_parts = set()
+        if source is not None:
+            self._source_zipf = ZipFile(source)
+            self._source_image_parts = {
+                part
+                for part in document.part.package.image_parts
+                if part.partname.membername in self._source_zipf.NameToInfo
+            }
+        self._num_written_images = len(self._source_image_parts)
+
+    def flush(self):
+        image_parts = list(self._document.part.package.image_parts)
+        for part in image_parts[self._num_written_images :]:
+            self._write_part(part)
+            self._release(part)
+        self._num_written_images = len(image_parts)
+
+        body = self._document.element.body
+        for element in list(body):
+            if element.tag == qn("w:sectPr"):
+                continue
+            self._body_file.write(self._serialize(element))
+            body.remove(element)
+
+    def _serialize(self, element):
+        # 單獨序列化的元素會帶有根元素的命名空間宣告, 寫回文件時已不需要
+        xml = etree.tostring(element, encoding="utf-8")
+        tag_end = xml.index(b">")
+        root_nsmap = self._document.element.nsmap
+
+        def remove_declaration(match):
+            prefix, uri = match.group(1).decode(), match.group(2).decode()
+            return b"" if root_nsmap.get(prefix) == uri else match.group(0)
+
+        start_tag = NAMESPACE_DECLARATION.sub(remove_declaration, xml[:tag_end])
+        return start_tag + xml[tag_end:]
+
+    @staticmethod
+    def _release(part):
+        image = part.image
+        part._sha1 = part.sha1
+        part._image = Image(b"", image.filename, image._image_header)
+        part._blob = b""
+        part.__class__ = _WrittenImagePart
+
+    def _write_part(self, part):
+        if part.content_type in STORED_CONTENT_TYPES:
+            compress_type = ZIP_STORED
+        else:
+            compress_type = ZIP_DEFLATED
+        self._zipf.writestr(
+            part.partname.membername, part.blob, compress_type=compress_type
+        )
+
+    def close(self):
+        self.flush()
+        self._write_package()
+
+    def save(self):
+        """
+        Write the whole document to file without releasing anything, like
+        Document.save(). Use it instead of flush() and close().
+        """
+        try:
+            self._write_package()
+        except BaseException:
+            self.abort()
+            raise
+
+    def _write_package(self):
+        package = self._document.part.package
+        document_part = self._document.part
+        parts = package.parts
+        for part in parts:
+            part.before_marshal()
+
+        self._zipf.writestr(
+            CONTENT_TYPES_URI.membername, _ContentTypesItem.from_parts(parts).blob
+        )
+        self._zipf.writestr(PACKAGE_URI.rels_uri.membername, package.rels.xml)
+        for part in parts:
+            if part is document_part:
+                self._write_document_part(part)
+            elif part in self._source_image_parts:
+                self._copy_source_member(part.partname.membername)
+            elif not isinstance(part, _WrittenImagePart):
+                self._write_part(part)
+            if len(part._rels):
+                self._zipf.writestr(part.partname.rels_uri.membername, part._rels.xml)
+
+        self._zipf.close()
+        self._close_files()
+
+    def _copy_source_member(self, membername):
+        # 直接複製已壓縮的資料, 不重新解壓縮及壓縮
+        info = self._source_zipf.getinfo(membername)
+        source_fp = self._source_zipf.fp
+        source_fp.seek(info.header_offset)
+        header = source_fp.read(sizeFileHeader)
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        source_fp.seek(info.header_offset + sizeFileHeader + name_length + extra_length)
+        data = source_fp.read(info.compress_size)
+
+        info = copy(info)
+        # 大小及 CRC 寫在檔頭, 不使用資料描述區
+        info.flag_bits &= ~0x08
+        info.extra = b""
+        info.header_offset = self._zipf.fp.tell()
+        self._zipf.fp.write(info.FileHeader())
+        self._zipf.fp.write(data)
+        self._zipf.filelist.append(info)
+        self._zipf.NameToInfo[info.filename] = info
+        self._zipf.start_dir = self._zipf.fp.tell()
+
+    def _close_files(self):
+        self._body_file.close()
+        if self._source_zipf is not None:
+            self._source_zipf.close()
+
+    def _write_document_part(self, part):
+        # 內文只剩 sectPr, 把暫存的內文插在 <w:body> 之後
+        xml = serialize_part_xml(part.element)
+        body_start = xml.index(b"<w:body>") + len(b"<w:body>")
+        self._body_file.seek(0)
+        with self._zipf.open(part.partname.membername, "w") as fp:
+            fp.write(xml[:body_start])
+            shutil.copyfileobj(self._body_file, fp)
+            fp.write(xml[body_start:])
+
+    def abort(self):
+        self._zipf.close()
+        self._close_files()
@@ -0,0 +1,141 @@
+import functools
+import io
+import os
+from copy import deepcopy
+import docx
+from docx.opc.part import XmlPart
+from docx.oxml.ns import qn
+from docx.package import Package
+from docx.parts.image import ImagePart
+from docx.shared import Cm, Pt
+from docx_index import index_document
+from docx_stream import StreamingDocxWriter
+
+TABLE_STYLE = "Table Grid"
+
+
+class ReportTemplate:
+    """
+    The base document of reports, parsed and styled once.
+
+    Without template_file python-docx's default template is used, with the
+    report margins and font. A template_file .docx keeps its own page
+    setup, styles, headers and footers, its body content is removed and the
+    table style of the report is added if it's missing.
+
+    document() returns a new document for a report. The parts a report
+    doesn't change, e.g. the styles, are shared with the template instead
+    of parsed or copied again.
+    """
+
+    def __init__(self, template_file=None):
+        self.template_file = template_file
+        document = docx.Document(template_file)
+        if template_file is None:
+            self._apply_report_style(document)
+        else:
+            self._clear_body(document)
+            self._add_table_style(document)
+        self._package = document.part.package
+        self._saved_size = None
+
+    @staticmethod
+    def _apply_report_style(document):
+        # 調整文件左右上下邊界至 1.27 cm
+        section = document.sections[0]
+        section.left_margin = Cm(1.27)
+        section.right_margin = Cm(1.27)
+        section.top_margin = Cm(1.27)
+        section.bottom_margin = Cm(1.27)
+
+        # 設定字型及大小
+        style = document.styles["Normal"]
+        style.font.name = "標楷體"
+        style._element.rPr.rFonts.set(qn("w:eastAsia"), "標楷體")
+        style.font.size = Pt(20)
+
+    @staticmethod
+    def _clear_body(document):
+        # 保留最後的 sectPr, 即範本的版面設定
+        body = document.element.body
+        for element in list(body):
+            if element.tag != qn("w:sectPr"):
+                body.remove(element)
+
+    @staticmethod
+    def _add_table_style(document):
+        styles = document.styles
+        if any(style.name == TABLE_STYLE for style in styles):
+            return
+        default_style = docx.Document().styles[TABLE_STYLE]
+        styles.element.append(deepcopy(default_style.element))
+
+    def document(self):
+        """
+        Return a new document based on the template.
+        """
+        package = Package()
+        copies = {}
+
+        def copy_part(part):
+            if part in copies:
+                return copies[part]
+            # 報告只會修改主文件及加入圖片, 其他沒有關聯的部分直接共用
+            is_main = part is self._package.main_document_part
+            if not is_main and not isinstance(part, ImagePart) and not len(part.rels):
+                copies[part] = part
+                return part
+            if isinstance(part, XmlPart):
+                part_copy = type(part)(
+                    part.partname, part.content_type, deepcopy(part.element), package
+                )
+            else:
+                part_copy = type(part).load(
+                    part.partname, part.content_type, part.blob, package
+                )
+            copies[part] = part_copy
+            for rel in part.rels.values():
+                target = (
+                    rel.target_ref if rel.is_external else copy_part(rel.target_part)
+                )
+                part_copy.load_rel(rel.reltype, target, rel.rId, rel.is_external)
+            return part_copy
+
+        for rel in self._package.rels.values():
+            target = rel.target_ref if rel.is_external else copy_part(rel.target_part)
+            package.load_rel(rel.reltype, target, rel.rId, rel.is_external)
+        package.after_unmarshal()
+
+        document = package.main_document_part.document
+        index_document(document)
+        return document
+
+    def saved_size(self):
+        """
+        Return the bytes of a report without pages saved from the template,
+        written like reports are, see StreamingDocxWriter.
+        """
+        if self._saved_size is None:
+            output = io.BytesIO()
+            # Document.save() 會壓縮範本中的圖片, 報告則是直接儲存
+            StreamingDocxWriter(self.document(), output).save()
+            self._saved_size = output.tell()
+        return self._saved_size
+
+
+@functools.lru_cache(maxsize=8)
+def _load_template(template_file, signature):
+    return ReportTemplate(template_file)
+
+
+def report_template(template_file=None):
+    """
+    Return the ReportTemplate of template_file, or of the default template.
+    Templates are kept per process and loaded again when the file changed.
+    """
+    signature = None
+    if template_file is not None:
+        template_file = os.path.abspath(template_file)
+        stat = os.stat(template_file)
+        signature = (stat.st_size, stat.st_mtime_ns)
+    return _load_template(template_file, signature)
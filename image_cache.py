@@ -0,0 +1,178 @@
+import hashlib
+import itertools
+import os
+import tempfile
+import time
+
+
+class ImageCache:
+    """
+    On-disk cache of prepared image bytes, keyed by the content hash of the
+    source file and the processing parameters. The least recently used
+    entries are evicted when the cache grows over max_bytes.
+
+    Entries are written to a temporary file and renamed into place, so
+    several processes can share one cache directory. Entries that can't be
+    read, written or removed, e.g. on Windows while another process has
+    them open, are treated as missing instead of failing the report.
+
+    The total size is approximate. It is kept in a size file in the cache
+    directory that every put reads and updates without a lock, so copies
+    of the cache in worker processes never scan the directory on their
+    first put. Concurrent puts may lose each other's updates, letting the
+    cache grow over max_bytes; the directory is rescanned, correcting the
+    size file, every rescan_interval seconds and on each eviction.
+    """
+
+    suffix = ".img"
+    size_file = "size"
+    rescan_interval = 300
+
+    def __init__(self, directory, max_bytes=1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def file_hash(file_path):
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def make_key(self, file_path, *params, file_hash=None):
+        # file_hash: 已知的檔案內容雜湊, 省下再讀一次檔案
+        if file_hash is None:
+            file_hash = self.file_hash(file_path)
+        key = f"{file_hash}:{params!r}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, "rb") as fp:
+                data = fp.read()
+            # 更新修改時間, 作為最近使用的紀錄
+            os.utime(entry_path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key, data):
+        entry_path = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(entry_path), suffix=".tmp"
+            )
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            # 如 Windows 上其他行程正開啟同一個項目, 不放入快取
+            self._remove(tmp_path)
+            return
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+        size, scanned_at = self._read_size()
+        if size is None or time.time() - scanned_at > self.rescan_interval:
+            # 掃描結果已包含剛寫入的項目
+            size, scanned_at = self._scan_size(), time.time()
+        else:
+            size += len(data)
+        self._write_size(size, scanned_at)
+        if size > self.max_bytes:
+            self.evict()
+
+    def _read_size(self):
+        # 大小檔內容: "<位元組數> <上次掃描的時間>"
+        try:
+            with open(os.path.join(self.directory, self.size_file)) as fp:
+                size, scanned_at = fp.read().split()
+            return int(size), float(scanned_at)
+        except (OSError, ValueError):
+            return None, 0.0
+
+    def _write_size(self, size, scanned_at):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                fp.write(f"{size} {scanned_at}")
+            os.replace(tmp_path, os.path.join(self.directory, self.size_file))
+        except OSError:
+            # 大小檔只是估計值 (如 Windows 上檔案正被讀取), 下次再寫
+            self._remove(tmp_path)
+
+    def _iter_entries(self):
+        for sub_dir in os.scandir(self.directory):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                yield entry
+
+    def _scan_size(self):
+        size = 0
+        for entry in self._iter_entries():
+            try:
+                size += entry.stat().st_size
+            except FileNotFoundError:
+                pass
+        return size
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is below 90% of
+        max_bytes. Entries removed by other processes meanwhile are skipped.
+        Temporary files left by interrupted writes over an hour ago, of
+        entries or of the size file, are removed.
+        """
+        entries = []
+        now = time.time()
+        # 大小檔的暫存檔在快取目錄下, 項目的暫存檔在各子目錄下
+        root_temp_files = (
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(".tmp") and entry.is_file()
+        )
+        for entry in itertools.chain(root_temp_files, self._iter_entries()):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith(".tmp"):
+                # 清除中斷的寫入留下的暫存檔
+                if now - stat.st_mtime > 3600:
+                    self._remove(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(entry[1] for entry in entries)
+        limit = self.max_bytes * 0.9
+        for _, entry_size, entry_path in sorted(entries):
+            if size <= limit:
+                break
+            self._remove(entry_path)
+            size -= entry_size
+        self._write_size(size, time.time())
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            # 已被其他行程刪除, 或 Windows 上正被開啟, 留待下次清除
+            pass
+
+    def clear(self):
+        for entry in self._iter_entries():
+            self._remove(entry.path)
+        self._write_size(0, time.time())
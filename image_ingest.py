@@ -0,0 +1,156 @@
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from image_cache import ImageCache
+from image_metadata import read_image_metadata
+
+logger = logging.getLogger(__name__)
+
+# 檔頭特徵, 只收報告能嵌入的格式
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+]
+SIGNATURE_LENGTH = max(len(signature) for signature, _ in IMAGE_SIGNATURES)
+
+# 每個工作檢查的檔案數
+INSPECT_BATCH_SIZE = 32
+
+
+def detect_image_format(file_path):
+    """
+    Return the image format of file_path from its first bytes, or None if
+    it isn't an image.
+    """
+    try:
+        with open(file_path, "rb") as fp:
+            header = fp.read(SIGNATURE_LENGTH)
+    except OSError:
+        return None
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+def _scan_directory(directory):
+    files = []
+    sub_directories = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        sub_directories.append(entry.path)
+                    elif entry.is_file():
+                        files.append(entry.path)
+                except OSError:
+                    continue
+    except OSError as e:
+        logger.warning("Can't read directory %s: %s", directory, e)
+    return files, sub_directories
+
+
+def _inspect_files(file_paths):
+    images = []
+    for file_path in file_paths:
+        if detect_image_format(file_path) is None:
+            continue
+        metadata = read_image_metadata(file_path)
+        if metadata is not None:
+            images.append((file_path, metadata))
+    return images
+
+
+def capture_time_key(item):
+    # 依拍攝時間排序, 沒有拍攝時間的照片排在最後, 再依檔名排序
+    file_path, metadata = item
+    datetime = (metadata["datetime"] or "").strip(" \x00")
+    if not datetime or datetime.startswith("0000"):
+        return (1, "", file_path)
+    return (0, datetime, file_path)
+
+
+def scan_images(directory, known_files=(), workers=None):
+    """
+    Find the images in the directory tree, sorted by capture time.
+
+    Directories are listed and files are inspected by a pool of threads.
+    Files are recognized by their first bytes, not their extension. Files
+    in known_files, and files with the same content as an earlier one or as
+    one of known_files, are skipped. Only files of the same size are hashed.
+    Return a list of (file_path, metadata), metadata as returned by
+    read_image_metadata.
+    """
+    known_files = set(known_files)
+    images = []
+    with ThreadPoolExecutor(workers) as executor:
+        # 目錄及檔案一起放入執行緒池, 邊列目錄邊讀檔頭
+        directories = {executor.submit(_scan_directory, directory)}
+        inspections = []
+        num_files = 0
+        while directories:
+            done, directories = wait(directories, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, sub_directories = future.result()
+                for sub_directory in sub_directories:
+                    directories.add(executor.submit(_scan_directory, sub_directory))
+                num_files += len(files)
+                files = [path for path in files if path not in known_files]
+                for i in range(0, len(files), INSPECT_BATCH_SIZE):
+                    batch = files[i : i + INSPECT_BATCH_SIZE]
+                    inspections.append(executor.submit(_inspect_files, batch))
+
+        for future in inspections:
+            images.extend(future.result())
+        images.sort(key=capture_time_key)
+
+        # 大小相同的檔案才可能重複, 只計算這些檔案的雜湊值
+        paths_by_size = defaultdict(list)
+        for file_path in known_files:
+            try:
+                paths_by_size[os.path.getsize(file_path)].append(file_path)
+            except OSError:
+                continue
+        for file_path, metadata in images:
+            paths_by_size[metadata["file_size"]].append(file_path)
+        hash_paths = [
+            file_path
+            for paths in paths_by_size.values()
+            if len(paths) > 1
+            for file_path in paths
+        ]
+        file_hashes = dict(zip(hash_paths, executor.map(_file_hash, hash_paths)))
+
+    seen_hashes = {file_hashes.get(file_path) for file_path in known_files}
+    seen_hashes.discard(None)
+    unique_images = []
+    for file_path, metadata in images:
+        file_hash = file_hashes.get(file_path)
+        if file_hash is not None:
+            if file_hash in seen_hashes:
+                continue
+            seen_hashes.add(file_hash)
+        unique_images.append((file_path, metadata))
+
+    logger.info(
+        "Found %d images in %d files under %s, %d duplicates skipped",
+        len(unique_images),
+        num_files,
+        directory,
+        len(images) - len(unique_images),
+    )
+    return unique_images
+
+
+def _file_hash(file_path):
+    try:
+        return ImageCache.file_hash(file_path)
+    except OSError:
+        return None
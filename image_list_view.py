@@ -0,0 +1,236 @@
+import os
+import tkinter as tk
+from preview_cache import PreviewCache
+
+# 縮圖大小及快取上限
+THUMBNAIL_WIDTH = 64
+THUMBNAIL_HEIGHT = 48
+THUMBNAIL_CACHE_MAX_BYTES = 32 * 1024**2
+
+ROW_PADDING = 4
+SELECTED_COLOR = "#cce4f7"
+
+
+class ImageListView(tk.Canvas):
+    """
+    A list of images with thumbnails and drag'n'drop reordering of entries.
+
+    The entries aren't copied into the widget. get_count() returns the
+    number of entries and get_file_path(index) the file path of an entry,
+    only the visible rows are drawn. When an entry is dragged
+    on_move(file_path, new_index) is called, which must move it in the
+    model. Call refresh() after entries are added or removed.
+    """
+
+    row_height = THUMBNAIL_HEIGHT + 2 * ROW_PADDING
+
+    def __init__(
+        self,
+        master,
+        get_count,
+        get_file_path,
+        on_move=None,
+        yscrollcommand=None,
+        **kw,
+    ):
+        kw.setdefault("bg", "white")
+        kw.setdefault("highlightthickness", 0)
+        tk.Canvas.__init__(self, master, kw)
+        self._get_count = get_count
+        self._get_file_path = get_file_path
+        self._on_move = on_move
+        self._yscrollcommand = yscrollcommand
+        self._thumbnails = PreviewCache(
+            THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, THUMBNAIL_CACHE_MAX_BYTES
+        )
+        # 只保留可見列的 PhotoImage
+        self._photos = {}
+        # 每個可見列的畫布物件, 捲動時重複使用
+        self._rows = []
+        self._top = 0
+        self._cur_index = None
+        self._redraw_pending = False
+
+        self.bind("<Configure>", lambda event: self.refresh())
+        self.bind("<Button-1>", self._click)
+        self.bind("<B1-Motion>", self._drag)
+        self.bind("<MouseWheel>", self._wheel)
+        self.bind("<Button-4>", lambda event: self.yview("scroll", -3, "units"))
+        self.bind("<Button-5>", lambda event: self.yview("scroll", 3, "units"))
+
+    @property
+    def curIndex(self):
+        return self._cur_index
+
+    @curIndex.setter
+    def curIndex(self, index):
+        self._cur_index = index
+        if index is not None:
+            self.see(index)
+        self._redraw()
+
+    def get(self, index):
+        return self._get_file_path(index)
+
+    def size(self):
+        return self._get_count()
+
+    def refresh(self):
+        """
+        Redraw the list after the entries in the model changed.
+        """
+        count = self._get_count()
+        if self._cur_index is not None and self._cur_index >= count:
+            self._cur_index = count - 1 if count else None
+        self._top = self._clamp_top(self._top)
+        self._redraw()
+
+    def see(self, index):
+        top = index * self.row_height
+        bottom = top + self.row_height
+        if top < self._top:
+            self._top = top
+        elif bottom > self._top + self._height():
+            self._top = self._clamp_top(bottom - self._height())
+
+    def yview(self, *args):
+        total_height = self._get_count() * self.row_height
+        if not args:
+            return self._view_fractions(total_height)
+        if args[0] == "moveto":
+            top = float(args[1]) * total_height
+        else:
+            amount = int(args[1])
+            if args[2] == "pages":
+                amount *= max(1, self._height() // self.row_height)
+            top = self._top + amount * self.row_height
+        self._top = self._clamp_top(top)
+        self._redraw()
+
+    def _height(self):
+        height = self.winfo_height()
+        # 尚未顯示時使用設定的高度
+        return height if height > 1 else int(self["height"])
+
+    def _clamp_top(self, top):
+        total_height = self._get_count() * self.row_height
+        return int(max(0, min(top, total_height - self._height())))
+
+    def _view_fractions(self, total_height):
+        if total_height <= 0:
+            return 0.0, 1.0
+        first = self._top / total_height
+        last = (self._top + self._height()) / total_height
+        return first, min(last, 1.0)
+
+    def _index_at(self, y):
+        return int((self._top + y) // self.row_height)
+
+    def _click(self, event):
+        self.focus_set()
+        index = self._index_at(event.y)
+        if index >= self._get_count():
+            return
+        self.curIndex = index
+        self.event_generate("<<ListboxSelect>>")
+
+    def _drag(self, event):
+        if self._cur_index is None:
+            return
+        # 拖曳到邊緣時捲動
+        if event.y < 0:
+            self.yview("scroll", -1, "units")
+        elif event.y > self._height():
+            self.yview("scroll", 1, "units")
+        count = self._get_count()
+        index = min(max(self._index_at(event.y), 0), count - 1)
+        if index == self._cur_index:
+            return
+        file_path = self._get_file_path(self._cur_index)
+        if self._on_move is not None:
+            self._on_move(file_path, index)
+        self.curIndex = index
+
+    def _wheel(self, event):
+        self.yview("scroll", -3 if event.delta > 0 else 3, "units")
+
+    def _redraw(self):
+        self._redraw_pending = False
+        height = self._height()
+        width = max(self.winfo_width(), int(self["width"]))
+        count = self._get_count()
+        first = self._top // self.row_height
+        num_rows = height // self.row_height + 2
+        while len(self._rows) < num_rows:
+            self._rows.append(self._create_row())
+
+        photos = {}
+        missing_paths = []
+        for i, row in enumerate(self._rows):
+            index = first + i
+            if i >= num_rows or index >= count:
+                for item in row:
+                    self.itemconfigure(item, state="hidden")
+                continue
+            file_path = self._get_file_path(index)
+            photo = self._photos.get(file_path)
+            if photo is None:
+                thumbnail = self._thumbnails.peek(file_path)
+                if thumbnail is None:
+                    missing_paths.append(file_path)
+                else:
+                    from PIL import ImageTk
+
+                    photo = ImageTk.PhotoImage(thumbnail)
+            if photo is not None:
+                photos[file_path] = photo
+            self._draw_row(row, index, file_path, photo, width)
+        self._photos = photos
+
+        if missing_paths:
+            # 先載入可見列, 再載入下一頁及上一頁
+            neighbors = [
+                self._get_file_path(index)
+                for index in range(first + num_rows, first + 2 * num_rows)
+                if index < count
+            ] + [
+                self._get_file_path(index)
+                for index in range(max(0, first - num_rows), first)
+            ]
+            self._thumbnails.prefetch(missing_paths + neighbors)
+            # 縮圖完成後再重畫, 無法讀取的檔案不會再載入
+            if self._thumbnails.is_prefetching() and not self._redraw_pending:
+                self._redraw_pending = True
+                self.after(50, self._redraw_if_pending)
+
+        if self._yscrollcommand is not None:
+            self._yscrollcommand(*self._view_fractions(count * self.row_height))
+
+    def _redraw_if_pending(self):
+        if self._redraw_pending:
+            self._redraw()
+
+    def _create_row(self):
+        return (
+            self.create_rectangle(0, 0, 0, 0, width=0),
+            self.create_image(0, 0, anchor=tk.W),
+            self.create_text(0, 0, anchor=tk.SW),
+            self.create_text(0, 0, anchor=tk.NW, fill="gray40"),
+        )
+
+    def _draw_row(self, row, index, file_path, photo, width):
+        background, image, name, directory = row
+        y = index * self.row_height - self._top
+        middle = y + self.row_height // 2
+        text_x = THUMBNAIL_WIDTH + 3 * ROW_PADDING
+        fill = SELECTED_COLOR if index == self._cur_index else ""
+        self.coords(background, 0, y, width, y + self.row_height)
+        self.itemconfigure(background, fill=fill, state="normal")
+        self.coords(image, ROW_PADDING, middle)
+        self.itemconfigure(image, image=photo or "", state="normal")
+        self.coords(name, text_x, middle)
+        self.itemconfigure(
+            name, text=f"{index + 1}. {os.path.basename(file_path)}", state="normal"
+        )
+        self.coords(directory, text_x, middle)
+        self.itemconfigure(directory, text=os.path.dirname(file_path), state="normal")
@@ -1,85 +1,533 @@
-from copy import deepcopy
-from report_controller import ReportController
+import functools
+import logging
+import os
+import queue
+import stat
+import tempfile
+import time
+from image_metadata import ImageMetadataIndex
+from image_ingest import scan_images
+from metrics import Metrics, LoggingSink
+from project_file import ProjectFile
+from project_store import ImageRecord, ImageStore, TIME_UNITS
 
+# docx, PIL 及 multiprocessing 載入較久, 為了加快 GUI 啟動, 用到時才載入
 
-class ImageManager:
-    data_template = {
-        "time": {
-            "year": "",
-            "month": "",
-            "day": "",
-            "hour": "",
-            "minute": "",
-            "second": "",
-        },
-        "use_image_time": False,
-        "rotate_image": False,
-    }
+logger = logging.getLogger(__name__)
 
-    def __init__(self):
-        self._report_title = ""
-        self._image_data = {}
 
-    def _sort_image_data(self, file_path_list):
-        sorted_image_date = []
-        for file_path in file_path_list:
-            image_data = self._image_data[file_path]
-            image_data["file_path"] = file_path
-            sorted_image_date.append(image_data)
+def generate_volume(
+    file_name,
+    image_data,
+    title,
+    metadata_index,
+    first_number,
+    streaming,
+    options,
+    progress_queue,
+    cancel_event,
+):
+    """
+    Generate one volume of a report, run in a separate process. A page count
+    is put to progress_queue after each page.
+    Return the file name and the Metrics of the volume.
+    """
+
+    def progress(finished_pages, num_pages):
+        progress_queue.put(1)
+
+    from report_controller import ReportController
+
+    # 各分冊分別計時, 由主行程合併後輸出
+    report_generator = ReportController(**options)
+    report_generator.set_data(image_data, title, metadata_index, first_number)
+    if streaming:
+        report_generator.generate_streaming(file_name, progress, cancel_event)
+    else:
+        report_generator.generate_doc(progress, cancel_event)
+        report_generator.save(file_name)
+    return file_name, report_generator.metrics
+
 
-        return sorted_image_date
+@functools.lru_cache(maxsize=None)
+def _umask():
+    # 讀取 umask 必須暫時修改它, 只讀一次, 避免與其他執行緒互相干擾
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def make_temp_file_name(file_name):
+    """
+    Return a new temporary file next to file_name, so it can be renamed to
+    file_name when finished. It has the permissions of file_name if it
+    exists, or those of a new file otherwise.
+    """
+    directory, base_name = os.path.split(os.path.abspath(file_name))
+    fd, temp_file_name = tempfile.mkstemp(
+        prefix=f".{base_name}.", suffix=".tmp", dir=directory
+    )
+    # mkstemp 建立的檔案只有擁有者可讀寫, 改名後會沿用
+    try:
+        mode = stat.S_IMODE(os.stat(file_name).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_umask()
+    try:
+        os.chmod(temp_file_name, mode)
+    finally:
+        os.close(fd)
+    return temp_file_name
+
+
+class ImageManager:
+    def __init__(self):
+        self._images = ImageStore()
+        self._metadata_index = ImageMetadataIndex()
+        # 保留已產生的頁面, 再次產生報告時只重建有變動的頁面, 第一次產生時才建立
+        self._page_cache = None
+        self._template_file = None
+
+    def _sort_image_data(self, file_path_list=None):
+        # 未指定時依專案中的順序
+        if file_path_list is None:
+            return list(self._images)
+        return [self._images[file_path] for file_path in file_path_list]
 
     def add_image(self, file_paths):
-        for path in file_paths:
-            data = deepcopy(self.data_template)
-            self._image_data[path] = data
-        print(f"Add images {self._image_data}")
+        """
+        Add images at the end, files already in the project are skipped.
+        Return the file paths added.
+        """
+        added_paths = [
+            path for path in file_paths if self._images.append(ImageRecord(path))
+        ]
+        self._metadata_index.add(added_paths)
+        logger.debug("Add images, %d images in total", len(self._images))
+        return added_paths
+
+    def add_folder(self, directory, workers=None):
+        """
+        Add the images found in the directory tree at the end, sorted by
+        capture time. Non-image files and images with the same content as
+        another one in the project are skipped, see scan_images.
+        Return the file paths added.
+        """
+        images = scan_images(directory, self._images.file_paths(), workers)
+        return self.add_scanned_images(images)
+
+    def add_scanned_images(self, images):
+        """
+        Add the (file_path, metadata) list returned by scan_images at the
+        end. Files already in the project are skipped.
+        Return the file paths added.
+        """
+        # 已讀取的資訊直接放入索引, 不必再讀一次
+        self._metadata_index.update(dict(images))
+        return self.add_image([file_path for file_path, _ in images])
 
     def delete_iamge(self, file_path):
-        del self._image_data[file_path]
-        print(f"Delete image {self._image_data}")
+        self._images.remove(file_path)
+        self._metadata_index.remove(file_path)
+        logger.debug("Delete image %s", file_path)
+
+    def move_image(self, file_path, index):
+        self._images.move(file_path, index)
+
+    def get_file_paths(self):
+        return self._images.file_paths()
+
+    def get_image_count(self):
+        return len(self._images)
+
+    def get_file_path(self, index):
+        return self._images.file_path_at(index)
 
     def get_image_info(self, file_path):
-        return self._image_data[file_path]
+        """
+        Return the ImageRecord of file_path.
+        """
+        return self._images[file_path]
+
+    def get_report_title(self):
+        return self._images.title
+
+    def open_project(self, file_path):
+        """
+        Open the project file file_path, created if it doesn't exist. Every
+        change afterwards is saved to the file at once.
+        """
+        self._set_images(ProjectFile(file_path))
+        logger.info("Open project %s with %d images", file_path, len(self._images))
+
+    def save_project(self, file_path):
+        """
+        Save the project to the project file file_path, replacing its content,
+        and keep saving every change to it.
+        """
+        project_file = ProjectFile(file_path)
+        project_file.replace(self._images)
+        project_file.set_title(self._images.title)
+        self._set_images(project_file)
+
+    def close_project(self):
+        """
+        Close the project file, the images are kept in memory only.
+        """
+        self._set_images(ImageStore(self._images, self._images.title))
+
+    def set_report_template(self, file_path=None):
+        """
+        Use the .docx file_path as the template of Word reports, or the
+        default template if None. Raise ValueError if it can't be read.
+        """
+        from docx_template import report_template
 
-    def generate_report(self, file_name, file_path_list):
-        report_generator = ReportController()
+        if file_path is not None:
+            try:
+                report_template(file_path)
+            except Exception as e:
+                raise ValueError(f"{file_path} is not a Word document") from e
+        self._template_file = file_path
+        # 已產生的頁面使用舊範本的樣式
+        if self._page_cache is not None:
+            self._page_cache.clear()
+
+    def warm_up(self):
+        """
+        Load the modules and the default template of reports ahead of the
+        first report, e.g. in a background thread once the GUI is shown.
+        """
+        import importlib
+        from PIL import Image
+        from docx_template import report_template
+
+        Image.init()
+        report_template()
+        importlib.import_module("pdf_report")
+
+    def _set_images(self, images):
+        self._images.close()
+        self._images = images
+        self._metadata_index.add(images.file_paths())
+
+    def clear_image_metadata(self):
+        """
+        Forget the metadata read from image headers, it's read again when
+        needed. E.g. between the jobs of a long-running service, so the
+        index doesn't keep every image it has seen.
+        """
+        self._metadata_index.clear()
+
+    def get_image_metadata(self, file_path):
+        """
+        Return capture time, size and orientation read from the image header,
+        or None if the file can't be read.
+        """
+        return self._metadata_index.get(file_path)
+
+    def generate_report(
+        self,
+        file_name,
+        file_path_list=None,
+        streaming=False,
+        max_pages=None,
+        max_bytes=None,
+        volume_processes=None,
+        progress=None,
+        cancel_event=None,
+        output_format=None,
+        **report_options,
+    ):
+        """
+        file_path_list: the images in report order, all images of the
+        project in their order if not given.
+        streaming: write the report while generating it to keep memory use
+        bounded, see ReportController.generate_streaming.
+        output_format: "docx" or "pdf", by default "pdf" if file_name ends
+        with .pdf. PDF reports are always streamed and can't be split into
+        volumes.
+        max_output_bytes in report_options: fit the report in this many
+        bytes by lowering the dpi and JPEG quality, Word reports only. When
+        the report is split into volumes, it is the limit of each volume.
+        OutputSizeExceeded is raised if it doesn't fit at the lowest settings.
+        max_pages, max_bytes: split the report into volumes of at most this
+        many pages or about this many bytes, generated in parallel processes,
+        at most os.cpu_count() at a time. The workers of report_options are
+        split between the volumes generated at the same time.
+        volume_processes: generate at most this many volumes at a time
+        instead, e.g. when several reports are generated at once.
+        progress: called as progress(finished_pages, num_pages).
+        cancel_event: a threading.Event to stop generating, the report is
+        then not written and GenerationCancelled is raised.
+        Pages unchanged since an earlier report of this ImageManager are
+        copied instead of rebuilt, if their pictures are in the image cache
+        of report_options or are embedded originals.
+        report_options are passed to ReportController, e.g. workers, cache or
+        metrics. The metrics record of the report is emitted to the sink of
+        metrics when finished, by default it is logged.
+        Return the list of generated file names.
+        """
+        from report_controller import ReportController
+        from pdf_report import PdfReportController
+
+        start_time = time.perf_counter()
+        if output_format is None:
+            is_pdf = str(file_name).lower().endswith(".pdf")
+            output_format = "pdf" if is_pdf else "docx"
+        report_options.setdefault("metrics", Metrics(LoggingSink()))
+        if output_format == "pdf":
+            if max_pages or max_bytes:
+                raise ValueError("PDF reports can't be split into volumes")
+            if report_options.get("max_output_bytes"):
+                raise ValueError("PDF reports don't support a size limit")
+            streaming = True
+            # PDF 報告不使用 Word 範本
+            report_options.pop("template_file", None)
+            report_generator = PdfReportController(**report_options)
+        else:
+            if self._page_cache is None:
+                from page_cache import PageCache
+
+                self._page_cache = PageCache()
+            report_options.setdefault("page_cache", self._page_cache)
+            report_options.setdefault("template_file", self._template_file)
+            report_generator = ReportController(**report_options)
+        metrics = report_generator.metrics
         sorted_image_date = self._sort_image_data(file_path_list)
 
-        print("===== Start tp Generate Report =====")
-        report_generator.set_data(sorted_image_date, self._report_title)
-        print("===== Generating Report =====")
-        report_generator.generate_doc()
-        print("===== Saving Report =====")
-        report_generator.save(file_name)
-        print("===== Generate Report Finished =====")
+        logger.info(
+            "Generating %s report %s with %d images",
+            output_format,
+            file_name,
+            len(sorted_image_date),
+        )
+        report_generator.set_data(
+            sorted_image_date, self._images.title, self._metadata_index
+        )
+        volumes = [(0, len(sorted_image_date))]
+        if max_pages or max_bytes:
+            volumes = report_generator.split_volumes(max_pages, max_bytes)
+
+        if len(volumes) > 1:
+            # 分冊檔名 ex: report.docx -> report_01.docx, report_02.docx
+            base_name, ext = os.path.splitext(os.fspath(file_name))
+            width = max(2, len(str(len(volumes))))
+            file_names = [
+                f"{base_name}_{i + 1:0{width}d}{ext}" for i in range(len(volumes))
+            ]
+        else:
+            file_names = [file_name]
+
+        # 先寫入暫存檔, 完成後才改名, 取消或失敗時不留下不完整的檔案
+        is_path = isinstance(file_name, (str, os.PathLike))
+        if is_path:
+            output_file_names = [make_temp_file_name(name) for name in file_names]
+        else:
+            output_file_names = file_names
+        try:
+            if len(volumes) > 1:
+                self._generate_volumes(
+                    output_file_names,
+                    sorted_image_date,
+                    volumes,
+                    streaming,
+                    report_options,
+                    volume_processes,
+                    progress,
+                    cancel_event,
+                    metrics,
+                )
+            elif streaming:
+                report_generator.generate_streaming(
+                    output_file_names[0], progress, cancel_event
+                )
+            else:
+                report_generator.generate_doc(progress, cancel_event)
+                report_generator.save(output_file_names[0])
+        except BaseException:
+            if is_path:
+                for output_file_name in output_file_names:
+                    os.unlink(output_file_name)
+            raise
+        if is_path:
+            for output_file_name, name in zip(output_file_names, file_names):
+                os.replace(output_file_name, name)
+
+        elapsed = time.perf_counter() - start_time
+        logger.info("Report %s finished in %.2fs", file_name, elapsed)
+        metrics.emit(
+            file_names=[os.fspath(name) if is_path else None for name in file_names],
+            volumes=len(volumes),
+            streaming=streaming,
+            output_format=output_format,
+            elapsed=round(elapsed, 6),
+        )
+        report_generator.clear()
+        return file_names
+
+    def append_report(
+        self,
+        file_name,
+        file_path_list=None,
+        progress=None,
+        cancel_event=None,
+        **report_options,
+    ):
+        """
+        Add the images of file_path_list, or all images of the project, to
+        the end of the report file_name made by generate_report, continuing
+        its photo numbers. Only the new
+        images are processed, the existing pages are copied as they are.
+        progress, cancel_event and report_options are the same as in
+        generate_report.
+        """
+        from report_controller import ReportController
+
+        start_time = time.perf_counter()
+        if report_options.get("max_output_bytes"):
+            raise ValueError("A size limit can't be used when appending to a report")
+        report_options.setdefault("metrics", Metrics(LoggingSink()))
+        report_generator = ReportController(**report_options)
+        metrics = report_generator.metrics
+        sorted_image_date = self._sort_image_data(file_path_list)
+
+        logger.info(
+            "Appending %d images to report %s", len(sorted_image_date), file_name
+        )
+        report_generator.set_data(
+            sorted_image_date, self._images.title, self._metadata_index
+        )
+        output_file_name = make_temp_file_name(file_name)
+        try:
+            report_generator.generate_append(
+                file_name, output_file_name, progress, cancel_event
+            )
+        except BaseException:
+            os.unlink(output_file_name)
+            raise
+        os.replace(output_file_name, file_name)
+
+        elapsed = time.perf_counter() - start_time
+        logger.info("Report %s appended in %.2fs", file_name, elapsed)
+        metrics.emit(
+            file_names=[os.fspath(file_name)],
+            appended=True,
+            elapsed=round(elapsed, 6),
+        )
         report_generator.clear()
+        return file_name
+
+    def _generate_volumes(
+        self,
+        file_names,
+        sorted_image_date,
+        volumes,
+        streaming,
+        report_options,
+        volume_processes,
+        progress,
+        cancel_event,
+        metrics,
+    ):
+        from concurrent.futures import ProcessPoolExecutor, wait
+        from report_controller import GenerationCancelled, process_context
 
-    def export_data(self, file_path_list):
+        # 同時產生的分冊數不超過 CPU 數, 各分冊平分 workers, 避免每個分冊
+        # 各自建立 workers 個行程而使行程數相乘
+        volume_workers = min(len(volumes), volume_processes or os.cpu_count() or 1)
+        workers = max(1, report_options.get("workers", 1) // volume_workers)
+        logger.info(
+            "Generating report in %d volumes, %d at a time with %d workers each",
+            len(volumes),
+            volume_workers,
+            workers,
+        )
+        # 分冊在其他行程產生, 不傳遞頁面快取; metrics 的 sink 不一定能 pickle,
+        # 分冊的計時回傳後合併到 metrics
+        report_options = {
+            key: value for key, value in report_options.items() if key != "metrics"
+        }
+        report_options.update(page_cache=None, workers=workers)
+        num_pages = sum((count + 1) // 2 for _, count in volumes)
+        finished_pages = 0
+        context = process_context()
+        with context.Manager() as manager, ProcessPoolExecutor(
+            max_workers=volume_workers, mp_context=context
+        ) as executor:
+            # 進度及取消透過 manager 在行程間傳遞
+            progress_queue = manager.Queue()
+            volume_cancel_event = manager.Event()
+            futures = [
+                executor.submit(
+                    generate_volume,
+                    volume_file_name,
+                    sorted_image_date[start_index : start_index + count],
+                    self._images.title,
+                    self._metadata_index,
+                    start_index + 1,
+                    streaming,
+                    report_options,
+                    progress_queue,
+                    volume_cancel_event,
+                )
+                for volume_file_name, (start_index, count) in zip(file_names, volumes)
+            ]
+            try:
+                not_done = futures
+                while not_done:
+                    _, not_done = wait(not_done, timeout=0.1)
+                    while True:
+                        try:
+                            progress_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        finished_pages += 1
+                        if progress is not None:
+                            progress(finished_pages, num_pages)
+                    if cancel_event is not None and cancel_event.is_set():
+                        volume_cancel_event.set()
+                for future in futures:
+                    file_name, volume_metrics = future.result()
+                    metrics.merge(volume_metrics)
+                    logger.info("Volume %s finished", file_name)
+                # 取消前分冊可能已全部完成, 仍然不留下報告
+                if cancel_event is not None and cancel_event.is_set():
+                    raise GenerationCancelled()
+            except BaseException:
+                volume_cancel_event.set()
+                raise
+
+    def export_data(self, file_path_list=None):
         sorted_image_date = self._sort_image_data(file_path_list)
-        return sorted_image_date
+        return [record.to_dict() for record in sorted_image_date]
 
     def import_data(self, import_data):
-        organized_image_data = {}
+        records = []
         try:
             for data in import_data:
-                tmp_data = {}
-                for key in data:
-                    if key in ["time", "use_image_time", "rotate_image"]:
-                        tmp_data[key] = data[key]
-                organized_image_data[data["file_path"]] = tmp_data
+                records.append(ImageRecord.from_dict(data))
         except:
-            print("Import data format error")
-        self._image_data = organized_image_data
+            logger.error("Import data format error")
+        # 已開啟專案檔時一併寫入專案檔
+        self._images.replace(records)
+        self._metadata_index.add(self._images.file_paths())
 
     def update_time(self, file_path, time_unit, value):
-        self._image_data[file_path]["time"][time_unit] = value
+        if time_unit not in TIME_UNITS:
+            raise ValueError(f"Unknown time unit {time_unit}")
+        self._images.update(file_path, time_unit, value)
 
     def update_use_image_time(self, file_path, value):
-        self._image_data[file_path]["use_image_time"] = value
+        self._images.update(file_path, "use_image_time", value)
+
+    def update_all_use_image_time(self, value):
+        self._images.set_all("use_image_time", value)
 
     def update_report_title(self, title):
-        self._report_title = title
+        self._images.set_title(title)
 
     def update_rotate_image(self, file_path, value):
-        self._image_data[file_path]["rotate_image"] = value
+        self._images.update(file_path, "rotate_image", value)
+
+    def update_all_rotate_image(self, value):
+        self._images.set_all("rotate_image", value)
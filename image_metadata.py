@@ -0,0 +1,185 @@
+import os
+import queue
+import threading
+
+# EXIF 標籤
+EXIF_IFD = 0x8769
+ORIENTATION = 274
+DATETIME_ORIGINAL = 36867
+
+
+def read_image_metadata(file_path):
+    """
+    Read capture time, size, orientation and file size from the image
+    header, the pixels are not decoded. Return None if the file can't be read.
+    """
+    from PIL import Image
+
+    try:
+        file_size = os.path.getsize(file_path)
+        with Image.open(file_path) as img:
+            width, height = img.size
+            exif = img.getexif()
+            datetime = exif.get_ifd(EXIF_IFD).get(DATETIME_ORIGINAL)
+            orientation = exif.get(ORIENTATION, 1)
+    except Exception:
+        return None
+
+    return {
+        "datetime": datetime,
+        "width": width,
+        "height": height,
+        "orientation": orientation,
+        "file_size": file_size,
+    }
+
+
+def format_exif_datetime(exif_datetime):
+    # EXIF 時間轉為民國年 ex:2019:09:29 17:12:17 -> 108年09月29日17時12分17秒
+    try:
+        date = exif_datetime.split(" ")[0].split(":")
+        time = exif_datetime.split(" ")[1].split(":")
+        return "{}年{}月{}日{}時{}分{}秒".format(
+            str(int(date[0]) - 1911),
+            date[1],
+            date[2],
+            time[0],
+            time[1],
+            time[2],
+        )
+    except Exception:
+        return "年月日時分秒"
+
+
+def file_signature(file_path):
+    """
+    Return (size, modification time) of file_path, None if it can't be read.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ImageMetadataIndex:
+    """
+    Image metadata by file path. Added files are read by a background
+    thread, get() reads a file right away if it hasn't been read yet or if
+    its size or modification time changed since it was read. The thread
+    ends when all added files are read.
+    """
+
+    def __init__(self, metadata=None):
+        # 檔案路徑 -> (檔案簽章, 資訊), 簽章不符時重新讀取
+        self._metadata = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        # clear() 後遞增, 清除前開始讀取的結果不再存入
+        self._generation = 0
+        if metadata:
+            self.update(metadata)
+
+    def __reduce__(self):
+        # 只傳遞已讀取的資料, 例如給其他行程使用
+        with self._lock:
+            entries = dict(self._metadata)
+        return _restore_index, (entries,)
+
+    def add(self, file_paths):
+        for file_path in file_paths:
+            self._queue.put(file_path)
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def update(self, metadata):
+        """
+        Add metadata already read, a dict by file path.
+        """
+        entries = {
+            file_path: (file_signature(file_path), file_metadata)
+            for file_path, file_metadata in metadata.items()
+        }
+        with self._lock:
+            self._metadata.update(entries)
+
+    def remove(self, file_path):
+        with self._lock:
+            self._metadata.pop(file_path, None)
+
+    def clear(self):
+        """
+        Forget all metadata, files added but not read yet aren't read.
+        """
+        with self._lock:
+            self._metadata.clear()
+            self._generation += 1
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._queue.task_done()
+
+    def get(self, file_path):
+        signature = file_signature(file_path)
+        metadata = self._get_current(file_path, signature)
+        if metadata is not False:
+            return metadata
+
+        metadata = read_image_metadata(file_path)
+        with self._lock:
+            self._metadata[file_path] = (signature, metadata)
+        return metadata
+
+    def _get_current(self, file_path, signature):
+        # 回傳仍然有效的資訊, 沒有或已過期時回傳 False
+        with self._lock:
+            entry = self._metadata.get(file_path)
+        if entry is None or signature is None or entry[0] != signature:
+            return False
+        return entry[1]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                file_path: file_metadata
+                for file_path, (_, file_metadata) in self._metadata.items()
+            }
+
+    def wait(self):
+        """
+        Block until all added files have been read.
+        """
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            # 佇列清空時結束執行緒, 之後 add() 再啟動新的
+            with self._lock:
+                try:
+                    file_path = self._queue.get_nowait()
+                except queue.Empty:
+                    self._thread = None
+                    return
+                generation = self._generation
+            try:
+                signature = file_signature(file_path)
+                if self._get_current(file_path, signature) is not False:
+                    continue
+                metadata = read_image_metadata(file_path)
+                with self._lock:
+                    if self._generation == generation:
+                        self._metadata[file_path] = (signature, metadata)
+            finally:
+                self._queue.task_done()
+
+
+def _restore_index(entries):
+    index = ImageMetadataIndex()
+    index._metadata = entries
+    return index
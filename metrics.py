@@ -0,0 +1,98 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Time spent per phase and counters of one report. Timers only add up
+    perf_counter differences, the sink gets a single record from emit(), so
+    it can be left on in production.
+
+    sink: a callable taking the record dict, e.g. LoggingSink or
+    JsonLinesSink. Must be picklable to be used in worker processes.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.timings = {}
+        self.calls = {}
+        self.counters = {}
+
+    @contextmanager
+    def timer(self, phase):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start_time)
+
+    def add_time(self, phase, seconds, calls=1):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, other):
+        """
+        Add the timings and counters of other, e.g. from a worker process.
+        """
+        for phase, seconds in other.timings.items():
+            self.add_time(phase, seconds, other.calls[phase])
+        for name, value in other.counters.items():
+            self.count(name, value)
+
+    def record(self, **fields):
+        record = dict(fields)
+        record["phases"] = {
+            phase: {"seconds": round(seconds, 6), "calls": self.calls[phase]}
+            for phase, seconds in self.timings.items()
+        }
+        record["counters"] = dict(self.counters)
+        return record
+
+    def emit(self, **fields):
+        if self.sink is not None:
+            self.sink(self.record(**fields))
+
+
+class LoggingSink:
+    """
+    Log every record as one line.
+    """
+
+    def __init__(self, logger_name=__name__, level=logging.INFO):
+        self.logger_name = logger_name
+        self.level = level
+
+    def __call__(self, record):
+        phases = ", ".join(
+            f"{phase} {value['seconds']:.3f}s"
+            for phase, value in record["phases"].items()
+        )
+        counters = ", ".join(
+            f"{name} {value}" for name, value in record["counters"].items()
+        )
+        logging.getLogger(self.logger_name).log(
+            self.level, "Report metrics: %s | %s", phases, counters
+        )
+
+
+class JsonLinesSink:
+    """
+    Append every record as one JSON line to file_path.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def __call__(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        # 以單次 append 寫入, 多個行程同時寫入也不會交錯
+        with self._lock, open(self.file_path, "a", encoding="utf-8") as fp:
+            fp.write(line)
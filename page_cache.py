@@ -0,0 +1,64 @@
+import os
+from collections import OrderedDict
+from copy import deepcopy
+from lxml import etree
+from image_cache import ImageCache
+
+
+class PageCache:
+    """
+    Least recently used cache of built report pages, keyed by a fingerprint
+    of everything the page shows. A page holds its XML elements and the
+    sources of its pictures in the order of the pictures in the XML,
+    ("cache", key) of a picture in an ImageCache or ("file", path) of an
+    embedded original. The picture bytes aren't kept in memory.
+    """
+
+    def __init__(self, max_bytes=512 * 1024**2):
+        self._max_bytes = max_bytes
+        self._pages = OrderedDict()
+        self._size = 0
+        self._file_hashes = {}
+
+    def file_hash(self, file_path):
+        """
+        Return the content hash of file_path. The hash is computed again only
+        when the size or modification time of the file changed.
+        """
+        stat = os.stat(file_path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = self._file_hashes.get(file_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        file_hash = ImageCache.file_hash(file_path)
+        self._file_hashes[file_path] = (signature, file_hash)
+        return file_hash
+
+    def get(self, fingerprint):
+        """
+        Return (elements, sources) of the page, or None if it isn't cached.
+        The elements must be copied before they're inserted in a document.
+        """
+        page = self._pages.get(fingerprint)
+        if page is None:
+            return None
+        self._pages.move_to_end(fingerprint)
+        elements, sources, _ = page
+        return elements, sources
+
+    def put(self, fingerprint, elements, sources):
+        if fingerprint in self._pages:
+            return
+        # 複製一份, 不受文件之後的修改影響
+        elements = [deepcopy(element) for element in elements]
+        size = sum(len(etree.tostring(element)) for element in elements)
+        self._pages[fingerprint] = (elements, sources, size)
+        self._size += size
+        while self._size > self._max_bytes and len(self._pages) > 1:
+            _, (_, _, old_size) = self._pages.popitem(last=False)
+            self._size -= old_size
+
+    def clear(self):
+        self._pages.clear()
+        self._size = 0
+        self._file_hashes.clear()
@@ -0,0 +1,511 @@
+import io
+import os
+import zlib
+from collections import deque
+from PIL import Image
+from image_metadata import ImageMetadataIndex
+from metrics import Metrics
+from report_controller import (
+    PICTURE_HEIGHT,
+    ROW_HEIGHTS_CM,
+    GenerationCancelled,
+    create_process_pool,
+    encode_jpeg,
+    format_image_time,
+    prepare_image_data,
+)
+
+# 長度單位為 point
+CM = 72 / 2.54
+
+# 與 docx 報告相同的版面: Letter 紙張, 邊界 1.27 cm
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+MARGIN = 1.27 * CM
+TITLE_FONT_SIZE = 20
+TEXT_FONT_SIZE = 12
+COLUMN_WIDTHS = [2.6 * CM, 9.0 * CM, 2.6 * CM, 4.76 * CM]
+ROW_HEIGHTS = [height * CM for height in ROW_HEIGHTS_CM]
+CELL_MARGIN = 0.19 * CM
+PICTURE_HEIGHT_PT = PICTURE_HEIGHT.pt
+TITLE_LINE_HEIGHT = TITLE_FONT_SIZE * 1.4
+# 標題換行後, 超過兩張照片的表格以外的空間就截斷
+MAX_TITLE_LINES = int(
+    (PAGE_HEIGHT - 2 * MARGIN - 2 * sum(ROW_HEIGHTS)) // TITLE_LINE_HEIGHT
+)
+
+# 不嵌入字型, 使用 PDF 閱讀器內建的繁體中文字型
+FONT_NAME = "MSung-Light"
+FONT_ENCODING = "UniCNS-UCS2-H"
+
+
+def text_width(text, font_size):
+    # 半形字元寬 500, 其他字元寬 1000 (單位為字級的千分之一)
+    return sum(500 if ord(char) < 128 else 1000 for char in text) * font_size / 1000
+
+
+def wrap_title(title, max_width):
+    """
+    Split title into lines at most max_width wide, like Word wraps the
+    title paragraph. Half-width words are kept whole when possible. Lines
+    beyond MAX_TITLE_LINES are cut, the last line then ends with "…".
+    """
+    lines = []
+    line = ""
+    for char in title:
+        if not line or text_width(line + char, TITLE_FONT_SIZE) <= max_width:
+            line += char
+            continue
+        # 在半形單字中間換行時, 改從前一個空白換行
+        break_index = line.rfind(" ") + 1
+        if char == " " or ord(char) >= 128 or ord(line[-1]) >= 128:
+            break_index = 0
+        if break_index:
+            lines.append(line[:break_index].rstrip())
+            line = line[break_index:] + char
+        else:
+            lines.append(line.rstrip())
+            line = char.lstrip()
+    if line:
+        lines.append(line)
+
+    if len(lines) > MAX_TITLE_LINES:
+        lines = lines[:MAX_TITLE_LINES]
+        last_line = lines[-1] + "…"
+        while text_width(last_line, TITLE_FONT_SIZE) > max_width:
+            last_line = last_line[:-2] + "…"
+        lines[-1] = last_line
+    return lines
+
+
+def pdf_text(text):
+    return b"<" + text.encode("utf-16-be").hex().upper().encode() + b">"
+
+
+def _text_op(text, x, y, font_size, char_spacing=0):
+    return b"BT /F1 %d Tf %.2f Tc %.2f %.2f Td %s Tj ET\n" % (
+        font_size,
+        char_spacing,
+        x,
+        y,
+        pdf_text(text),
+    )
+
+
+def _cell_text(text, left, width, bottom, height, align):
+    """
+    Return the operators drawing text vertically centered in a cell,
+    aligned "left" or "distribute" like the docx paragraphs.
+    """
+    baseline = bottom + height / 2 - TEXT_FONT_SIZE * 0.35
+    x = left + CELL_MARGIN
+    available = width - 2 * CELL_MARGIN
+    char_spacing = 0
+    if align == "distribute" and len(text) > 1:
+        char_spacing = (available - text_width(text, TEXT_FONT_SIZE)) / (len(text) - 1)
+    return _text_op(text, x, baseline, TEXT_FONT_SIZE, char_spacing)
+
+
+def load_jpeg(picture, quality):
+    """
+    Return (jpeg_bytes, width, height, color_space) of a prepared picture,
+    image bytes or the path of an original file. JPEGs PDF can show as they
+    are aren't encoded again.
+    """
+    if isinstance(picture, bytes):
+        data = picture
+    else:
+        with open(picture, "rb") as fp:
+            data = fp.read()
+    img = Image.open(io.BytesIO(data))
+    if img.format != "JPEG" or img.mode not in ("RGB", "L"):
+        data = encode_jpeg(img, quality)
+        img = Image.open(io.BytesIO(data))
+    color_space = "DeviceGray" if img.mode == "L" else "DeviceRGB"
+    return data, img.width, img.height, color_space
+
+
+def compose_page(title, slots, dpi, quality, rotate_in_xml, cache):
+    """
+    Prepare the images of one page and draw it, run in a worker process.
+    slots: list of (image_data, datetime, number) of the upper and lower
+    photo.
+    Return (content, images, metrics): the content stream of the page and
+    (jpeg_bytes, width, height, color_space) of each image, drawn as /Im0
+    and /Im1.
+    """
+    metrics = Metrics()
+    content = [b"0.5 w\n"]
+    images = []
+
+    # 標題, 超過表格寬度時換行
+    top = PAGE_HEIGHT - MARGIN
+    table_width = sum(COLUMN_WIDTHS)
+    for line in wrap_title(title, table_width) or [""]:
+        line_width = text_width(line, TITLE_FONT_SIZE)
+        content.append(
+            _text_op(
+                line,
+                (PAGE_WIDTH - line_width) / 2,
+                top - TITLE_FONT_SIZE,
+                TITLE_FONT_SIZE,
+            )
+        )
+        top -= TITLE_LINE_HEIGHT
+
+    column_lefts = [MARGIN + sum(COLUMN_WIDTHS[:i]) for i in range(5)]
+    for slot, (image_data, datetime, number) in enumerate(slots):
+        picture, image_metrics = prepare_image_data(
+            image_data, dpi, quality, rotate_in_xml, cache
+        )
+        metrics.merge(image_metrics)
+        if picture is None:
+            picture = image_data.file_path
+        with metrics.timer("pdf_image"):
+            data, width, height, color_space = load_jpeg(picture, quality)
+        images.append((data, width, height, color_space))
+        metrics.count("bytes_embedded", len(data))
+        metrics.count("images")
+
+        with metrics.timer("compose"):
+            picture_bottom = top - ROW_HEIGHTS[0]
+            time_bottom = picture_bottom - ROW_HEIGHTS[1]
+            note_bottom = time_bottom - ROW_HEIGHTS[2]
+
+            # 圖片置中, 旋轉的圖片在頁面上逆時針轉 90 度
+            is_rotated = image_data.rotate_image and rotate_in_xml
+            shown_width, shown_height = (
+                (height, width) if is_rotated else (width, height)
+            )
+            scale = PICTURE_HEIGHT_PT / shown_height
+            scale = min(scale, (table_width - 2 * CELL_MARGIN) / shown_width)
+            shown_width *= scale
+            shown_height *= scale
+            x = MARGIN + (table_width - shown_width) / 2
+            y = picture_bottom + (ROW_HEIGHTS[0] - shown_height) / 2
+            if is_rotated:
+                matrix = (0, shown_height, -shown_width, 0, x + shown_width, y)
+            else:
+                matrix = (shown_width, 0, 0, shown_height, x, y)
+            content.append(
+                b"q %.4f %.4f %.4f %.4f %.4f %.4f cm /Im%d Do Q\n" % (*matrix, slot)
+            )
+
+            # 表格線
+            right = MARGIN + table_width
+            content.append(
+                b"%.2f %.2f %.2f %.2f re S\n"
+                % (MARGIN, note_bottom, table_width, top - note_bottom)
+            )
+            for y in (picture_bottom, time_bottom):
+                content.append(b"%.2f %.2f m %.2f %.2f l S\n" % (MARGIN, y, right, y))
+            for i in (1, 2, 3):
+                x = column_lefts[i]
+                content.append(
+                    b"%.2f %.2f m %.2f %.2f l S\n" % (x, picture_bottom, x, time_bottom)
+                )
+            x = column_lefts[1]
+            content.append(
+                b"%.2f %.2f m %.2f %.2f l S\n" % (x, time_bottom, x, note_bottom)
+            )
+
+            # 文字
+            row_height = ROW_HEIGHTS[1]
+            for column, text, align in [
+                (0, "時間", "distribute"),
+                (1, datetime, "left"),
+                (2, "照片編號", "distribute"),
+                (3, str(number), "left"),
+            ]:
+                content.append(
+                    _cell_text(
+                        text,
+                        column_lefts[column],
+                        COLUMN_WIDTHS[column],
+                        time_bottom,
+                        row_height,
+                        align,
+                    )
+                )
+            content.append(
+                _cell_text(
+                    "說明",
+                    column_lefts[0],
+                    COLUMN_WIDTHS[0],
+                    note_bottom,
+                    ROW_HEIGHTS[2],
+                    "distribute",
+                )
+            )
+            top = note_bottom
+
+    return b"".join(content), images, metrics
+
+
+class PdfWriter:
+    """
+    A minimal PDF writer. Objects are written to the file as soon as they
+    are added, so pages don't stay in memory. The cross-reference table is
+    written by close().
+    """
+
+    def __init__(self, file):
+        if isinstance(file, (str, os.PathLike)):
+            self._file = open(file, "wb")
+            self._owns_file = True
+        else:
+            self._file = file
+            self._owns_file = False
+        self._offsets = {}
+        self._num_objects = 0
+        self._position = 0
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self._file.write(data)
+        self._position += len(data)
+
+    def reserve(self):
+        """
+        Return a new object number, the object is added later.
+        """
+        self._num_objects += 1
+        return self._num_objects
+
+    def add(self, obj, number=None):
+        """
+        Write obj, the bytes of a PDF object, and return its object number.
+        """
+        if number is None:
+            number = self.reserve()
+        self._offsets[number] = self._position
+        self._write(b"%d 0 obj\n" % number + obj + b"\nendobj\n")
+        return number
+
+    def add_stream(self, dictionary, data, number=None):
+        return self.add(
+            b"<< %s /Length %d >>\nstream\n" % (dictionary, len(data))
+            + data
+            + b"\nendstream",
+            number,
+        )
+
+    def close(self, root):
+        xref_position = self._position
+        lines = [b"xref\n0 %d\n" % (self._num_objects + 1), b"0000000000 65535 f \n"]
+        for number in range(1, self._num_objects + 1):
+            lines.append(b"%010d 00000 n \n" % self._offsets[number])
+        self._write(b"".join(lines))
+        self._write(
+            b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (self._num_objects + 1, root, xref_position)
+        )
+        self.abort()
+
+    def abort(self):
+        if self._owns_file:
+            self._file.close()
+
+
+class PdfReportController:
+    """
+    Generate the report as PDF, with the same layout as ReportController:
+    two photos per page with their time and number. Pages are composed in
+    worker processes and written to the file in order as they finish.
+    """
+
+    def __init__(
+        self,
+        image_dpi=200,
+        jpeg_quality=85,
+        workers=1,
+        rotate_in_xml=False,
+        cache=None,
+        metrics=None,
+    ):
+        """
+        The options are the same as in ReportController. With image_dpi
+        None the original files are embedded if they're JPEGs, other
+        formats are encoded as JPEG.
+        """
+        self._image_data = []
+        self._report_title = ""
+        self._metadata_index = ImageMetadataIndex()
+        self._first_number = 1
+        self._image_dpi = image_dpi
+        self._jpeg_quality = jpeg_quality
+        self._workers = workers
+        self._rotate_in_xml = rotate_in_xml
+        self._cache = cache
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def set_data(self, image_data, title, metadata_index=None, first_number=1):
+        """
+        The arguments are the same as in ReportController.set_data.
+        """
+        self._image_data = image_data
+        self._report_title = title
+        self._first_number = first_number
+        if metadata_index is None:
+            metadata_index = ImageMetadataIndex()
+            metadata_index.add(
+                data.file_path for data in image_data if data.use_image_time
+            )
+        self._metadata_index = metadata_index
+
+    def generate_streaming(self, file, progress=None, cancel_event=None):
+        """
+        Generate the report and write it to file page by page.
+        progress and cancel_event are the same as in
+        ReportController.generate_doc.
+        """
+        writer = PdfWriter(file)
+        try:
+            self._write_pages(writer, progress, cancel_event)
+        except BaseException:
+            writer.abort()
+            raise
+
+    def _write_pages(self, writer, progress, cancel_event):
+        catalog = writer.reserve()
+        pages = writer.reserve()
+        font = self._write_font(writer)
+        page_numbers = []
+        num_pages = (len(self._image_data) + 1) // 2
+        composed_pages = self._iter_composed_pages()
+        try:
+            for i in range(num_pages):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise GenerationCancelled()
+                content, images = next(composed_pages)
+                self.metrics.count("pages")
+                with self.metrics.timer("write"):
+                    page_numbers.append(
+                        self._write_page(writer, pages, font, content, images)
+                    )
+                if progress is not None:
+                    progress(i + 1, num_pages)
+        finally:
+            composed_pages.close()
+
+        with self.metrics.timer("write"):
+            kids = b" ".join(b"%d 0 R" % number for number in page_numbers)
+            writer.add(
+                b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_numbers)),
+                pages,
+            )
+            writer.add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages, catalog)
+            writer.close(catalog)
+
+    @staticmethod
+    def _write_font(writer):
+        descriptor = writer.add(
+            b"<< /Type /FontDescriptor /FontName /%s /Flags 6"
+            b" /FontBBox [-160 -249 1015 1071] /ItalicAngle 0 /Ascent 880"
+            b" /Descent -120 /CapHeight 880 /StemV 93 >>" % FONT_NAME.encode()
+        )
+        # CID 1-95 為半形 ASCII 字元
+        cid_font = writer.add(
+            b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /%s"
+            b" /CIDSystemInfo << /Registry (Adobe) /Ordering (CNS1) /Supplement 0 >>"
+            b" /FontDescriptor %d 0 R /DW 1000 /W [1 95 500] >>"
+            % (FONT_NAME.encode(), descriptor)
+        )
+        return writer.add(
+            b"<< /Type /Font /Subtype /Type0 /BaseFont /%s /Encoding /%s"
+            b" /DescendantFonts [%d 0 R] >>"
+            % (FONT_NAME.encode(), FONT_ENCODING.encode(), cid_font)
+        )
+
+    @staticmethod
+    def _write_page(writer, pages, font, content, images):
+        image_refs = []
+        for i, (data, width, height, color_space) in enumerate(images):
+            number = writer.add_stream(
+                b"/Type /XObject /Subtype /Image /Width %d /Height %d"
+                b" /ColorSpace /%s /BitsPerComponent 8 /Filter /DCTDecode"
+                % (width, height, color_space.encode()),
+                data,
+            )
+            image_refs.append(b"/Im%d %d 0 R" % (i, number))
+        contents = writer.add_stream(b"/Filter /FlateDecode", zlib.compress(content))
+        return writer.add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d]"
+            b" /Resources << /Font << /F1 %d 0 R >> /XObject << %s >> >>"
+            b" /Contents %d 0 R >>"
+            % (
+                pages,
+                PAGE_WIDTH,
+                PAGE_HEIGHT,
+                font,
+                b" ".join(image_refs),
+                contents,
+            )
+        )
+
+    def _page_slots(self, start_index):
+        slots = []
+        for i, image_data in enumerate(self._image_data[start_index : start_index + 2]):
+            metadata = None
+            if image_data.use_image_time:
+                with self.metrics.timer("exif_read"):
+                    metadata = self._metadata_index.get(image_data.file_path)
+            slots.append(
+                (
+                    image_data,
+                    format_image_time(image_data, metadata),
+                    self._first_number + start_index + i,
+                )
+            )
+        return slots
+
+    def _iter_composed_pages(self):
+        """
+        Yield (content, images) of each page in order. With several workers
+        the pages are composed in a process pool, keeping a bounded number
+        of pages in flight ahead of the writing.
+        """
+        options = (
+            self._image_dpi,
+            self._jpeg_quality,
+            self._rotate_in_xml,
+            self._cache,
+        )
+        start_indexes = range(0, len(self._image_data), 2)
+        if self._workers <= 1:
+            for start_index in start_indexes:
+                content, images, metrics = compose_page(
+                    self._report_title, self._page_slots(start_index), *options
+                )
+                self.metrics.merge(metrics)
+                yield content, images
+            return
+
+        executor = create_process_pool(self._workers)
+        try:
+            pending = deque()
+            for start_index in start_indexes:
+                pending.append(
+                    executor.submit(
+                        compose_page,
+                        self._report_title,
+                        self._page_slots(start_index),
+                        *options,
+                    )
+                )
+                if len(pending) >= self._workers * 2:
+                    yield self._pop_composed_page(pending)
+            while pending:
+                yield self._pop_composed_page(pending)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def _pop_composed_page(self, pending):
+        # 等待時間長表示頁面組成跟不上寫入
+        with self.metrics.timer("wait_pages"):
+            content, images, metrics = pending.popleft().result()
+        self.metrics.merge(metrics)
+        return content, images
+
+    def clear(self):
+        self._image_data = []
@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict
+
+
+def load_preview(file_path, max_width, max_height):
+    """
+    Decode an image scaled down to fit max_width x max_height. JPEGs are
+    decoded at a reduced scale in draft mode.
+    """
+    # 第一次預覽時才載入 PIL
+    from PIL import Image
+
+    img = Image.open(file_path)
+    img.draft("RGB", (max_width, max_height))
+    if img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+    img.thumbnail((max_width, max_height), Image.LANCZOS)
+    return img
+
+
+class PreviewCache:
+    """
+    Least recently used cache of screen sized previews, bounded by the
+    memory of the decoded pixels. A background thread prepares the previews
+    passed to prefetch() ahead of time.
+    """
+
+    def __init__(self, max_width, max_height, max_bytes=256 * 1024**2):
+        self._max_width = max_width
+        self._max_height = max_height
+        self._max_bytes = max_bytes
+        self._previews = OrderedDict()
+        self._size = 0
+        self._loading = {}
+        # 無法讀取的檔案, 不再預先載入
+        self._failed = set()
+        self._prefetch_paths = []
+        self._lock = threading.Lock()
+        self._prefetch_ready = threading.Condition(self._lock)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def get(self, file_path):
+        """
+        Return the preview of file_path, decoding it now if it isn't cached
+        or being prefetched.
+        """
+        with self._lock:
+            preview = self._lookup(file_path)
+            loading = self._loading.get(file_path)
+        if preview is not None:
+            return preview
+        if loading is not None:
+            loading.wait()
+            with self._lock:
+                preview = self._lookup(file_path)
+            if preview is not None:
+                return preview
+
+        preview = load_preview(file_path, self._max_width, self._max_height)
+        with self._lock:
+            self._store(file_path, preview)
+        return preview
+
+    def peek(self, file_path):
+        """
+        Return the preview of file_path if it's cached, otherwise None
+        without decoding it.
+        """
+        with self._lock:
+            return self._lookup(file_path)
+
+    def prefetch(self, file_paths):
+        """
+        Prepare the previews of file_paths in the background, in the given
+        order. Replaces the paths of earlier calls not prepared yet.
+        """
+        with self._lock:
+            self._prefetch_paths = [
+                path
+                for path in file_paths
+                if path not in self._previews and path not in self._failed
+            ]
+            self._prefetch_ready.notify()
+
+    def is_prefetching(self):
+        with self._lock:
+            return bool(self._prefetch_paths or self._loading)
+
+    def remove(self, file_path):
+        with self._lock:
+            preview = self._previews.pop(file_path, None)
+            self._failed.discard(file_path)
+            if preview is not None:
+                self._size -= self._preview_size(preview)
+
+    def clear(self):
+        with self._lock:
+            self._previews.clear()
+            self._size = 0
+            self._failed.clear()
+
+    def _lookup(self, file_path):
+        preview = self._previews.get(file_path)
+        if preview is not None:
+            self._previews.move_to_end(file_path)
+        return preview
+
+    def _store(self, file_path, preview):
+        if file_path in self._previews:
+            return
+        self._previews[file_path] = preview
+        self._size += self._preview_size(preview)
+        while self._size > self._max_bytes and len(self._previews) > 1:
+            _, old_preview = self._previews.popitem(last=False)
+            self._size -= self._preview_size(old_preview)
+
+    @staticmethod
+    def _preview_size(preview):
+        return preview.width * preview.height * len(preview.getbands())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._prefetch_paths:
+                    self._prefetch_ready.wait()
+                file_path = self._prefetch_paths.pop(0)
+                if file_path in self._previews:
+                    continue
+                loading = threading.Event()
+                self._loading[file_path] = loading
+
+            try:
+                preview = load_preview(file_path, self._max_width, self._max_height)
+            except Exception:
+                preview = None
+            with self._lock:
+                if preview is not None:
+                    self._store(file_path, preview)
+                else:
+                    self._failed.add(file_path)
+                del self._loading[file_path]
+            loading.set()
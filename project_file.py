@@ -0,0 +1,216 @@
+import sqlite3
+import threading
+from project_store import ImageRecord, ImageStore, TIME_UNITS, FLAGS, check_field
+
+PROJECT_FILE_SUFFIX = ".rgproj"
+
+# 檔案格式版本, 存於 PRAGMA user_version
+SCHEMA_VERSION = 1
+
+COLUMNS = TIME_UNITS + FLAGS
+
+# 時間欄位不指定型別, 保留匯入資料原本的值
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    file_path TEXT PRIMARY KEY,
+    position REAL NOT NULL,
+    year, month, day, hour, minute, second,
+    use_image_time INTEGER NOT NULL,
+    rotate_image INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS images_position ON images (position);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value
+) WITHOUT ROWID;
+"""
+
+
+class ProjectFile(ImageStore):
+    """
+    An ImageStore saved in a SQLite database file. Every change is written
+    at once as a single row update, so the file is always up to date.
+
+    Only the file paths are read when the file is opened, the record of a
+    photo is read the first time it's used. The order is kept as a REAL
+    position per photo, moving a photo only updates its own row.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        # 報告在背景執行緒產生, 連線由 _lock 保護
+        self._connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        try:
+            self._open()
+        except BaseException:
+            self._connection.close()
+            raise
+
+    def _open(self):
+        try:
+            version = self._execute("PRAGMA user_version")[0][0]
+        except sqlite3.DatabaseError:
+            raise ValueError(f"{self.path} is not a project file")
+        if version > SCHEMA_VERSION:
+            raise ValueError(f"{self.path} was saved by a newer version")
+        # WAL 模式下寫入不等待磁碟同步, 每次自動儲存只需數十微秒
+        self._execute("PRAGMA journal_mode=WAL")
+        self._execute("PRAGMA synchronous=NORMAL")
+        if version == 0:
+            self._connection.executescript(SCHEMA)
+            self._execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+        rows = self._execute("SELECT file_path, position FROM images ORDER BY position")
+        self._positions = dict(rows)
+        self._set_order(self._positions)
+        # 未讀取的紀錄為 None
+        self._records = dict.fromkeys(self._order)
+        self._num_unloaded = len(self._order)
+        rows = self._execute("SELECT value FROM settings WHERE key = 'title'")
+        self.title = rows[0][0] if rows else ""
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def __getitem__(self, file_path):
+        record = self._records[file_path]
+        if record is None:
+            rows = self._execute(
+                f"SELECT {', '.join(COLUMNS)} FROM images WHERE file_path = ?",
+                (file_path,),
+            )
+            record = self._make_record(file_path, rows[0])
+            self._records[file_path] = record
+            self._num_unloaded -= 1
+        return record
+
+    def __iter__(self):
+        if self._num_unloaded:
+            self._load_all()
+        return super().__iter__()
+
+    def _load_all(self):
+        rows = self._execute(f"SELECT file_path, {', '.join(COLUMNS)} FROM images")
+        for file_path, *row in rows:
+            if self._records.get(file_path, 0) is None:
+                self._records[file_path] = self._make_record(file_path, row)
+        self._num_unloaded = 0
+
+    @staticmethod
+    def _make_record(file_path, row):
+        *time, use_image_time, rotate_image = row
+        return ImageRecord(
+            file_path,
+            dict(zip(TIME_UNITS, time)),
+            bool(use_image_time),
+            bool(rotate_image),
+        )
+
+    @staticmethod
+    def _row(record, position):
+        return (
+            record.file_path,
+            position,
+            *(getattr(record, field) for field in TIME_UNITS),
+            record.use_image_time,
+            record.rotate_image,
+        )
+
+    def append(self, record):
+        if not super().append(record):
+            return False
+        position = self._positions[self._order[-2]] + 1 if len(self._order) > 1 else 0
+        self._positions[record.file_path] = position
+        self._execute(
+            "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            self._row(record, position),
+        )
+        return True
+
+    def remove(self, file_path):
+        if self._records[file_path] is None:
+            self._num_unloaded -= 1
+        super().remove(file_path)
+        del self._positions[file_path]
+        self._execute("DELETE FROM images WHERE file_path = ?", (file_path,))
+
+    def move(self, file_path, index):
+        super().move(file_path, index)
+        index = self.index(file_path)
+        before = self._positions[self._order[index - 1]] if index > 0 else None
+        if index < len(self._order) - 1:
+            after = self._positions[self._order[index + 1]]
+        else:
+            after = None
+
+        if before is None and after is None:
+            return
+        elif before is None:
+            position = after - 1
+        elif after is None:
+            position = before + 1
+        else:
+            position = (before + after) / 2
+        if position in (before, after):
+            # 同一處移動太多次, 浮點數已無法再細分, 重新編號
+            self._renumber()
+            return
+        self._positions[file_path] = position
+        self._execute(
+            "UPDATE images SET position = ? WHERE file_path = ?", (position, file_path)
+        )
+
+    def _renumber(self):
+        self._positions = {file_path: i for i, file_path in enumerate(self._order)}
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                "UPDATE images SET position = ? WHERE file_path = ?",
+                [
+                    (position, file_path)
+                    for file_path, position in self._positions.items()
+                ],
+            )
+
+    def replace(self, records):
+        super().replace(records)
+        self._positions = {file_path: i for i, file_path in enumerate(self._order)}
+        self._num_unloaded = 0
+        # 整批寫入一個交易
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.execute("DELETE FROM images")
+            self._connection.executemany(
+                "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    self._row(record, self._positions[record.file_path])
+                    for record in self._records.values()
+                ],
+            )
+
+    def set_title(self, title):
+        super().set_title(title)
+        self._execute("INSERT OR REPLACE INTO settings VALUES ('title', ?)", (title,))
+
+    def update(self, file_path, field, value):
+        super().update(file_path, field, value)
+        self._execute(
+            f"UPDATE images SET {field} = ? WHERE file_path = ?", (value, file_path)
+        )
+
+    def set_all(self, field, value):
+        check_field(field)
+        # 未讀取的紀錄之後會讀到新的值
+        for record in self._records.values():
+            if record is not None:
+                setattr(record, field, value)
+        self._execute(f"UPDATE images SET {field} = ?", (value,))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
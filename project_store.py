@@ -0,0 +1,179 @@
+TIME_UNITS = ("year", "month", "day", "hour", "minute", "second")
+FLAGS = ("use_image_time", "rotate_image")
+
+
+class ImageRecord:
+    """
+    Settings of one photo: the time typed in by hand, whether to use the
+    capture time of the image instead, and whether to rotate it.
+    """
+
+    __slots__ = ("file_path",) + TIME_UNITS + FLAGS
+
+    def __init__(self, file_path, time=None, use_image_time=False, rotate_image=False):
+        self.file_path = file_path
+        time = time or {}
+        self.year = time.get("year", "")
+        self.month = time.get("month", "")
+        self.day = time.get("day", "")
+        self.hour = time.get("hour", "")
+        self.minute = time.get("minute", "")
+        self.second = time.get("second", "")
+        self.use_image_time = use_image_time
+        self.rotate_image = rotate_image
+
+    @property
+    def time(self):
+        return {
+            "year": self.year,
+            "month": self.month,
+            "day": self.day,
+            "hour": self.hour,
+            "minute": self.minute,
+            "second": self.second,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create a record from an entry of the export_data format.
+        """
+        return cls(
+            data["file_path"],
+            data.get("time"),
+            data.get("use_image_time", False),
+            data.get("rotate_image", False),
+        )
+
+    def to_dict(self):
+        return {
+            "time": self.time,
+            "use_image_time": self.use_image_time,
+            "rotate_image": self.rotate_image,
+            "file_path": self.file_path,
+        }
+
+
+class ImageStore:
+    """
+    The photos of a project in report order. Records are looked up by file
+    path in a dict, the order is a list of their file paths.
+
+    The index of each file path is kept in a dict as well. Removing or
+    moving a photo only marks the indexes after it as stale, they are
+    filled in again the next time they are asked for.
+    """
+
+    def __init__(self, records=(), title=""):
+        self.title = title
+        self._set_records(records)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return map(self.__getitem__, self._order)
+
+    def __contains__(self, file_path):
+        return file_path in self._records
+
+    def __getitem__(self, file_path):
+        return self._records[file_path]
+
+    def file_paths(self):
+        return list(self._order)
+
+    def file_path_at(self, index):
+        return self._order[index]
+
+    def index(self, file_path):
+        if file_path not in self._records:
+            raise ValueError(f"{file_path} is not in the store")
+        return self._index(file_path)
+
+    def _index(self, file_path):
+        # 過期的 index 可能仍小於 _num_indexed, 需確認位置上是同一張照片
+        index = self._indexes.get(file_path)
+        if index is not None and index < self._num_indexed:
+            if self._order[index] == file_path:
+                return index
+        # 從第一個過期的位置往後補上, 直到找到 file_path
+        for index in range(self._num_indexed, len(self._order)):
+            self._indexes[self._order[index]] = index
+            self._num_indexed = index + 1
+            if self._order[index] == file_path:
+                return index
+
+    def append(self, record):
+        """
+        Add record at the end. Return False if its file is already in the
+        store.
+        """
+        if record.file_path in self._records:
+            return False
+        self._records[record.file_path] = record
+        self._order.append(record.file_path)
+        if self._num_indexed == len(self._order) - 1:
+            self._indexes[record.file_path] = self._num_indexed
+            self._num_indexed += 1
+        return True
+
+    def remove(self, file_path):
+        del self._records[file_path]
+        index = self._index(file_path)
+        del self._order[index]
+        del self._indexes[file_path]
+        self._num_indexed = index
+
+    def move(self, file_path, index):
+        old_index = self.index(file_path)
+        del self._order[old_index]
+        # 與 list.insert 相同, 超出範圍的 index 放在頭尾
+        if index < 0:
+            index = max(index + len(self._order), 0)
+        index = min(index, len(self._order))
+        self._order.insert(index, file_path)
+        self._num_indexed = min(old_index, index)
+
+    def replace(self, records):
+        """
+        Replace all photos with records.
+        """
+        self._set_records(records)
+
+    def _set_records(self, records):
+        self._records = {}
+        for record in records:
+            self._records.setdefault(record.file_path, record)
+        self._set_order(self._records)
+
+    def _set_order(self, file_paths):
+        self._order = list(file_paths)
+        self._indexes = {}
+        self._num_indexed = 0
+
+    def set_title(self, title):
+        self.title = title
+
+    def update(self, file_path, field, value):
+        """
+        Set one time unit or flag of a record.
+        """
+        check_field(field)
+        setattr(self[file_path], field, value)
+
+    def set_all(self, field, value):
+        """
+        Set one time unit or flag of every record.
+        """
+        check_field(field)
+        for record in self:
+            setattr(record, field, value)
+
+    def close(self):
+        pass
+
+
+def check_field(field):
+    if field not in TIME_UNITS + FLAGS:
+        raise AttributeError(field)
@@ -0,0 +1,239 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from image_manager import ImageManager
+from image_cache import ImageCache
+from metrics import Metrics, JsonLinesSink
+from report_controller import process_context
+
+# 只用於產生新報告的選項, 附加時不使用
+NEW_REPORT_OPTIONS = (
+    "streaming",
+    "max_pages",
+    "max_bytes",
+    "volume_processes",
+    "max_output_bytes",
+)
+
+
+def generate_report_from_json(
+    json_path, output_path, title, report_options, append=False
+):
+    """
+    Generate one report from a file in the export_data format, or append the
+    images to the existing report output_path.
+    report_options are passed to ImageManager.generate_report.
+    Return the elapsed time in seconds.
+    """
+    start_time = time.perf_counter()
+    with open(json_path, encoding="utf-8") as fp:
+        import_data = json.load(fp)
+
+    image_manager = ImageManager()
+    image_manager.import_data(import_data)
+    image_manager.update_report_title(title)
+    if append:
+        # 附加時一律串流寫入, 也不分冊
+        report_options = {
+            key: value
+            for key, value in report_options.items()
+            if key not in NEW_REPORT_OPTIONS
+        }
+        image_manager.append_report(output_path, **report_options)
+    else:
+        image_manager.generate_report(output_path, **report_options)
+    return time.perf_counter() - start_time
+
+
+def make_output_paths(args):
+    """
+    Return {json_path: output_path} of the reports, named after the JSON
+    files in output_dir or the directory of each JSON file.
+    """
+    output_paths = {}
+    ext = ".pdf" if args.pdf else ".docx"
+    for json_path in args.json_files:
+        output_dir = args.output_dir or os.path.dirname(json_path)
+        file_name = os.path.splitext(os.path.basename(json_path))[0] + ext
+        output_paths[json_path] = os.path.join(output_dir, file_name)
+    return output_paths
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate reports from exported JSON data without the GUI."
+    )
+    parser.add_argument("json_files", nargs="+", help="data exported by the GUI")
+    parser.add_argument("-t", "--title", default="", help="report title")
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        help="directory of the reports, defaults to the directory of each JSON file",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of reports generated at once",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes preparing images of each report, at most the"
+        " CPUs divided by the reports generated at once",
+    )
+    parser.add_argument(
+        "--dpi",
+        type=int,
+        default=200,
+        help="resample images to this dpi, 0 embeds the original files",
+    )
+    parser.add_argument("--quality", type=int, default=85, help="JPEG quality")
+    parser.add_argument(
+        "--rotate-in-xml",
+        action="store_true",
+        help="rotate pictures in the document instead of rotating pixels",
+    )
+    parser.add_argument(
+        "--pdf", action="store_true", help="generate PDF reports instead of .docx"
+    )
+    parser.add_argument(
+        "--template", help="Word document whose page setup and styles are used"
+    )
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="add the images to the end of the existing reports instead",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="write each report while generating it to bound memory use",
+    )
+    parser.add_argument(
+        "--max-pages", type=int, help="split reports into volumes of this many pages"
+    )
+    parser.add_argument(
+        "--max-size",
+        type=float,
+        help="split reports into volumes of about this many MB",
+    )
+    parser.add_argument(
+        "--size-limit",
+        type=float,
+        help="lower the dpi and quality of images to fit each report or volume"
+        " in about this many MB",
+    )
+    parser.add_argument("--cache-dir", help="directory of the prepared image cache")
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        help="size limit of the prepared image cache in MB",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="append the phase timings of each report as a JSON line to this file,"
+        " instead of logging them",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="log the progress of each report"
+    )
+    args = parser.parse_args(argv)
+    if args.pdf and (args.append or args.max_pages or args.max_size):
+        parser.error("PDF reports can't be appended to or split into volumes")
+    if args.size_limit and (args.pdf or args.append):
+        parser.error("--size-limit only applies to new Word reports")
+
+    # 同時產生的報告寫到同一個檔案時會互相覆蓋
+    json_paths = {}
+    for json_path, output_path in make_output_paths(args).items():
+        key = os.path.normcase(os.path.abspath(output_path))
+        if key in json_paths:
+            parser.error(
+                f"{json_paths[key]} and {json_path} would both be written to"
+                f" {output_path}"
+            )
+        json_paths[key] = json_path
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(name)s %(message)s",
+    )
+    report_options = {
+        "image_dpi": args.dpi or None,
+        "jpeg_quality": args.quality,
+        "rotate_in_xml": args.rotate_in_xml,
+        "streaming": args.streaming,
+        "max_pages": args.max_pages,
+        "max_bytes": args.max_size and int(args.max_size * 1024 * 1024),
+    }
+    if args.size_limit:
+        report_options["max_output_bytes"] = int(args.size_limit * 1024 * 1024)
+    if args.template:
+        report_options["template_file"] = os.path.abspath(args.template)
+    if args.cache_dir:
+        report_options["cache"] = ImageCache(
+            args.cache_dir, args.cache_size * 1024 * 1024
+        )
+    if args.metrics:
+        report_options["metrics"] = Metrics(JsonLinesSink(args.metrics))
+
+    jobs = make_output_paths(args)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    num_jobs = max(1, min(args.jobs, len(jobs)))
+    # 同時產生的報告平分 CPU 給各自的分冊及準備圖片的行程,
+    # 避免行程數為 CPU 數的平方
+    cpus_per_job = max(1, (os.cpu_count() or 1) // num_jobs)
+    report_options["volume_processes"] = cpus_per_job
+    report_options["workers"] = max(1, min(args.workers, cpus_per_job))
+
+    num_failed = 0
+    start_time = time.perf_counter()
+    # 報告在工作行程中再建立處理池, 不可用 fork 建立, 見 process_context
+    with ProcessPoolExecutor(
+        max_workers=num_jobs, mp_context=process_context()
+    ) as executor:
+        futures = {
+            executor.submit(
+                generate_report_from_json,
+                json_path,
+                output_path,
+                args.title,
+                report_options,
+                args.append,
+            ): json_path
+            for json_path, output_path in jobs.items()
+        }
+        for future in as_completed(futures):
+            json_path = futures[future]
+            try:
+                elapsed = future.result()
+            except Exception:
+                num_failed += 1
+                print(f"FAILED {json_path}", file=sys.stderr)
+                traceback.print_exc()
+            else:
+                print(f"OK     {json_path} -> {jobs[json_path]} ({elapsed:.2f}s)")
+
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"{len(jobs) - num_failed} of {len(jobs)} reports generated in {elapsed:.2f}s"
+    )
+    return 1 if num_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,37 +1,425 @@
+import io
+import logging
+import math
+import multiprocessing
 import os
 import docx
-import tempfile
+from collections import deque
+from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
 from docx.shared import Cm, Pt
+from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.table import WD_ALIGN_VERTICAL
-from PIL import Image
+from docx.table import Table, _Cell
+from docx.text.paragraph import Paragraph
+from PIL import Image, JpegImagePlugin
+from image_metadata import ImageMetadataIndex, format_exif_datetime
+from docx_stream import StreamingDocxWriter
+from docx_index import index_document
+from docx_template import TABLE_STYLE, report_template
+from metrics import Metrics
+from project_store import TIME_UNITS
+
+logger = logging.getLogger(__name__)
+
+# 照片欄位的列印高度
+PICTURE_HEIGHT = Cm(8.5)
+# 每張照片的表格: 照片, 時間及照片編號, 說明各列的高度 (cm)
+ROW_HEIGHTS_CM = [8.8, 0.5, 1.3]
+
+# 估計檔案大小用: 各 JPEG 畫質每像素的位元數, 及每頁表格的大小
+JPEG_BITS_PER_PIXEL = [(50, 1.0), (75, 1.5), (85, 2.0), (90, 2.6), (95, 4.0)]
+PAGE_XML_SIZE = 4096
+
+# 指定報告大小上限時: 超過上限後再準備全部圖片的次數 (之後只再以最低設定
+# 準備一次), 降低畫質及解析度的下限, 原檔沒有重新取樣時的起始解析度,
+# 及估計原檔每像素位元數用的畫質
+MAX_BUDGET_PASSES = 3
+MIN_BUDGET_QUALITY = 40
+MIN_BUDGET_DPI = 72
+BUDGET_START_DPI = 300
+ORIGINAL_JPEG_QUALITY = 92
+# 符合上限但用不到預算的這個比例時, 改用損失較少的設定再試
+BUDGET_FILL_RATIO = 0.9
+# 圖片多於兩倍時, 先以這麼多張的樣本找出設定, 不必每次重新準備全部圖片
+BUDGET_SAMPLE_SIZE = 8
+# 量得的大小對估計大小的斜率範圍, 及壓縮後每頁表格的大小
+MIN_BUDGET_SLOPE = 0.2
+MAX_BUDGET_SLOPE = 2.0
+PAGE_SAVED_SIZE = 512
+# 寫出的報告仍超過上限時, 依超出的大小縮小預算重新產生的次數
+MAX_SIZE_CHECKS = 3
+
+
+def jpeg_bits_per_pixel(quality):
+    # 依畫質內插每像素位元數
+    points = JPEG_BITS_PER_PIXEL
+    quality = min(max(quality, points[0][0]), points[-1][0])
+    for (q0, bits0), (q1, bits1) in zip(points, points[1:]):
+        if q0 <= quality <= q1:
+            return bits0 + (bits1 - bits0) * (quality - q0) / (q1 - q0)
+
+
+def size_budget_steps(dpi, quality):
+    """
+    Yield the lower (dpi, quality) settings tried to fit a report in a
+    size budget, from the least to the most visible loss.
+    """
+    # 先把畫質降到 75, 列印時幾乎看不出差別, 再把解析度降到 150 dpi
+    while quality > 75:
+        quality = max(75, quality - 5)
+        yield dpi, quality
+    while dpi > 150:
+        dpi = max(150, round(dpi * 0.9))
+        yield dpi, quality
+    # 之後畫質及解析度輪流降低到下限
+    while quality > MIN_BUDGET_QUALITY or dpi > MIN_BUDGET_DPI:
+        if quality > MIN_BUDGET_QUALITY:
+            quality = max(MIN_BUDGET_QUALITY, quality - 5)
+            yield dpi, quality
+        if dpi > MIN_BUDGET_DPI:
+            dpi = max(MIN_BUDGET_DPI, round(dpi * 0.9))
+            yield dpi, quality
+
+
+def predict_picture_size(size, fit_height, base, target):
+    """
+    Predict the bytes of a picture prepared with the (dpi, quality) target,
+    from its size prepared with base, in proportion to the pixels and the
+    bits per pixel. dpi None is the original file. The sizes measured in
+    each pass correct the prediction, see ReportController._search_budget.
+    fit_height: original pixels along the picture height, None if unknown.
+    """
+
+    def pixel_height(dpi):
+        slot_height = PICTURE_HEIGHT.inches * (BUDGET_START_DPI if dpi is None else dpi)
+        if fit_height is None:
+            return slot_height
+        return fit_height if dpi is None else min(fit_height, slot_height)
+
+    (base_dpi, base_quality), (dpi, quality) = base, target
+    if base_dpi is None:
+        base_quality = ORIGINAL_JPEG_QUALITY
+    scale = (pixel_height(dpi) / pixel_height(base_dpi)) ** 2
+    return (
+        size * scale * jpeg_bits_per_pixel(quality) / jpeg_bits_per_pixel(base_quality)
+    )
+
+
+def predict_log_size(points, log_sizes, index, slope):
+    """
+    Predict the log of the measured size at step index, from the measured
+    points {step index: log size} and the log of the predicted sizes of
+    the steps. The measured point nearest in predicted size is scaled by
+    slope.
+    """
+    nearest = min(points, key=lambda i: abs(log_sizes[i] - log_sizes[index]))
+    return points[nearest] + slope * (log_sizes[index] - log_sizes[nearest])
+
+
+def measured_slope(points, log_sizes, log_budget, slope):
+    """
+    Return the slope of the measured log sizes over the predicted ones, from
+    the two measured points nearest to the budget, or slope if there are
+    fewer than two.
+    """
+    if len(points) < 2:
+        return slope
+    i, j = sorted(points, key=lambda i: abs(points[i] - log_budget))[:2]
+    if abs(log_sizes[i] - log_sizes[j]) < 1e-6:
+        return slope
+    slope = (points[i] - points[j]) / (log_sizes[i] - log_sizes[j])
+    return min(max(slope, MIN_BUDGET_SLOPE), MAX_BUDGET_SLOPE)
+
+
+def prepare_image(
+    file_path, is_rotate_image, dpi, quality, rotate_pixels=True, metrics=None
+):
+    """
+    Load image, rotate it if needed and resample it to the picture height at
+    the given dpi. Return the image re-encoded as JPEG bytes.
+    With rotate_pixels False the pixels are not rotated, but the image is
+    still resampled for its rotated height.
+    metrics: a Metrics timing the decode, rotate, resample and encode phases.
+    """
+    if metrics is None:
+        metrics = Metrics()
+
+    with metrics.timer("decode"):
+        img = Image.open(file_path)
+        target_height = round(PICTURE_HEIGHT.inches * dpi)
+
+        # JPEG 可在解碼時直接縮小, 省下大部分解碼時間
+        img_width, img_height = img.size
+        fit_height = img_width if is_rotate_image else img_height
+        if fit_height > target_height:
+            scale = target_height / fit_height
+            img.draft("RGB", (int(img_width * scale) + 1, int(img_height * scale) + 1))
+        img.load()
+
+    if is_rotate_image and rotate_pixels:
+        with metrics.timer("rotate"):
+            img = img.transpose(Image.ROTATE_90)
+
+    with metrics.timer("resample"):
+        img_width, img_height = img.size
+        fit_height = img_width if is_rotate_image and not rotate_pixels else img_height
+        if fit_height > target_height:
+            scale = target_height / fit_height
+            img = img.resize(
+                (max(1, round(img_width * scale)), max(1, round(img_height * scale))),
+                Image.LANCZOS,
+            )
+
+    with metrics.timer("encode"):
+        return encode_jpeg(img, quality, dpi)
+
+
+def encode_jpeg(img, quality, dpi=None):
+    """
+    Return img encoded as JPEG bytes, transparent parts are filled white.
+    """
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, "white")
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+    elif img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    output = io.BytesIO()
+    if dpi is None:
+        img.save(output, "jpeg", quality=quality)
+    else:
+        img.save(output, "jpeg", quality=quality, dpi=(dpi, dpi))
+    return output.getvalue()
+
+
+def prepare_picture(
+    file_path, is_rotate_image, dpi, quality, rotate_in_xml, metrics=None
+):
+    """
+    Return the image bytes to embed for one image, or None to embed the
+    original file.
+    """
+    if dpi is not None:
+        return prepare_image(
+            file_path,
+            is_rotate_image,
+            dpi,
+            quality,
+            rotate_pixels=not rotate_in_xml,
+            metrics=metrics,
+        )
+    if is_rotate_image and not rotate_in_xml:
+        return ReportController.rotate_image(file_path, metrics)
+    return None
+
+
+def embeds_original(image_data, dpi, rotate_in_xml=False):
+    """
+    Return True if the original file of image_data is embedded as it is.
+    """
+    is_rotate_image = image_data.rotate_image
+    return dpi is None and not (is_rotate_image and not rotate_in_xml)
+
+
+def picture_cache_key(
+    cache, image_data, dpi, quality, rotate_in_xml=False, file_hash=None
+):
+    """
+    Return the key of the prepared picture of image_data in the ImageCache
+    cache, or None if the original file is embedded as it is.
+    """
+    if embeds_original(image_data, dpi, rotate_in_xml):
+        return None
+    is_rotate_image = image_data.rotate_image
+    return cache.make_key(
+        image_data.file_path,
+        is_rotate_image,
+        is_rotate_image and rotate_in_xml,
+        dpi,
+        quality,
+        file_hash=file_hash,
+    )
+
+
+def prepare_image_data(image_data, dpi, quality, rotate_in_xml=False, cache=None):
+    """
+    Do the decoding, rotating and resampling work of one image entry.
+    Return (picture, metrics): the image bytes to embed, or None to embed the
+    original file, and the Metrics of this image, merged back by the caller
+    when run in a worker process.
+    With rotate_in_xml the pixels are left unrotated, the rotation is applied
+    to the picture in the document instead.
+    cache: an ImageCache holding pictures prepared by earlier runs.
+    """
+    metrics = Metrics()
+    file_path = image_data.file_path
+    is_rotate_image = image_data.rotate_image
+    if cache is not None and not embeds_original(image_data, dpi, rotate_in_xml):
+        with metrics.timer("cache_lookup"):
+            key = picture_cache_key(cache, image_data, dpi, quality, rotate_in_xml)
+            picture = cache.get(key)
+        if picture is None:
+            metrics.count("cache_misses")
+            picture = prepare_picture(
+                file_path, is_rotate_image, dpi, quality, rotate_in_xml, metrics
+            )
+            with metrics.timer("cache_store"):
+                cache.put(key, picture)
+        else:
+            metrics.count("cache_hits")
+    else:
+        picture = prepare_picture(
+            file_path, is_rotate_image, dpi, quality, rotate_in_xml, metrics
+        )
+
+    return picture, metrics
+
+
+def format_image_time(image_data, metadata=None):
+    """
+    Return the time shown for an image ex: 108年09月29日17時12分17秒, the
+    capture time in metadata if the image uses it, else the typed time.
+    """
+    if image_data.use_image_time:
+        return format_exif_datetime(metadata and metadata["datetime"])
+    year = image_data.year
+    month = image_data.month
+    day = image_data.day
+    hour = image_data.hour
+    minute = image_data.minute
+    second = image_data.second
+    return f"{year}年{month}月{day}日{hour}時{minute}分{second}秒"
+
+
+def process_context():
+    """
+    Return the multiprocessing context of the process pools generating
+    reports. Reports are generated from a worker thread of the GUI while
+    other threads (EXIF index, preview prefetch, Tk) run, and a process
+    forked from them can deadlock on a lock another thread held, so the
+    workers are started by a fork server, or spawned where there is none.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # fork server 預先載入, 工作行程不必各自載入 docx 及 PIL
+        context.set_forkserver_preload(["report_controller"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def create_process_pool(workers):
+    """
+    Create the process pool preparing images of a report.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=process_context())
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+class OutputSizeExceeded(Exception):
+    """
+    Raised when a report doesn't fit in max_output_bytes even at the lowest
+    dpi and JPEG quality, min_bytes is its estimated size at those settings,
+    or the size it was written in at the last settings tried.
+    """
+
+    def __init__(self, max_bytes, min_bytes):
+        super().__init__(
+            f"The report needs about {min_bytes} bytes even at the lowest dpi"
+            f" and quality, more than the limit of {max_bytes} bytes"
+        )
+        self.max_bytes = max_bytes
+        self.min_bytes = min_bytes
 
 
 class ReportController:
-    def __init__(self):
-        self.doc = docx.Document()
+    def __init__(
+        self,
+        image_dpi=200,
+        jpeg_quality=85,
+        workers=1,
+        rotate_in_xml=False,
+        cache=None,
+        metrics=None,
+        page_cache=None,
+        template_file=None,
+        max_output_bytes=None,
+    ):
+        """
+        image_dpi: resample images to this dpi for the picture slot, or None
+        to embed the original files.
+        jpeg_quality: JPEG quality of the resampled images.
+        workers: number of processes preparing images, 1 prepares them in
+        the current process.
+        rotate_in_xml: rotate pictures with the DrawingML transform instead
+        of rotating the pixels.
+        cache: an ImageCache to reuse prepared pictures between runs.
+        metrics: a Metrics collecting the time of each phase and the bytes
+        embedded, available as self.metrics.
+        page_cache: a PageCache of pages built by earlier runs, pages whose
+        fingerprint didn't change are copied from it instead of rebuilt.
+        Only pages whose pictures are embedded originals or stored in cache
+        are kept, the pictures are read again from there when reused.
+        template_file: a .docx whose page setup, styles, headers and footers
+        are used for the report, see ReportTemplate.
+        max_output_bytes: lower the dpi and JPEG quality of all images as
+        little as needed for the report to fit in this many bytes,
+        OutputSizeExceeded is raised when generating if it can't.
+        """
+        self._template = report_template(template_file)
+        self.doc = self._template.document()
         self._image_data = []
         self._report_title = ""
+        self._metadata_index = ImageMetadataIndex()
+        self._first_number = 1
+        self._image_dpi = image_dpi
+        self._jpeg_quality = jpeg_quality
+        self._workers = workers
+        self._rotate_in_xml = rotate_in_xml
+        self._cache = cache
+        self._page_template = None
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._max_output_bytes = max_output_bytes
+        # 寫出報告後量得的圖片以外的大小, 及上次符合預算的設定及圖片大小
+        self._written_overhead = None
+        self._budget_settings = None
+        self._picture_bytes = 0
+        # generate_doc 檢查大小時寫出的報告, save() 直接寫入
+        self._saved_report = None
+        # 有大小上限時每張圖片的設定取決於全部圖片, 不沿用之前的頁面
+        self._page_cache = None if max_output_bytes else page_cache
 
-        # 調整文件左右上下邊界至 1.27 cm
-        section = self.doc.sections[0]
-        section.left_margin = Cm(1.27)
-        section.right_margin = Cm(1.27)
-        section.top_margin = Cm(1.27)
-        section.bottom_margin = Cm(1.27)
-
-        # 設定字型及大小
-        style = self.doc.styles["Normal"]
-        self.doc.styles["Normal"].font.name = "標楷體"
-        self.doc.styles["Normal"]._element.rPr.rFonts.set(qn("w:eastAsia"), "標楷體")
-        self.doc.styles["Normal"].font.size = Pt(20)
-
-    def set_data(self, image_data, title):
+    def set_data(self, image_data, title, metadata_index=None, first_number=1):
+        """
+        image_data: list of ImageRecord in report order.
+        metadata_index: an ImageMetadataIndex with the EXIF data of the
+        images, a new one is filled in the background if not given.
+        first_number: photo number of the first image.
+        """
         self._image_data = image_data
+        self._first_number = first_number
+        if metadata_index is None:
+            metadata_index = ImageMetadataIndex()
+            metadata_index.add(
+                data.file_path for data in image_data if data.use_image_time
+            )
+        self._metadata_index = metadata_index
+        if title != self._report_title:
+            self._page_template = None
         self._report_title = title
 
-    def add_table(self, start_index, count):
+    def _build_page_template(self):
+        """
+        Build the title paragraph and the styled, merged table of one page.
+        Return their XML elements, removed from the document body.
+        """
         # 標題
         title = self.doc.add_paragraph(self._report_title)
         title.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
@@ -39,7 +427,7 @@ class ReportController:
 
         # 建立表格
         table = self.doc.add_table(6, 4)
-        table.style = "Table Grid"
+        table.style = TABLE_STYLE
         table.autofit = False
 
         # 表格全部設為垂直置中
@@ -54,7 +442,7 @@ class ReportController:
                 cell.width = Cm(widths[i])
 
         # 設定表格高度
-        heights = [8.8, 0.5, 1.3, 8.8, 0.5, 1.3]
+        heights = ROW_HEIGHTS_CM * 2
         for i, row in enumerate(table.rows):
             row.height = Cm(heights[i])
 
@@ -98,88 +486,786 @@ class ReportController:
             run = word_position.add_run(" ")
             run.font.size = Pt(12)
 
+        body = self.doc.element.body
+        body.remove(title._p)
+        body.remove(table._tbl)
+        return title._p, table._tbl
+
+    def add_table(self, start_index, prepared_images):
+        """
+        Add the title and table of the page starting at start_index.
+        Return their XML elements.
+        """
+        # 每頁複製同一份已排版的標題及表格, 只填入圖片、時間及編號
+        with self.metrics.timer("table_build"):
+            if self._page_template is None:
+                self._page_template = self._build_page_template()
+            title_element, table_element = self._page_template
+            body = self.doc.element.body
+            title_p = body._insert_p(deepcopy(title_element))
+            tbl = body._insert_tbl(deepcopy(table_element))
+            table = Table(tbl, self.doc._body)
+        self.metrics.count("pages")
+
         # 填上內容
-        for i in range(count):
-            # 貼圖片
-            pic_position = table.rows[i * 3].cells[0].paragraphs[0]
-            img_file_path = self._image_data[start_index + i]["file_path"]
-            is_rotate_image = self._image_data[start_index + i]["rotate_image"]
-            if is_rotate_image:
-                img_file_path = self.rotate_image(img_file_path)
-            pic_position.add_run().add_picture(img_file_path, height=Cm(8.5))
+        for i, (picture, datatime) in enumerate(prepared_images):
+            self._fill_slot(
+                table,
+                i,
+                self._image_data[start_index + i],
+                picture,
+                datatime,
+                self._first_number + start_index + i,
+            )
+
+        return [title_p, tbl]
+
+    def _fill_slot(self, table, slot, image_data, picture, datatime, number):
+        """
+        Fill the picture, time and number of the upper (0) or lower (1) slot
+        of a page table.
+        """
+        rows = table._tbl.tr_lst
+
+        # 貼圖片
+        pic_position = _Cell(rows[slot * 3].tc_lst[0], table).paragraphs[0]
+        if picture is None:
+            picture = image_data.file_path
+            self.metrics.count("bytes_embedded", os.path.getsize(picture))
+        else:
+            self.metrics.count("bytes_embedded", len(picture))
+            picture = io.BytesIO(picture)
+        self.metrics.count("images")
+        with self.metrics.timer("picture_insert"):
+            if image_data.rotate_image and self._rotate_in_xml:
+                # 旋轉後的高度為原圖寬度
+                shape = pic_position.add_run().add_picture(
+                    picture, width=PICTURE_HEIGHT
+                )
+                self.rotate_picture(shape)
+            else:
+                pic_position.add_run().add_picture(picture, height=PICTURE_HEIGHT)
             pic_position.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            if is_rotate_image:
-                os.unlink(img_file_path)
 
-            # 加時間
-            datatime = self.get_datetime(self._image_data[start_index + i])
-            word_position = table.rows[i * 3 + 1].cells[1].paragraphs[0]
-            run = word_position.add_run(datatime)
-            run.font.size = Pt(12)
+        # 加時間
+        word_position = _Cell(rows[slot * 3 + 1].tc_lst[1], table).paragraphs[0]
+        run = word_position.add_run(datatime)
+        run.font.size = Pt(12)
 
-            # 加編號
-            word_position = table.rows[i * 3 + 1].cells[3].paragraphs[0]
-            run = word_position.add_run(str(start_index + 1 + i))
-            run.font.size = Pt(12)
+        # 加編號
+        word_position = _Cell(rows[slot * 3 + 1].tc_lst[3], table).paragraphs[0]
+        run = word_position.add_run(str(number))
+        run.font.size = Pt(12)
 
-    def generate_doc(self):
+    def _page_fingerprint(self, start_index):
+        """
+        Return a key of everything shown on the page starting at start_index.
+        """
+        images = tuple(
+            (
+                image_data.file_path,
+                self._page_cache.file_hash(image_data.file_path),
+                tuple(getattr(image_data, unit) for unit in TIME_UNITS),
+                image_data.use_image_time,
+                image_data.rotate_image,
+            )
+            for image_data in self._image_data[start_index : start_index + 2]
+        )
+        # 快取的頁面從產生時的圖片快取讀回圖片
+        cache_directory = None
+        if self._cache is not None:
+            cache_directory = os.path.abspath(self._cache.directory)
+        return (
+            self._report_title,
+            self._first_number + start_index,
+            self._image_dpi,
+            self._jpeg_quality,
+            self._rotate_in_xml,
+            cache_directory,
+            images,
+        )
+
+    def _picture_sources(self, image_data_list):
+        """
+        Return the sources of the pictures of image_data_list kept in the
+        page cache: ("cache", key) of a picture in the image cache or
+        ("file", path) of an embedded original. Return None if a picture
+        has neither, the page then isn't cached.
+        """
+        # 頁面快取不保留圖片內容, 記憶體用量不隨照片數增加
+        sources = []
+        for image_data in image_data_list:
+            file_path = image_data.file_path
+            if embeds_original(image_data, self._image_dpi, self._rotate_in_xml):
+                sources.append(("file", file_path))
+            elif self._cache is not None:
+                key = picture_cache_key(
+                    self._cache,
+                    image_data,
+                    self._image_dpi,
+                    self._jpeg_quality,
+                    self._rotate_in_xml,
+                    file_hash=self._page_cache.file_hash(file_path),
+                )
+                sources.append(("cache", key))
+            else:
+                return None
+        return sources
+
+    def _read_picture_source(self, source, image_data):
+        """
+        Return the picture bytes of a page cache source, or the path of the
+        original file. A picture evicted from the image cache, or cached by a
+        run with an image cache while this one has none, is prepared again.
+        """
+        kind, value = source
+        if kind == "file":
+            self.metrics.count("bytes_embedded", os.path.getsize(value))
+            return value
+        picture = None
+        if self._cache is not None:
+            picture = self._cache.get(value)
+        if picture is None:
+            picture, metrics = prepare_image_data(
+                image_data,
+                self._image_dpi,
+                self._jpeg_quality,
+                self._rotate_in_xml,
+                self._cache,
+            )
+            self.metrics.merge(metrics)
+        self.metrics.count("bytes_embedded", len(picture))
+        return io.BytesIO(picture)
+
+    def _insert_cached_page(self, elements, sources, image_data_list):
+        """
+        Insert copies of the elements of a cached page and relate its
+        pictures to image parts of this document.
+        """
+        body = self.doc.element.body
+        for element in elements:
+            element = deepcopy(element)
+            # 圖片的關聯 ID 及圖形 ID 依本文件重新指定
+            doc_prs = element.xpath(".//wp:docPr")
+            for doc_pr in doc_prs:
+                doc_pr.set("id", "0")
+            body.insert_element_before(element, "w:sectPr")
+            for doc_pr in doc_prs:
+                doc_pr.set("id", str(self.doc.part.next_id))
+            blips = element.xpath(".//a:blip")
+            for blip, source, image_data in zip(blips, sources, image_data_list):
+                picture = self._read_picture_source(source, image_data)
+                rId, _ = self.doc.part.get_or_add_image(picture)
+                blip.set(qn("r:embed"), rId)
+            sources = sources[len(blips) :]
+            image_data_list = image_data_list[len(blips) :]
+
+    def estimate_image_size(self, image_data):
+        """
+        Estimate the bytes an image adds to the report, from its header
+        metadata and the resampling options.
+        """
+        file_path = image_data.file_path
+        metadata = self._metadata_index.get(file_path)
+        if metadata is None:
+            return 0
+        if self._image_dpi is None:
+            return metadata["file_size"]
+
+        width, height = metadata["width"], metadata["height"]
+        if image_data.rotate_image:
+            width, height = height, width
+        target_height = min(height, round(PICTURE_HEIGHT.inches * self._image_dpi))
+        num_pixels = target_height * width * target_height / height
+
+        bits = jpeg_bits_per_pixel(self._jpeg_quality)
+        return min(int(num_pixels * bits / 8), metadata["file_size"])
+
+    def split_volumes(self, max_pages=None, max_bytes=None):
+        """
+        Split the images into volumes of whole pages, each with at most
+        max_pages pages and about max_bytes estimated bytes.
+        Return a list of (start_index, count).
+        """
+        volumes = []
+        start_index = 0
+        num_pages = 0
+        num_bytes = 0
+        for page_start in range(0, len(self._image_data), 2):
+            page_images = self._image_data[page_start : page_start + 2]
+            page_bytes = PAGE_XML_SIZE + sum(
+                self.estimate_image_size(image_data) for image_data in page_images
+            )
+            is_full = (max_pages and num_pages >= max_pages) or (
+                max_bytes and num_bytes + page_bytes > max_bytes
+            )
+            if num_pages and is_full:
+                volumes.append((start_index, page_start - start_index))
+                start_index = page_start
+                num_pages = 0
+                num_bytes = 0
+            num_pages += 1
+            num_bytes += page_bytes
+        if num_pages:
+            volumes.append((start_index, len(self._image_data) - start_index))
+
+        return volumes
+
+    def generate_doc(self, progress=None, cancel_event=None):
+        """
+        progress: called as progress(finished_pages, num_pages) after each
+        page.
+        cancel_event: a threading.Event, GenerationCancelled is raised before
+        the next page once it is set.
+        With max_output_bytes, the document is saved in memory to check its
+        size, and generated again with a smaller budget if it's over. save()
+        then writes the bytes saved for the check.
+        """
+        self._saved_report = None
+        if not self._max_output_bytes:
+            for _ in self.iter_pages(progress, cancel_event):
+                pass
+            return
+
+        def build(progress):
+            for _ in self.iter_pages(progress, cancel_event):
+                pass
+            output = io.BytesIO()
+            with self.metrics.timer("size_check"):
+                StreamingDocxWriter(self.doc, output).save()
+            self._saved_report = output
+            return output.tell()
+
+        self._generate_in_size_limit(build, progress)
+
+    def generate_streaming(self, file, progress=None, cancel_event=None):
+        """
+        Generate the report and write it to file page by page. The images and
+        body of every finished page are written out and released, so memory
+        use doesn't grow with the number of images. Don't call save() after.
+        progress and cancel_event are the same as in generate_doc.
+        With max_output_bytes, a report written over the limit is written
+        again with a smaller budget, file must then be a path or seekable.
+        """
+        if not self._max_output_bytes:
+            self._write_streaming(file, progress, cancel_event)
+            return
+
+        is_path = isinstance(file, (str, os.PathLike))
+        start = None if is_path else file.tell()
+
+        def write(progress):
+            if not is_path:
+                file.seek(start)
+                file.truncate()
+            self._write_streaming(file, progress, cancel_event)
+            if is_path:
+                return os.path.getsize(file)
+            return file.tell() - start
+
+        self._generate_in_size_limit(write, progress)
+
+    def _generate_in_size_limit(self, write, progress):
+        """
+        Call write(progress) to generate the report until the size it
+        returns is within max_output_bytes. Each time it's over, the budget
+        of the pictures is computed again from the bytes written besides the
+        pictures, starting from the settings of the last pass. Progress is
+        only reported the first time. Raise OutputSizeExceeded after
+        MAX_SIZE_CHECKS tries.
+        """
+        self._written_overhead = None
+        self._budget_settings = None
+        for check in range(MAX_SIZE_CHECKS):
+            if check:
+                self.doc = self._template.document()
+                self._page_template = None
+                progress = None
+            size = write(progress)
+            self.metrics.count("size_checks")
+            if size <= self._max_output_bytes:
+                return
+            logger.info(
+                "Report written in %d bytes, over the limit of %d",
+                size,
+                self._max_output_bytes,
+            )
+            self._written_overhead = size - self._picture_bytes
+        raise OutputSizeExceeded(self._max_output_bytes, size)
+
+    def generate_append(self, source_file, file, progress=None, cancel_event=None):
+        """
+        Append the images to the report in source_file, made by this class,
+        and write the result to file. The empty slot on the last page is
+        filled first, the new pages continue the photo numbers and keep the
+        title of the report. The existing pages and images are copied as
+        they are, so the cost only depends on the number of new images.
+        progress and cancel_event are the same as in generate_doc.
+        """
+        with self.metrics.timer("load"):
+            self.doc = docx.Document(source_file)
+            index_document(self.doc)
+        self._page_template = None
+        image_data_list = self._image_data
+
+        empty_slot_table = None
+        last_number = 0
+        tbl_lst = self.doc.element.body.tbl_lst
+        if tbl_lst:
+            tbl = tbl_lst[-1]
+            table = Table(tbl, self.doc._body)
+            try:
+                numbers = [
+                    _Cell(tbl.tr_lst[slot * 3 + 1].tc_lst[3], table).text.strip()
+                    for slot in range(2)
+                ]
+                last_number = int(numbers[1] or numbers[0])
+            except (IndexError, ValueError):
+                raise ValueError(f"{source_file} is not a generated report")
+            if not numbers[1]:
+                empty_slot_table = table
+            title_p = tbl.getprevious()
+            if title_p is not None and title_p.tag == qn("w:p"):
+                self._report_title = Paragraph(title_p, self.doc._body).text
+        self._first_number = last_number + 1
+
+        # 先填滿最後一頁的空位
+        if empty_slot_table is not None and image_data_list:
+            image_data = image_data_list[0]
+            picture, metrics = prepare_image_data(
+                image_data,
+                self._image_dpi,
+                self._jpeg_quality,
+                self._rotate_in_xml,
+                self._cache,
+            )
+            self.metrics.merge(metrics)
+            self._fill_slot(
+                empty_slot_table,
+                1,
+                image_data,
+                picture,
+                self.get_datetime(image_data),
+                self._first_number,
+            )
+            self._first_number += 1
+            self._image_data = image_data_list[1:]
+        if self._image_data and tbl_lst:
+            self.doc.add_page_break()
+
+        self._write_streaming(file, progress, cancel_event, source=source_file)
+
+    def _write_streaming(self, file, progress, cancel_event, source=None):
+        writer = StreamingDocxWriter(self.doc, file, source)
+        try:
+            for _ in self.iter_pages(progress, cancel_event):
+                with self.metrics.timer("write"):
+                    writer.flush()
+        except BaseException:
+            writer.abort()
+            raise
+        with self.metrics.timer("write"):
+            writer.close()
+
+    def iter_pages(self, progress=None, cancel_event=None):
+        """
+        Add the pages of the report, yield the page index after each page.
+        With a page cache, unchanged pages are copied from it.
+        """
         num_iamge_data = len(self._image_data)
         num_pages = (num_iamge_data + 1) // 2
+        fingerprints = [None] * num_pages
+        cached_pages = [None] * num_pages
+        if self._page_cache is not None:
+            with self.metrics.timer("fingerprint"):
+                for i in range(num_pages):
+                    fingerprints[i] = self._page_fingerprint(i * 2)
+                    cached_pages[i] = self._page_cache.get(fingerprints[i])
+        # 只準備需要重建的頁面的圖片
+        build_image_data = [
+            image_data
+            for i in range(num_pages)
+            if cached_pages[i] is None
+            for image_data in self._image_data[i * 2 : i * 2 + 2]
+        ]
+        if self._max_output_bytes:
+            pictures = self._fit_output_size(build_image_data, cancel_event)
+            prepared_images = (
+                (picture, self.get_datetime(image_data))
+                for picture, image_data in zip(pictures, build_image_data)
+            )
+        else:
+            prepared_images = self._iter_prepared_images(
+                build_image_data, self._image_dpi, self._jpeg_quality
+            )
+
+        try:
+            for i in range(num_pages):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise GenerationCancelled()
+                start_index = i * 2
+                if cached_pages[i] is not None:
+                    with self.metrics.timer("page_reuse"):
+                        self._insert_cached_page(
+                            *cached_pages[i],
+                            self._image_data[start_index : start_index + 2],
+                        )
+                    self.metrics.count("pages_reused")
+                else:
+                    if start_index + 2 <= num_iamge_data:
+                        page_images = [next(prepared_images), next(prepared_images)]
+                    else:
+                        page_images = [next(prepared_images)]
+                    elements = self.add_table(start_index, page_images)
+                    if fingerprints[i] is not None:
+                        sources = self._picture_sources(
+                            self._image_data[start_index : start_index + 2]
+                        )
+                        if sources is not None:
+                            self._page_cache.put(fingerprints[i], elements, sources)
+                if i != num_pages - 1:
+                    self.doc.add_page_break()
+                if progress is not None:
+                    progress(i + 1, num_pages)
+                yield i
+        finally:
+            # 結束處理池, 不再準備剩下的圖片
+            prepared_images.close()
+
+    def _fit_output_size(self, image_data_list, cancel_event=None):
+        """
+        Prepare the pictures of image_data_list to fit the report in
+        max_output_bytes, with the least lossy (dpi, quality) step from
+        image_dpi and jpeg_quality down through size_budget_steps that fits.
+        Embedded originals are first tried as they are.
+        If the first pass is over the budget and there are many images, the
+        step is searched with a sample of them first, its share of the
+        budget as in the first pass, then with all of them from the step
+        found, see _search_budget.
+        When the report is generated again because it was written over the
+        limit, the search starts from the settings that fit last time and the
+        budget leaves the bytes written besides the pictures.
+        Return the pictures of the step that fits, raise OutputSizeExceeded
+        if even the lowest settings don't.
+        """
+        num_pages = (len(self._image_data) + 1) // 2
+        overhead = self._written_overhead
+        if overhead is None:
+            overhead = self._template.saved_size() + num_pages * PAGE_SAVED_SIZE
+        budget = self._max_output_bytes - overhead
+        if budget <= 0:
+            raise OutputSizeExceeded(self._max_output_bytes, overhead)
+        settings = self._budget_settings or (self._image_dpi, self._jpeg_quality)
+        steps = [settings]
+        if settings[0] is None:
+            # 原檔超過上限時, 從起始解析度開始重新取樣
+            settings = (BUDGET_START_DPI, settings[1])
+            steps.append(settings)
+        steps.extend(size_budget_steps(*settings))
 
-        for i in range(num_pages):
-            start_index = i * 2
-            if start_index + 2 <= num_iamge_data:
-                self.add_table(start_index, 2)
+        sizes, pictures = self._prepare_pass(
+            image_data_list, steps[0], budget, cancel_event
+        )
+        self.metrics.count("size_passes")
+        if pictures is not None:
+            return self._use_budget_pass(steps[0], sizes, pictures, budget)
+
+        start = None
+        slope = 1.0
+        sample = []
+        if len(image_data_list) > 2 * BUDGET_SAMPLE_SIZE:
+            sample = [
+                i * len(image_data_list) // BUDGET_SAMPLE_SIZE
+                for i in range(BUDGET_SAMPLE_SIZE)
+            ]
+        sample_sizes = [sizes[i] for i in sample]
+        if sum(sample_sizes):
+            start, slope, _, _ = self._search_budget(
+                [image_data_list[i] for i in sample],
+                steps,
+                budget * sum(sample_sizes) / sum(sizes),
+                sample_sizes,
+                start,
+                slope,
+                False,
+                cancel_event,
+            )
+
+        index, _, sizes, pictures = self._search_budget(
+            image_data_list, steps, budget, sizes, start, slope, True, cancel_event
+        )
+        if pictures is None:
+            raise OutputSizeExceeded(self._max_output_bytes, sum(sizes) + overhead)
+        return self._use_budget_pass(steps[index], sizes, pictures, budget)
+
+    def _use_budget_pass(self, settings, sizes, pictures, budget):
+        self._budget_settings = settings
+        self._picture_bytes = sum(sizes)
+        logger.info(
+            "Images prepared at %s dpi, quality %d: %d bytes of %d",
+            settings[0],
+            settings[1],
+            sum(sizes),
+            budget,
+        )
+        return pictures
+
+    def _search_budget(
+        self,
+        image_data_list,
+        steps,
+        budget,
+        first_sizes,
+        start,
+        slope,
+        keep_pictures,
+        cancel_event,
+    ):
+        """
+        Search steps, (dpi, quality) settings from the least to the most
+        lossy, for the least lossy one that fits the pictures of
+        image_data_list in budget bytes. first_sizes are their sizes with
+        steps[0], which don't fit.
+        Each pass prepares all the pictures with one step, steps[start]
+        first if it's given. The step of the next pass is predicted from the
+        measured sizes: predict_picture_size only ranks the steps, the slope
+        of the measured log sizes over the predicted ones, slope until two
+        passes are measured, sets how far to go. A step that fits in less
+        than BUDGET_FILL_RATIO of the budget is followed by the least lossy
+        step above it predicted to fit, unless it's known not to.
+        After MAX_BUDGET_PASSES passes without a fit, a last pass with
+        keep_pictures uses the lowest step.
+        Return (index, slope, sizes, pictures) of the step that fits, or of
+        the last pass if none does, pictures is then None, and so is it
+        without keep_pictures. Without a fit, index is the step predicted to
+        fit.
+        """
+        fit_heights = [self._fit_height(image_data) for image_data in image_data_list]
+        log_sizes = [
+            math.log(
+                max(
+                    sum(
+                        predict_picture_size(size, fit_height, steps[0], step)
+                        for size, fit_height in zip(first_sizes, fit_heights)
+                    ),
+                    1,
+                )
+            )
+            for step in steps
+        ]
+        log_budget = math.log(budget)
+        keep_limit = budget if keep_pictures else None
+        # 量得的 {設定的索引: 大小的對數}, 超過預算的最低設定及符合預算的最高設定
+        points = {0: math.log(max(sum(first_sizes), 1))}
+        low, high = 0, len(steps)
+        fit = None
+        sizes = first_sizes
+        index = start
+        for _ in range(MAX_BUDGET_PASSES):
+            if index is None:
+                # 在已知超過及已知符合的設定之間, 找損失最少且預測符合的設定
+                index = next(
+                    (
+                        i
+                        for i in range(low + 1, high)
+                        if predict_log_size(points, log_sizes, i, slope) <= log_budget
+                    ),
+                    None,
+                )
+                if index is None:
+                    if fit is not None or low == len(steps) - 1:
+                        index = low if fit is None else high
+                        break
+                    index = len(steps) - 1
+            sizes, pictures = self._prepare_pass(
+                image_data_list, steps[index], keep_limit, cancel_event
+            )
+            self.metrics.count("size_passes")
+            total = sum(sizes)
+            logger.debug(
+                "%d pictures at %s dpi, quality %d: %d bytes of %d",
+                len(image_data_list),
+                *steps[index],
+                total,
+                budget,
+            )
+            points[index] = math.log(max(total, 1))
+            if total <= budget:
+                high = index
+                fit = (index, sizes, pictures)
+                if total >= budget * BUDGET_FILL_RATIO:
+                    break
             else:
-                self.add_table(start_index, 1)
-            if i != num_pages - 1:
-                self.doc.add_page_break()
+                low = index
+            slope = measured_slope(points, log_sizes, log_budget, slope)
+            index = None
+        else:
+            if fit is None and keep_pictures and low < len(steps) - 1:
+                # 修正後仍超過上限, 最後改用最低設定
+                index = len(steps) - 1
+                sizes, pictures = self._prepare_pass(
+                    image_data_list, steps[index], keep_limit, cancel_event
+                )
+                self.metrics.count("size_passes")
+                if sum(sizes) <= budget:
+                    fit = (index, sizes, pictures)
+
+        if fit is None:
+            return index, slope, sizes, None
+        return fit[0], slope, fit[1], fit[2]
+
+    def _prepare_pass(self, image_data_list, settings, keep_limit, cancel_event):
+        """
+        Prepare all pictures with the (dpi, quality) settings.
+        Return (sizes, pictures), pictures is None if their total size
+        exceeds keep_limit, or if keep_limit is None.
+        """
+        sizes = []
+        pictures = None if keep_limit is None else []
+        num_bytes = 0
+        prepared_images = self._iter_prepared_images(image_data_list, *settings)
+        try:
+            for image_data, (picture, _) in zip(image_data_list, prepared_images):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise GenerationCancelled()
+                if picture is None:
+                    size = os.path.getsize(image_data.file_path)
+                else:
+                    size = len(picture)
+                sizes.append(size)
+                num_bytes += size
+                if pictures is None:
+                    continue
+                # 超過上限時這次的結果不會使用, 不再保留圖片以限制記憶體用量
+                if num_bytes > keep_limit:
+                    pictures = None
+                else:
+                    pictures.append(picture)
+        finally:
+            prepared_images.close()
+        return sizes, pictures
+
+    def _fit_height(self, image_data):
+        # 原圖對應照片欄位高度方向的像素數
+        metadata = self._metadata_index.get(image_data.file_path)
+        if metadata is None:
+            return None
+        if image_data.rotate_image:
+            return metadata["width"]
+        return metadata["height"]
+
+    def _iter_prepared_images(self, image_data_list, dpi, quality):
+        """
+        Yield (picture, datetime) of image_data_list in order, prepared with
+        dpi and quality. With several workers the images are prepared in a
+        process pool, keeping a bounded number of images in flight ahead of
+        the table assembly.
+        """
+        options = (dpi, quality, self._rotate_in_xml, self._cache)
+        if self._workers <= 1:
+            for image_data in image_data_list:
+                picture, metrics = prepare_image_data(image_data, *options)
+                self.metrics.merge(metrics)
+                yield picture, self.get_datetime(image_data)
+            return
+
+        executor = create_process_pool(self._workers)
+        try:
+            pending = deque()
+            for image_data in image_data_list:
+                future = executor.submit(prepare_image_data, image_data, *options)
+                pending.append((image_data, future))
+                if len(pending) >= self._workers * 4:
+                    yield self._pop_prepared_image(pending)
+            while pending:
+                yield self._pop_prepared_image(pending)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def _pop_prepared_image(self, pending):
+        image_data, future = pending.popleft()
+        # 等待時間長表示圖片處理跟不上表格組裝
+        with self.metrics.timer("wait_images"):
+            picture, metrics = future.result()
+        self.metrics.merge(metrics)
+        return picture, self.get_datetime(image_data)
 
     def save(self, file):
-        self.doc.save(file)
+        # 與 Document.save() 相同, 但圖片不再壓縮一次
+        with self.metrics.timer("save"):
+            if self._saved_report is None:
+                StreamingDocxWriter(self.doc, file).save()
+                return
+            # 檢查大小時已寫出, 不再產生一次
+            with self._saved_report.getbuffer() as data:
+                if isinstance(file, (str, os.PathLike)):
+                    with open(file, "wb") as fp:
+                        fp.write(data)
+                else:
+                    file.write(data)
 
     def clear(self):
-        self.doc = docx.Document()
+        self._saved_report = None
+        self.doc = self._template.document()
+        self._page_template = None
 
     def get_datetime(self, image_data):
         # get datetime in string ex:108年09月29日17時12分17秒
-        if image_data["use_image_time"]:
-            img = Image.open(image_data["file_path"])
-            try:
-                exif = img._getexif()
-                datatime = exif.get(36867)
-                date = datatime.split(" ")[0].split(":")
-                time = datatime.split(" ")[1].split(":")
-                str_datetime = "{}年{}月{}日{}時{}分{}秒".format(
-                    str(int(date[0]) - 1911),
-                    date[1],
-                    date[2],
-                    time[0],
-                    time[1],
-                    time[2],
-                )
-            except:
-                str_datetime = "年月日時分秒"
-        else:
-            year = image_data["time"]["year"]
-            month = image_data["time"]["month"]
-            day = image_data["time"]["day"]
-            hour = image_data["time"]["hour"]
-            minute = image_data["time"]["minute"]
-            second = image_data["time"]["second"]
-            str_datetime = f"{year}年{month}月{day}日{hour}時{minute}分{second}秒"
+        metadata = None
+        if image_data.use_image_time:
+            with self.metrics.timer("exif_read"):
+                metadata = self._metadata_index.get(image_data.file_path)
+        return format_image_time(image_data, metadata)
 
-        return str_datetime
+    @staticmethod
+    def rotate_picture(shape):
+        """
+        Rotate an inline picture 90 degrees counterclockwise in the document
+        XML, the image part is left untouched.
+        """
+        inline = shape._inline
+        # 與 Word 相同: wp:extent 維持圖形未旋轉的大小 (與 a:ext 一致),
+        # 旋轉後外框的差距記在 wp:effectExtent, 可為負值
+        cx, cy = inline.extent.cx, inline.extent.cy
+        effect_extent = inline.find(qn("wp:effectExtent"))
+        if effect_extent is None:
+            effect_extent = OxmlElement("wp:effectExtent")
+            inline.extent.addnext(effect_extent)
+        left = (cy - cx) // 2
+        top = (cx - cy) // 2
+        effect_extent.set("l", str(left))
+        effect_extent.set("r", str(cy - cx - left))
+        effect_extent.set("t", str(top))
+        effect_extent.set("b", str(cx - cy - top))
+        # DrawingML 的角度單位為 1/60000 度, 順時針為正
+        xfrm = inline.graphic.graphicData.pic.spPr.xfrm
+        xfrm.set("rot", str(270 * 60000))
 
-    def rotate_image(self, file_path):
+    @staticmethod
+    def rotate_image(file_path, metrics=None):
         """
-        Rotate image 90 degrees and save as a tempprary file.
-        Return temporary file name.
+        Rotate image 90 degrees in memory and keep the source format.
+        Return the encoded image bytes.
         """
-        tmp_image = tempfile.NamedTemporaryFile(suffix=".png", delete=False, mode="w+")
-        img = Image.open(file_path)
-        img = img.rotate(90, expand=True)
-        img.save(tmp_image.name, "png")
-        tmp_image.close()
+        if metrics is None:
+            metrics = Metrics()
+
+        with metrics.timer("decode"):
+            img = Image.open(file_path)
+            image_format = img.format
+            params = {}
+            if image_format in ("JPEG", "MPO"):
+                # 沿用原圖的量化表及取樣, 畫質及檔案大小與原圖相近
+                image_format = "JPEG"
+                params["qtables"] = img.quantization
+                params["subsampling"] = JpegImagePlugin.get_sampling(img)
+            if "icc_profile" in img.info:
+                params["icc_profile"] = img.info["icc_profile"]
+            img.load()
 
-        return tmp_image.name
+        with metrics.timer("rotate"):
+            img = img.transpose(Image.ROTATE_90)
+        with metrics.timer("encode"):
+            output = io.BytesIO()
+            img.save(output, image_format, **params)
+        return output.getvalue()
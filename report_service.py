@@ -0,0 +1,541 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from PIL import Image
+from docx_template import report_template
+from image_cache import ImageCache
+from image_manager import ImageManager
+from metrics import Metrics, JsonLinesSink, LoggingSink
+from project_store import ImageRecord
+from report_controller import process_context
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "pdf": "application/pdf",
+}
+
+# 請求內容上限, export_data 每張照片約 100 bytes
+MAX_REQUEST_BYTES = 16 * 1024**2
+
+# 計算延遲百分位數的最近工作數
+LATENCY_WINDOW = 200
+
+# 工作行程保留的 ImageManager, 頁面快取在工作之間重複使用
+_worker_image_manager = None
+
+
+def init_worker():
+    """
+    Initialize a worker process: load the modules and the state reused by
+    every job it renders.
+    """
+    global _worker_image_manager
+    Image.init()
+    report_template()
+    _worker_image_manager = ImageManager()
+
+
+def render_report(import_data, title, file_name, output_format, report_options):
+    """
+    Render one job in a worker process.
+    Return the wall clock start time and the metrics record of the report.
+    """
+    started_at = time.time()
+    image_manager = _worker_image_manager
+    image_manager.import_data(import_data)
+    image_manager.update_report_title(title)
+    metrics = Metrics()
+    try:
+        image_manager.generate_report(
+            file_name, output_format=output_format, metrics=metrics, **report_options
+        )
+    finally:
+        # 只保留頁面快取, EXIF 資料不跨工作保留, 記憶體用量才不會一直增加
+        image_manager.clear_image_metadata()
+    return started_at, metrics.record()
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "p50": round(values[(len(values) - 1) // 2], 6),
+        "p95": round(values[int((len(values) - 1) * 0.95)], 6),
+        "max": round(values[-1], 6),
+    }
+
+
+class QueueFull(Exception):
+    """
+    Raised when a job is submitted while max_queue jobs are unfinished.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("Too many unfinished jobs")
+        self.retry_after = retry_after
+
+
+class ReportJob:
+    __slots__ = (
+        "id",
+        "title",
+        "output_format",
+        "file_name",
+        "num_images",
+        "status",
+        "submitted_at",
+        "started_at",
+        "finished_at",
+        "error",
+        "metrics",
+        "future",
+    )
+
+    def __init__(self, title, output_format, file_name, num_images):
+        self.id = uuid.uuid4().hex
+        self.title = title
+        self.output_format = output_format
+        self.file_name = file_name
+        self.num_images = num_images
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.metrics = None
+        self.future = None
+
+    def latency(self):
+        """
+        Return the seconds waited in the queue, rendering and in total,
+        None until the job is finished.
+        """
+        if self.finished_at is None or self.started_at is None:
+            return None
+        return {
+            "queue_wait": round(self.started_at - self.submitted_at, 6),
+            "render": round(self.finished_at - self.started_at, 6),
+            "total": round(self.finished_at - self.submitted_at, 6),
+        }
+
+    def to_dict(self):
+        status = self.status
+        if status == "queued" and self.future is not None and self.future.running():
+            status = "running"
+        return {
+            "id": self.id,
+            "status": status,
+            "title": self.title,
+            "format": self.output_format,
+            "images": self.num_images,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+            "latency": self.latency(),
+            "error": self.error,
+        }
+
+
+class ReportService:
+    """
+    Queue of report jobs rendered by a pool of worker processes.
+
+    Each worker keeps an ImageManager between jobs, so its page cache is
+    reused, its EXIF data are cleared after each job. At most max_queue
+    jobs may be unfinished, submit() raises QueueFull beyond that. The reports are written to output_dir,
+    the latest max_finished finished jobs and their reports are kept.
+    report_options are passed to ImageManager.generate_report, e.g.
+    image_dpi or cache. The metrics record of every job, with its latency,
+    is emitted to metrics_sink.
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        workers=None,
+        max_queue=16,
+        max_finished=100,
+        report_options=None,
+        metrics_sink=None,
+    ):
+        self._output_dir = output_dir
+        self._workers = workers or os.cpu_count()
+        self._max_queue = max_queue
+        self._max_finished = max_finished
+        self._report_options = dict(report_options or {})
+        self._metrics_sink = metrics_sink or LoggingSink(__name__)
+        self._jobs = {}
+        self._finished_ids = deque()
+        self._num_unfinished = 0
+        self._counters = {
+            "submitted": 0,
+            "finished": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "rejected": 0,
+        }
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+        self._executor = self._start_executor()
+
+    def _start_executor(self):
+        executor = ProcessPoolExecutor(
+            self._workers, mp_context=process_context(), initializer=init_worker
+        )
+        # 先啟動全部工作行程, 第一個工作不必等待載入
+        for future in [executor.submit(time.time) for _ in range(self._workers)]:
+            future.result()
+        return executor
+
+    def submit(self, import_data, title="", output_format="docx"):
+        """
+        Queue a report of import_data, in the export_data format.
+        Return the ReportJob.
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {output_format}")
+        if not isinstance(import_data, list):
+            raise ValueError("Data must be a list of images")
+        for data in import_data:
+            try:
+                ImageRecord.from_dict(data)
+            except Exception:
+                raise ValueError(f"Invalid image entry {data!r}")
+
+        with self._lock:
+            if self._num_unfinished >= self._max_queue:
+                self._counters["rejected"] += 1
+                raise QueueFull(self._retry_after())
+            self._num_unfinished += 1
+            self._counters["submitted"] += 1
+
+        job = ReportJob(title, output_format, None, len(import_data))
+        job.file_name = os.path.join(self._output_dir, f"{job.id}.{output_format}")
+        args = (import_data, title, job.file_name, output_format, self._report_options)
+        # 多個 HTTP 執行緒可能同時發現處理池異常, 只重新建立一次
+        with self._lock:
+            try:
+                try:
+                    job.future = self._executor.submit(render_report, *args)
+                except BrokenProcessPool:
+                    # 工作行程異常結束後重新建立處理池
+                    logger.warning("Worker pool broken, restarting it")
+                    self._executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = self._start_executor()
+                    job.future = self._executor.submit(render_report, *args)
+            except BaseException:
+                self._num_unfinished -= 1
+                raise
+            self._jobs[job.id] = job
+        job.future.add_done_callback(lambda future: self._job_done(job, future))
+        logger.info("Job %s queued with %d images", job.id, job.num_images)
+        return job
+
+    def _retry_after(self):
+        # 以最近工作的平均處理時間估計佇列清空所需秒數
+        renders = [latency["render"] for latency in self._latencies]
+        mean_render = sum(renders) / len(renders) if renders else 1.0
+        return max(1, round(mean_render * self._num_unfinished / self._workers))
+
+    def _job_done(self, job, future):
+        job.finished_at = time.time()
+        if future.cancelled():
+            job.status = "cancelled"
+            with self._lock:
+                self._num_unfinished -= 1
+                self._counters["cancelled"] += 1
+            return
+        expired_ids = []
+        try:
+            job.started_at, job.metrics = future.result()
+        except BaseException as e:
+            job.status = "failed"
+            job.error = str(e) or type(e).__name__
+            logger.error("Job %s failed: %s", job.id, job.error)
+        else:
+            job.status = "finished"
+            latency = job.latency()
+            logger.info("Job %s finished in %.2fs", job.id, latency["total"])
+            record = dict(job.metrics, job_id=job.id, images=job.num_images)
+            record.update(latency)
+            try:
+                self._metrics_sink(record)
+            except Exception:
+                logger.exception("Metrics sink failed for job %s", job.id)
+        finally:
+            # sink 或其他錯誤都不能佔住佇列的位置
+            with self._lock:
+                self._num_unfinished -= 1
+                self._counters[job.status] += 1
+                if job.status == "finished":
+                    self._latencies.append(job.latency())
+                self._finished_ids.append(job.id)
+                while len(self._finished_ids) > self._max_finished:
+                    expired_ids.append(self._finished_ids.popleft())
+        for job_id in expired_ids:
+            self.delete(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def delete(self, job_id):
+        """
+        Cancel a queued job, or forget a finished job and remove its report.
+        Return False if the job is unknown or still rendering.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return False
+        if job.finished_at is None and not job.future.cancel():
+            return False
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        try:
+            os.unlink(job.file_name)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            jobs = list(self._jobs.values())
+            counters = dict(self._counters)
+        statuses = [job.to_dict()["status"] for job in jobs]
+        return {
+            "workers": self._workers,
+            "max_queue": self._max_queue,
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            **counters,
+            "latency": {
+                name: percentiles([latency[name] for latency in latencies])
+                for name in ("queue_wait", "render", "total")
+            },
+        }
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs?title=...&format=docx|pdf   body: export_data JSON, queue a job
+    GET /jobs/<id>                          job status
+    GET /jobs/<id>/report                   download the finished report
+    DELETE /jobs/<id>                       cancel or forget a job
+    GET /metrics                            queue and latency statistics
+    """
+
+    server_version = "ReportService/1.0"
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/jobs":
+            return self._send_error(HTTPStatus.NOT_FOUND, "Not found")
+        try:
+            length = int(self.headers["Content-Length"])
+        except (TypeError, ValueError):
+            return self._send_error(
+                HTTPStatus.BAD_REQUEST, "Missing or invalid Content-Length"
+            )
+        if length < 0:
+            return self._send_error(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if length > MAX_REQUEST_BYTES:
+            return self._send_error(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request too large"
+            )
+        query = parse_qs(url.query)
+        title = query.get("title", [""])[0]
+        output_format = query.get("format", ["docx"])[0]
+        try:
+            import_data = json.loads(self.rfile.read(length))
+            job = self.server.service.submit(import_data, title, output_format)
+        except QueueFull as e:
+            return self._send_error(
+                HTTPStatus.TOO_MANY_REQUESTS,
+                str(e),
+                {"Retry-After": str(e.retry_after)},
+            )
+        except ValueError as e:
+            return self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+        self._send_json(
+            HTTPStatus.ACCEPTED, job.to_dict(), {"Location": f"/jobs/{job.id}"}
+        )
+
+    def do_GET(self):
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if parts == ["metrics"]:
+            return self._send_json(HTTPStatus.OK, self.server.service.stats())
+        job = self._get_job(parts)
+        if job is None:
+            return self._send_error(HTTPStatus.NOT_FOUND, "Unknown job")
+        if len(parts) == 2:
+            return self._send_json(HTTPStatus.OK, job.to_dict())
+        if job.status != "finished":
+            return self._send_error(
+                HTTPStatus.CONFLICT, f"Job is {job.to_dict()['status']}"
+            )
+        try:
+            fp = open(job.file_name, "rb")
+        except FileNotFoundError:
+            return self._send_error(HTTPStatus.NOT_FOUND, "Report removed")
+        with fp:
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", OUTPUT_FORMATS[job.output_format])
+            self.send_header("Content-Length", str(os.fstat(fp.fileno()).st_size))
+            self.send_header(
+                "Content-Disposition",
+                f'attachment; filename="report.{job.output_format}"',
+            )
+            self.end_headers()
+            shutil.copyfileobj(fp, self.wfile)
+
+    def do_DELETE(self):
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        job = self._get_job(parts)
+        if job is None or len(parts) != 2:
+            return self._send_error(HTTPStatus.NOT_FOUND, "Unknown job")
+        if not self.server.service.delete(job.id):
+            return self._send_error(HTTPStatus.CONFLICT, "Job is running")
+        self.send_response(HTTPStatus.NO_CONTENT)
+        self.end_headers()
+
+    def _get_job(self, parts):
+        if len(parts) not in (2, 3) or parts[0] != "jobs":
+            return None
+        if len(parts) == 3 and parts[2] != "report":
+            return None
+        return self.server.service.get(parts[1])
+
+    def _send_json(self, status, obj, headers=None):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, headers=None):
+        self._send_json(status, {"error": message}, headers)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+class ReportServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, ReportRequestHandler)
+        self.service = service
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve report generation to other programs over local HTTP."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument(
+        "--output-dir", default="reports", help="directory of the generated reports"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of processes generating reports",
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=16,
+        help="number of unfinished jobs before new ones are rejected",
+    )
+    parser.add_argument(
+        "--max-finished",
+        type=int,
+        default=100,
+        help="number of finished jobs whose reports are kept",
+    )
+    parser.add_argument(
+        "--dpi",
+        type=int,
+        default=200,
+        help="resample images to this dpi, 0 embeds the original files",
+    )
+    parser.add_argument("--quality", type=int, default=85, help="JPEG quality")
+    parser.add_argument(
+        "--template", help="Word document whose page setup and styles are used"
+    )
+    parser.add_argument("--cache-dir", help="directory of the prepared image cache")
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        help="size limit of the prepared image cache in MB",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="append the metrics of each job as a JSON line to this file,"
+        " instead of logging them",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="log every job and request"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(name)s %(message)s",
+    )
+    report_options = {"image_dpi": args.dpi or None, "jpeg_quality": args.quality}
+    if args.template:
+        report_options["template_file"] = os.path.abspath(args.template)
+    if args.cache_dir:
+        report_options["cache"] = ImageCache(
+            args.cache_dir, args.cache_size * 1024 * 1024
+        )
+    service = ReportService(
+        args.output_dir,
+        args.workers,
+        args.max_queue,
+        args.max_finished,
+        report_options,
+        JsonLinesSink(args.metrics) if args.metrics else None,
+    )
+    server = ReportServer((args.host, args.port), service)
+    print(f"Serving reports on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
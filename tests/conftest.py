@@ -0,0 +1,38 @@
+import os
+import sys
+import pytest
+
+# 模組都在專案根目錄
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EXIF_IFD = 0x8769
+DATETIME_ORIGINAL = 36867
+
+
+@pytest.fixture
+def make_photo(tmp_path):
+    """
+    Return make_photo(name, size, color, exif_datetime) writing a JPEG to
+    tmp_path and returning its path.
+    """
+    from PIL import Image
+
+    def make_photo(name, size=(320, 240), color=(200, 80, 40), exif_datetime=None):
+        file_path = str(tmp_path / name)
+        img = Image.new("RGB", size, color)
+        exif = Image.Exif()
+        if exif_datetime is not None:
+            exif[EXIF_IFD] = {DATETIME_ORIGINAL: exif_datetime}
+        img.save(file_path, "jpeg", quality=90, exif=exif.tobytes())
+        return file_path
+
+    return make_photo
+
+
+@pytest.fixture
+def photos(make_photo):
+    # 5 張不同顏色的照片, 共 3 頁
+    return [
+        make_photo(f"photo_{i}.jpg", color=(40 * i, 120, 255 - 40 * i))
+        for i in range(5)
+    ]
@@ -0,0 +1,92 @@
+import zipfile
+from docx import Document
+from docx.oxml.ns import qn
+from project_store import ImageRecord
+from report_controller import ReportController
+
+
+def generate(photos, file_name, streaming):
+    report_generator = ReportController(image_dpi=72)
+    report_generator.set_data(
+        [ImageRecord(path, rotate_image=i == 1) for i, path in enumerate(photos)],
+        "標題",
+    )
+    if streaming:
+        report_generator.generate_streaming(file_name)
+    else:
+        report_generator.generate_doc()
+        report_generator.save(file_name)
+
+
+def page_breaks(document):
+    return len(document.element.body.xpath(".//w:br[@w:type='page']"))
+
+
+def test_streaming_matches_saved_report(tmp_path, photos):
+    saved = str(tmp_path / "saved.docx")
+    streamed = str(tmp_path / "streamed.docx")
+    generate(photos, saved, streaming=False)
+    generate(photos, streamed, streaming=True)
+
+    saved_document = Document(saved)
+    streamed_document = Document(streamed)
+    assert len(streamed_document.tables) == len(saved_document.tables) == 3
+    assert page_breaks(streamed_document) == page_breaks(saved_document) == 2
+    assert len(streamed_document.inline_shapes) == len(photos)
+    assert [table._tbl.xml for table in streamed_document.tables] == [
+        table._tbl.xml for table in saved_document.tables
+    ]
+    # 版面設定仍在內文最後
+    assert streamed_document.element.body[-1].tag == qn("w:sectPr")
+
+
+def test_streaming_stores_images_and_deflates_xml(tmp_path, photos):
+    streamed = str(tmp_path / "streamed.docx")
+    generate(photos, streamed, streaming=True)
+
+    with zipfile.ZipFile(streamed) as zipf:
+        assert zipf.testzip() is None
+        infos = {info.filename: info for info in zipf.infolist()}
+    media = [info for name, info in infos.items() if name.startswith("word/media/")]
+    assert len(media) == len(photos)
+    assert all(info.compress_type == zipfile.ZIP_STORED for info in media)
+    assert infos["word/document.xml"].compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_appended_report_continues_numbers(tmp_path, photos):
+    first = str(tmp_path / "first.docx")
+    generate(photos[:3], first, streaming=True)
+
+    report_generator = ReportController(image_dpi=72)
+    report_generator.set_data([ImageRecord(path) for path in photos[3:]], "標題")
+    appended = str(tmp_path / "appended.docx")
+    report_generator.generate_append(first, appended)
+
+    document = Document(appended)
+    assert len(document.tables) == 3
+    assert len(document.inline_shapes) == len(photos)
+    numbers = [
+        table.cell(row, 3).text
+        for table in document.tables
+        for row in (1, 4)
+        if table.cell(row, 3).text
+    ]
+    assert numbers == ["1", "2", "3", "4", "5"]
+
+
+def test_streaming_with_template_keeps_header(tmp_path, photos):
+    template = Document()
+    template.sections[0].header.paragraphs[0].text = "公司名稱"
+    template.add_paragraph("removed from the report")
+    template_file = str(tmp_path / "template.docx")
+    template.save(template_file)
+
+    report_generator = ReportController(image_dpi=72, template_file=template_file)
+    report_generator.set_data([ImageRecord(path) for path in photos], "標題")
+    streamed = str(tmp_path / "streamed.docx")
+    report_generator.generate_streaming(streamed)
+
+    document = Document(streamed)
+    assert document.sections[0].header.paragraphs[0].text == "公司名稱"
+    assert "removed from the report" not in [p.text for p in document.paragraphs]
+    assert len(document.tables) == 3
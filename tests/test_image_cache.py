@@ -0,0 +1,83 @@
+import os
+import pickle
+import time
+from image_cache import ImageCache
+
+
+def disk_size(cache):
+    return sum(entry.stat().st_size for entry in cache._iter_entries())
+
+
+def test_pickled_copies_share_size_without_scanning(tmp_path, monkeypatch):
+    cache = ImageCache(str(tmp_path / "cache"), max_bytes=10_000)
+    cache.put("a" * 64, b"x" * 1000)
+    assert cache._read_size()[0] == 1000
+
+    # 如同 ProcessPoolExecutor 傳給各工作行程的複本
+    copies = [pickle.loads(pickle.dumps(cache)) for _ in range(2)]
+    scans = []
+    monkeypatch.setattr(ImageCache, "_scan_size", lambda self: scans.append(1))
+    copies[0].put("b" * 64, b"x" * 2000)
+    copies[1].put("c" * 64, b"x" * 3000)
+    assert scans == []
+    assert cache._read_size()[0] == disk_size(cache) == 6000
+
+
+def test_size_cap_holds_across_copies(tmp_path):
+    cache = ImageCache(str(tmp_path / "cache"), max_bytes=10_000)
+    copies = [pickle.loads(pickle.dumps(cache)) for _ in range(4)]
+    for i in range(40):
+        copies[i % 4].put(f"{i:064x}", b"x" * 1000)
+        assert disk_size(cache) <= cache.max_bytes
+    assert cache._read_size()[0] == disk_size(cache)
+
+
+def test_stale_size_is_rescanned(tmp_path):
+    cache = ImageCache(str(tmp_path / "cache"), max_bytes=10_000)
+    cache.put("a" * 64, b"x" * 1000)
+    # 遺失的更新使大小檔偏小, 超過 rescan_interval 後重新掃描
+    cache._write_size(0, time.time() - cache.rescan_interval - 1)
+    cache.put("b" * 64, b"x" * 1000)
+    assert cache._read_size()[0] == 2000
+
+
+def test_locked_entries_are_skipped(tmp_path, monkeypatch):
+    cache = ImageCache(str(tmp_path / "cache"), max_bytes=2500)
+    cache.put("a" * 64, b"x" * 1000)
+
+    # 如 Windows 上其他行程正開啟項目時, 取代及刪除都會失敗
+    def locked(*args):
+        raise PermissionError("in use")
+
+    monkeypatch.setattr(os, "replace", locked)
+    monkeypatch.setattr(os, "unlink", locked)
+    cache.put("a" * 64, b"y" * 1000)
+    cache.put("b" * 64, b"x" * 2000)
+    cache.max_bytes = 0
+    cache.evict()
+    monkeypatch.undo()
+
+    assert cache.get("a" * 64) == b"x" * 1000
+    assert cache.get("b" * 64) is None
+
+
+def test_stale_temp_files_are_removed(tmp_path):
+    cache = ImageCache(str(tmp_path / "cache"), max_bytes=10_000)
+    cache.put("a" * 64, b"x" * 1000)
+    # 中斷的寫入留下的暫存檔: 大小檔的在快取目錄下, 項目的在子目錄下
+    old_time = time.time() - 7200
+    stale_files = [
+        os.path.join(cache.directory, "size_stale.tmp"),
+        os.path.join(cache.directory, "aa", "entry_stale.tmp"),
+    ]
+    recent_file = os.path.join(cache.directory, "size_recent.tmp")
+    for file_path in stale_files + [recent_file]:
+        with open(file_path, "wb") as fp:
+            fp.write(b"x")
+    for file_path in stale_files:
+        os.utime(file_path, (old_time, old_time))
+
+    cache.evict()
+    assert not any(os.path.exists(file_path) for file_path in stale_files)
+    assert os.path.exists(recent_file)
+    assert cache.get("a" * 64) == b"x" * 1000
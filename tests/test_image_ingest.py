@@ -0,0 +1,86 @@
+import os
+import shutil
+from image_ingest import detect_image_format, scan_images
+from image_manager import ImageManager
+
+
+def make_folder(tmp_path, make_photo):
+    """
+    Return a folder with photos taken at different times in sub folders,
+    a JPEG and a PNG saved with wrong extensions, and files that aren't
+    images.
+    """
+    from PIL import Image
+
+    folder = tmp_path / "folder"
+    (folder / "sub" / "deeper").mkdir(parents=True)
+    names = {
+        "sub/late.jpg": "2019:09:30 08:00:00",
+        "early.jpg": "2019:09:29 17:12:17",
+        "sub/deeper/middle.jpg": "2019:09:30 07:00:00",
+    }
+    for i, (name, exif_datetime) in enumerate(names.items()):
+        file_path = make_photo(
+            f"photo_{i}.jpg", color=(60 * i, 100, 200), exif_datetime=exif_datetime
+        )
+        os.replace(file_path, folder / name)
+    os.replace(make_photo("jpeg.txt", color=(0, 0, 0)), folder / "jpeg.txt")
+    Image.new("RGB", (32, 24), (10, 20, 30)).save(folder / "png.jpg", "png")
+    (folder / "notes.jpg").write_text("not an image")
+    (folder / "empty.png").write_bytes(b"")
+    return folder
+
+
+def test_images_are_found_by_content_and_sorted_by_time(tmp_path, make_photo):
+    folder = make_folder(tmp_path, make_photo)
+    assert detect_image_format(str(folder / "jpeg.txt")) == "JPEG"
+    assert detect_image_format(str(folder / "png.jpg")) == "PNG"
+    assert detect_image_format(str(folder / "notes.jpg")) is None
+
+    images = scan_images(str(folder), workers=2)
+    # 有拍攝時間的依時間排序, 沒有的排在最後並依檔名排序
+    assert [os.path.relpath(path, folder) for path, _ in images] == [
+        "early.jpg",
+        os.path.join("sub", "deeper", "middle.jpg"),
+        os.path.join("sub", "late.jpg"),
+        "jpeg.txt",
+        "png.jpg",
+    ]
+    metadata = dict(images)[str(folder / "png.jpg")]
+    assert (metadata["width"], metadata["height"]) == (32, 24)
+    assert metadata["datetime"] is None
+
+
+def test_duplicates_are_skipped_by_content(tmp_path, make_photo):
+    folder = make_folder(tmp_path, make_photo)
+    shutil.copy(folder / "early.jpg", folder / "sub" / "copy.jpg")
+    # 與已知檔案內容相同的照片也略過
+    known_file = str(tmp_path / "known.jpg")
+    shutil.copy(folder / "sub" / "late.jpg", known_file)
+
+    images = scan_images(str(folder), known_files=[known_file])
+    file_paths = [path for path, _ in images]
+    assert str(folder / "early.jpg") in file_paths
+    assert str(folder / "sub" / "copy.jpg") not in file_paths
+    assert str(folder / "sub" / "late.jpg") not in file_paths
+    assert len(file_paths) == 4
+
+
+def test_known_files_are_skipped(tmp_path, make_photo):
+    folder = make_folder(tmp_path, make_photo)
+    known_file = str(folder / "early.jpg")
+    images = scan_images(str(folder), known_files=[known_file])
+    assert known_file not in [path for path, _ in images]
+    assert len(images) == 4
+
+
+def test_add_folder(tmp_path, make_photo):
+    folder = make_folder(tmp_path, make_photo)
+    image_manager = ImageManager()
+    image_manager.add_image([str(folder / "png.jpg")])
+    added_paths = image_manager.add_folder(str(folder))
+    assert len(added_paths) == 4
+    assert image_manager.get_file_paths() == [str(folder / "png.jpg")] + added_paths
+    # 背景掃描的結果之後才加入, 期間已加入的照片不重複加入
+    images = scan_images(str(folder))
+    assert image_manager.add_scanned_images(images) == []
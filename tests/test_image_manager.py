@@ -0,0 +1,134 @@
+import concurrent.futures
+import os
+import stat
+import threading
+import pytest
+import report_controller
+from image_manager import ImageManager, generate_volume
+from report_controller import GenerationCancelled
+from metrics import Metrics
+
+
+def test_volumes_share_cpus_and_workers(tmp_path, photos, monkeypatch):
+    pool_sizes = []
+    volume_workers = []
+
+    class RecordingPool(concurrent.futures.ProcessPoolExecutor):
+        def __init__(self, max_workers=None, **kwargs):
+            pool_sizes.append(max_workers)
+            super().__init__(max_workers, **kwargs)
+
+        def submit(self, fn, *args, **kwargs):
+            if fn is generate_volume:
+                volume_workers.append(args[6]["workers"])
+            return super().submit(fn, *args, **kwargs)
+
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", RecordingPool)
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    file_names = image_manager.generate_report(
+        str(tmp_path / "report.docx"), max_pages=1, workers=4
+    )
+
+    # 3 個分冊, 同時最多 2 個 (CPU 數), 各分到 4 // 2 個 workers
+    assert len(file_names) == 3
+    assert all(os.path.exists(file_name) for file_name in file_names)
+    assert pool_sizes == [2]
+    assert volume_workers == [2, 2, 2]
+
+
+@pytest.mark.skipif(os.name == "nt", reason="POSIX permissions")
+def test_reports_keep_file_permissions(tmp_path, photos):
+    umask = os.umask(0o022)
+    os.umask(umask)
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    file_name = str(tmp_path / "report.docx")
+    image_manager.generate_report(file_name, photos[:3])
+    assert stat.S_IMODE(os.stat(file_name).st_mode) == 0o666 & ~umask
+
+    # 附加時沿用原報告的權限
+    os.chmod(file_name, 0o640)
+    image_manager.append_report(file_name, photos[3:])
+    assert stat.S_IMODE(os.stat(file_name).st_mode) == 0o640
+
+
+def test_volumes_with_unpicklable_sink(tmp_path, photos):
+    records = []
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    file_names = image_manager.generate_report(
+        str(tmp_path / "report.docx"),
+        max_pages=1,
+        metrics=Metrics(lambda record: records.append(record)),
+    )
+
+    # 各分冊的計時合併成一筆紀錄
+    assert len(file_names) == 3
+    assert len(records) == 1
+    assert records[0]["volumes"] == 3
+    assert records[0]["phases"]["decode"]["calls"] == len(photos)
+
+
+def test_volume_processes_limits_volumes_at_a_time(tmp_path, photos, monkeypatch):
+    pool_sizes = []
+
+    class RecordingPool(concurrent.futures.ProcessPoolExecutor):
+        def __init__(self, max_workers=None, **kwargs):
+            pool_sizes.append(max_workers)
+            super().__init__(max_workers, **kwargs)
+
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", RecordingPool)
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    file_names = image_manager.generate_report(
+        str(tmp_path / "report.docx"), max_pages=1, volume_processes=1
+    )
+    assert len(file_names) == 3
+    assert pool_sizes == [1]
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"streaming": True}, {"workers": 2}, {"max_pages": 1}],
+)
+def test_cancel_leaves_no_output(tmp_path, photos, options):
+    cancel_event = threading.Event()
+
+    def progress(finished_pages, num_pages):
+        # 第一頁完成後取消
+        cancel_event.set()
+
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    with pytest.raises(GenerationCancelled):
+        image_manager.generate_report(
+            str(tmp_path / "report.docx"),
+            progress=progress,
+            cancel_event=cancel_event,
+            **options,
+        )
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        os.path.basename(file_path) for file_path in photos
+    )
+
+
+def test_process_pools_dont_fork(tmp_path, photos, monkeypatch):
+    start_methods = []
+
+    class RecordingPool(concurrent.futures.ProcessPoolExecutor):
+        def __init__(self, max_workers=None, mp_context=None, **kwargs):
+            start_methods.append(mp_context and mp_context.get_start_method())
+            super().__init__(max_workers, mp_context=mp_context, **kwargs)
+
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", RecordingPool)
+    monkeypatch.setattr(report_controller, "ProcessPoolExecutor", RecordingPool)
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    image_manager.generate_report(str(tmp_path / "report.docx"), workers=2)
+    image_manager.generate_report(str(tmp_path / "volume.docx"), max_pages=2)
+
+    # 處理圖片的處理池及分冊的處理池
+    assert len(start_methods) == 2
+    assert all(method in ("forkserver", "spawn") for method in start_methods)
@@ -0,0 +1,62 @@
+import os
+import pickle
+from docx import Document
+from image_manager import ImageManager
+from image_metadata import ImageMetadataIndex
+
+
+def rewrite_photo(make_photo, file_path, exif_datetime):
+    make_photo(os.path.basename(file_path), exif_datetime=exif_datetime)
+    # 確保修改時間不同, 有些檔案系統的時間精度較低
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def report_text(file_name):
+    document = Document(file_name)
+    return "".join(
+        cell.text
+        for table in document.tables
+        for row in table.rows
+        for cell in row.cells
+    )
+
+
+def test_photo_changed_in_place_is_read_again(tmp_path, make_photo):
+    file_path = make_photo("photo.jpg", exif_datetime="2020:01:01 10:00:00")
+    image_manager = ImageManager()
+    image_manager.add_image([file_path])
+    image_manager.update_use_image_time(file_path, True)
+    image_manager.generate_report(str(tmp_path / "first.docx"))
+    assert "109年01月01日10時00分00秒" in report_text(str(tmp_path / "first.docx"))
+
+    rewrite_photo(make_photo, file_path, "2021:02:03 04:05:06")
+    image_manager.generate_report(str(tmp_path / "second.docx"))
+
+    assert "110年02月03日04時05分06秒" in report_text(str(tmp_path / "second.docx"))
+
+
+def test_background_thread_ends_when_files_are_read(photos):
+    index = ImageMetadataIndex()
+    index.add(photos)
+    thread = index._thread
+    index.wait()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert index.get(photos[0])["width"] == 320
+
+    index.add(photos[:1])
+    index.wait()
+    assert index.get(photos[0]) is not None
+
+
+def test_pickled_index_checks_signatures(make_photo):
+    file_path = make_photo("photo.jpg", exif_datetime="2020:01:01 10:00:00")
+    index = ImageMetadataIndex()
+    assert index.get(file_path)["datetime"] == "2020:01:01 10:00:00"
+
+    copy = pickle.loads(pickle.dumps(index))
+    rewrite_photo(make_photo, file_path, "2021:02:03 04:05:06")
+
+    assert copy.get(file_path)["datetime"] == "2021:02:03 04:05:06"
@@ -0,0 +1,54 @@
+import json
+import logging
+from metrics import JsonLinesSink, LoggingSink, Metrics
+
+
+def run_phase(metrics):
+    with metrics.timer("encode"):
+        pass
+    metrics.count("images", 2)
+
+
+def test_json_lines_sink(tmp_path):
+    file_path = str(tmp_path / "metrics.jsonl")
+    for i in range(2):
+        metrics = Metrics(JsonLinesSink(file_path))
+        run_phase(metrics)
+        metrics.emit(file_names=[f"report_{i}.docx"])
+
+    with open(file_path, encoding="utf-8") as fp:
+        records = [json.loads(line) for line in fp]
+    assert [record["file_names"] for record in records] == [
+        ["report_0.docx"],
+        ["report_1.docx"],
+    ]
+    for record in records:
+        assert record["phases"]["encode"]["calls"] == 1
+        assert record["phases"]["encode"]["seconds"] >= 0
+        assert record["counters"] == {"images": 2}
+
+
+def test_logging_sink(caplog):
+    metrics = Metrics(LoggingSink("report_metrics_test"))
+    run_phase(metrics)
+    with caplog.at_level(logging.INFO, logger="report_metrics_test"):
+        metrics.emit()
+
+    (log_record,) = caplog.records
+    assert log_record.name == "report_metrics_test"
+    assert log_record.levelno == logging.INFO
+    message = log_record.getMessage()
+    assert message.startswith("Report metrics: encode ")
+    assert message.endswith("| images 2")
+
+
+def test_merge_adds_timings_and_counters():
+    metrics = Metrics()
+    run_phase(metrics)
+    other = Metrics()
+    run_phase(other)
+    metrics.merge(other)
+
+    record = metrics.record()
+    assert record["phases"]["encode"]["calls"] == 2
+    assert record["counters"] == {"images": 4}
@@ -0,0 +1,108 @@
+from docx import Document
+from image_cache import ImageCache
+from image_manager import ImageManager
+from metrics import Metrics
+
+
+def generate(image_manager, file_name, **report_options):
+    metrics = Metrics()
+    image_manager.generate_report(file_name, metrics=metrics, **report_options)
+    return metrics.counters
+
+
+def test_pages_cached_with_image_cache_reused_without_it(tmp_path, photos):
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    cache = ImageCache(str(tmp_path / "cache"))
+    generate(image_manager, str(tmp_path / "first.docx"), cache=cache)
+
+    counters = generate(image_manager, str(tmp_path / "second.docx"))
+
+    assert counters.get("pages_reused", 0) == 0
+    assert len(Document(str(tmp_path / "second.docx")).inline_shapes) == len(photos)
+
+
+def body_xml(file_name):
+    return [table._tbl.xml for table in Document(file_name).tables]
+
+
+def test_unchanged_pages_are_reused(tmp_path, photos):
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    cache = ImageCache(str(tmp_path / "cache"))
+    generate(image_manager, str(tmp_path / "first.docx"), cache=cache, streaming=True)
+
+    counters = generate(
+        image_manager, str(tmp_path / "second.docx"), cache=cache, streaming=True
+    )
+
+    assert counters["pages_reused"] == 3
+    assert counters.get("pages", 0) == 0
+    assert body_xml(str(tmp_path / "second.docx")) == body_xml(
+        str(tmp_path / "first.docx")
+    )
+    assert len(Document(str(tmp_path / "second.docx")).inline_shapes) == len(photos)
+
+
+def test_edited_page_is_rebuilt(tmp_path, photos):
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    cache = ImageCache(str(tmp_path / "cache"))
+    generate(image_manager, str(tmp_path / "first.docx"), cache=cache)
+
+    image_manager.update_time(photos[2], "year", "110")
+    counters = generate(image_manager, str(tmp_path / "second.docx"), cache=cache)
+
+    assert counters["pages_reused"] == 2
+    assert counters["pages"] == 1
+    tables = Document(str(tmp_path / "second.docx")).tables
+    assert "110年" in tables[1].cell(1, 1).text
+
+
+def test_changed_photo_file_invalidates_page(tmp_path, photos, make_photo):
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    cache = ImageCache(str(tmp_path / "cache"))
+    generate(image_manager, str(tmp_path / "first.docx"), cache=cache)
+
+    make_photo("photo_4.jpg", size=(240, 320))
+    counters = generate(image_manager, str(tmp_path / "second.docx"), cache=cache)
+
+    assert counters["pages_reused"] == 2
+    assert counters["pages"] == 1
+
+
+def test_evicted_picture_is_prepared_again(tmp_path, photos):
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    cache = ImageCache(str(tmp_path / "cache"))
+    generate(image_manager, str(tmp_path / "first.docx"), cache=cache)
+
+    cache.clear()
+    counters = generate(image_manager, str(tmp_path / "second.docx"), cache=cache)
+
+    assert counters["pages_reused"] == 3
+    assert counters["cache_misses"] == len(photos)
+    assert len(Document(str(tmp_path / "second.docx")).inline_shapes) == len(photos)
+
+
+def test_template_change_clears_pages(tmp_path, photos):
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    cache = ImageCache(str(tmp_path / "cache"))
+    generate(image_manager, str(tmp_path / "first.docx"), cache=cache)
+
+    template_file = str(tmp_path / "template.docx")
+    Document().save(template_file)
+    image_manager.set_report_template(template_file)
+    counters = generate(image_manager, str(tmp_path / "second.docx"), cache=cache)
+
+    assert counters.get("pages_reused", 0) == 0
+
+
+def test_pages_without_image_cache_are_not_kept(tmp_path, photos):
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    generate(image_manager, str(tmp_path / "first.docx"))
+
+    assert len(image_manager._page_cache._pages) == 0
@@ -0,0 +1,204 @@
+import re
+import zlib
+import pytest
+from image_manager import ImageManager
+from pdf_report import (
+    COLUMN_WIDTHS,
+    MARGIN,
+    PAGE_WIDTH,
+    PICTURE_HEIGHT_PT,
+    ROW_HEIGHTS,
+    TITLE_FONT_SIZE,
+    PdfReportController,
+    text_width,
+)
+from project_store import ImageRecord
+from report_controller import ROW_HEIGHTS_CM
+
+OBJECT_REF = re.compile(rb"(\d+) 0 R")
+
+
+def read_pdf(file_name):
+    """
+    Return {number: object bytes} of a PDF written by PdfWriter, checking
+    that every cross-reference entry points to its object.
+    """
+    with open(file_name, "rb") as fp:
+        data = fp.read()
+    assert data.startswith(b"%PDF-1.4\n")
+    match = re.search(rb"startxref\n(\d+)\n%%EOF\n$", data)
+    assert match is not None
+    xref_position = int(match.group(1))
+    xref, trailer = data[xref_position:].split(b"trailer\n")
+    lines = xref.splitlines()
+    assert lines[0] == b"xref"
+    first, count = (int(value) for value in lines[1].split())
+    assert first == 0 and len(lines) == count + 2
+    assert b"/Size %d " % count in trailer
+
+    objects = {}
+    for number, line in enumerate(lines[3:], 1):
+        offset, generation, kind = line.split()
+        assert (generation, kind) == (b"00000", b"n")
+        start = int(offset)
+        header = b"%d 0 obj\n" % number
+        assert data[start : start + len(header)] == header
+        end = data.index(b"\nendobj\n", start)
+        objects[number] = data[start + len(header) : end]
+    root = int(re.search(rb"/Root (\d+) 0 R", trailer).group(1))
+    return objects, root
+
+
+def read_stream(obj):
+    length = int(re.search(rb"/Length (\d+)", obj).group(1))
+    start = obj.index(b"stream\n") + len(b"stream\n")
+    data = obj[start : start + length]
+    assert obj[start + length :] == b"\nendstream"
+    if b"/FlateDecode" in obj[:start]:
+        data = zlib.decompress(data)
+    return data
+
+
+def read_pages(file_name):
+    """
+    Return [(content, {name: image object}) of each page] in order.
+    """
+    objects, root = read_pdf(file_name)
+    pages_number = int(re.search(rb"/Pages (\d+) 0 R", objects[root]).group(1))
+    pages = objects[pages_number]
+    kids = re.search(rb"/Kids \[([^\]]*)\]", pages).group(1)
+    page_numbers = [int(number) for number in OBJECT_REF.findall(kids)]
+    assert b"/Count %d" % len(page_numbers) in pages
+
+    result = []
+    for number in page_numbers:
+        page = objects[number]
+        assert b"/Type /Page " in page
+        assert b"/Parent %d 0 R" % pages_number in page
+        contents = int(re.search(rb"/Contents (\d+) 0 R", page).group(1))
+        xobjects = re.search(rb"/XObject << ([^>]*) >>", page).group(1)
+        images = {
+            name.decode(): objects[int(image_number)]
+            for name, image_number in re.findall(rb"/(Im\d) (\d+) 0 R", xobjects)
+        }
+        result.append((read_stream(objects[contents]), images))
+    return result
+
+
+def image_placements(content):
+    """
+    Return [(image name, cm matrix)] of the images drawn by content.
+    """
+    return [
+        (name.decode(), tuple(float(value) for value in matrix.split()))
+        for matrix, name in re.findall(
+            rb"q ([-\d. ]+) cm /(Im\d) Do Q", content
+        )
+    ]
+
+
+def image_size(image):
+    width = int(re.search(rb"/Width (\d+)", image).group(1))
+    height = int(re.search(rb"/Height (\d+)", image).group(1))
+    return width, height
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_pdf_report_is_valid(tmp_path, photos, workers):
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    file_name = str(tmp_path / "report.pdf")
+    assert image_manager.generate_report(file_name, workers=workers) == [file_name]
+
+    # 5 張照片共 3 頁, 每頁 2 張, 最後一頁 1 張
+    pages = read_pages(file_name)
+    assert len(pages) == 3
+    for content, images in pages[:2]:
+        assert sorted(images) == ["Im0", "Im1"]
+        assert [name for name, _ in image_placements(content)] == ["Im0", "Im1"]
+    content, images = pages[2]
+    assert list(images) == ["Im0"]
+    assert [name for name, _ in image_placements(content)] == ["Im0"]
+    for _, images in pages:
+        for image in images.values():
+            stream = read_stream(image)
+            assert b"/Filter /DCTDecode" in image
+            assert stream.startswith(b"\xff\xd8")
+
+
+def test_pdf_rotated_pictures(tmp_path, make_photo):
+    file_path = make_photo("landscape.jpg", size=(400, 300))
+    table_center = MARGIN + sum(COLUMN_WIDTHS) / 2
+    for rotate_in_xml in (False, True):
+        report_generator = PdfReportController(
+            image_dpi=72, rotate_in_xml=rotate_in_xml
+        )
+        report_generator.set_data(
+            [ImageRecord(file_path), ImageRecord(file_path, rotate_image=True)],
+            "標題",
+        )
+        file_name = str(tmp_path / f"report_{rotate_in_xml}.pdf")
+        report_generator.generate_streaming(file_name)
+
+        ((content, images),) = read_pages(file_name)
+        (_, upper), (_, lower) = image_placements(content)
+        # 未旋轉的照片: 不旋轉的矩陣, 高度為照片欄位高度
+        a, b, c, d, x, y = upper
+        assert b == c == 0
+        assert d == pytest.approx(PICTURE_HEIGHT_PT, abs=0.01)
+        assert x + a / 2 == pytest.approx(table_center, abs=0.01)
+        assert image_size(images["Im0"])[0] > image_size(images["Im0"])[1]
+
+        a, b, c, d, x, y = lower
+        width, height = image_size(images["Im1"])
+        if rotate_in_xml:
+            # 像素不旋轉, 以矩陣逆時針轉 90 度: 圖片的寬顯示為高
+            assert width > height
+            assert a == d == 0
+            assert b > 0 and c < 0
+            shown_width, shown_height = -c, b
+            left = x - shown_width
+        else:
+            assert width < height
+            assert b == c == 0
+            shown_width, shown_height = a, d
+            left = x
+        assert shown_height == pytest.approx(PICTURE_HEIGHT_PT, abs=0.01)
+        assert shown_width / shown_height == pytest.approx(300 / 400, abs=0.01)
+        assert left + shown_width / 2 == pytest.approx(table_center, abs=0.01)
+        # 下方照片在上方照片的表格之下, 於照片欄位中垂直置中
+        picture_bottom = upper[5] - (ROW_HEIGHTS[0] - upper[3]) / 2 - sum(ROW_HEIGHTS)
+        assert y == pytest.approx(
+            picture_bottom + (ROW_HEIGHTS[0] - shown_height) / 2, abs=0.01
+        )
+
+
+def test_pdf_long_title_is_wrapped(tmp_path, make_photo):
+    file_path = make_photo("photo.jpg")
+    report_generator = PdfReportController(image_dpi=72)
+    title = "工程施工照片" * 10 + " Construction photos of the site"
+    report_generator.set_data([ImageRecord(file_path)], title)
+    file_name = str(tmp_path / "report.pdf")
+    report_generator.generate_streaming(file_name)
+
+    ((content, _),) = read_pages(file_name)
+    lines = [
+        (float(x), float(y), bytes.fromhex(text.decode()).decode("utf-16-be"))
+        for x, y, text in re.findall(
+            rb"BT /F1 %d Tf [-\d.]+ Tc ([-\d.]+) ([-\d.]+) Td <([0-9A-F]+)> Tj ET"
+            % TITLE_FONT_SIZE,
+            content,
+        )
+    ]
+    # 標題換行, 每行置中且不超過表格寬度
+    assert len(lines) == 3
+    assert "".join(text for _, _, text in lines).replace(" ", "") == title.replace(
+        " ", ""
+    )
+    for x, _, text in lines:
+        assert x >= MARGIN - 0.01
+        assert x + text_width(text, TITLE_FONT_SIZE) <= PAGE_WIDTH - MARGIN + 0.01
+    assert lines[0][1] > lines[1][1] > lines[2][1]
+    # 與 Word 的表格列高一致
+    expected_heights = [height * 72 / 2.54 for height in ROW_HEIGHTS_CM]
+    assert ROW_HEIGHTS == pytest.approx(expected_heights)
@@ -0,0 +1,102 @@
+import threading
+import time
+import preview_cache
+from preview_cache import PreviewCache, load_preview
+
+# 320x240 的照片縮小為 160x120 RGB, 每張 57600 bytes
+PREVIEW_BYTES = 160 * 120 * 3
+
+
+def wait_for_prefetch(cache, timeout=10):
+    deadline = time.monotonic() + timeout
+    while cache.is_prefetching():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def count_loads(monkeypatch):
+    loaded = []
+
+    def counting_load_preview(file_path, max_width, max_height):
+        loaded.append(file_path)
+        return load_preview(file_path, max_width, max_height)
+
+    monkeypatch.setattr(preview_cache, "load_preview", counting_load_preview)
+    return loaded
+
+
+def test_least_recently_used_are_evicted_by_size(photos):
+    cache = PreviewCache(160, 120, max_bytes=PREVIEW_BYTES * 2)
+    assert cache.get(photos[0]).size == (160, 120)
+    cache.get(photos[1])
+    # 使用過的預覽移到最後, 超過大小時先移除最久沒用的
+    cache.get(photos[0])
+    cache.get(photos[2])
+
+    assert cache.peek(photos[0]) is not None
+    assert cache.peek(photos[1]) is None
+    assert cache.peek(photos[2]) is not None
+
+    cache.remove(photos[0])
+    cache.get(photos[3])
+    assert cache.peek(photos[2]) is not None
+
+
+def test_prefetch_prepares_previews_in_background(photos, tmp_path, monkeypatch):
+    loaded = count_loads(monkeypatch)
+    cache = PreviewCache(160, 120)
+    missing = str(tmp_path / "missing.jpg")
+    cache.prefetch(photos[:3] + [missing])
+    wait_for_prefetch(cache)
+
+    assert loaded == photos[:3] + [missing]
+    assert all(cache.peek(path) is not None for path in photos[:3])
+    # 已預先載入的不再解碼, 無法讀取的檔案不再預先載入
+    cache.get(photos[0])
+    cache.prefetch([photos[1], missing, photos[3]])
+    wait_for_prefetch(cache)
+    assert loaded == photos[:3] + [missing, photos[3]]
+    assert cache.peek(photos[3]) is not None
+
+
+def test_prefetch_replaces_pending_paths(photos, monkeypatch):
+    loaded = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_load_preview(file_path, max_width, max_height):
+        loaded.append(file_path)
+        started.set()
+        release.wait()
+        return load_preview(file_path, max_width, max_height)
+
+    monkeypatch.setattr(preview_cache, "load_preview", blocking_load_preview)
+    cache = PreviewCache(160, 120)
+    cache.prefetch(photos[:3])
+    assert started.wait(10)
+    # 載入第一張時再次要求, 尚未載入的路徑被取代
+    cache.prefetch(photos[3:])
+    release.set()
+    wait_for_prefetch(cache)
+    assert loaded == [photos[0]] + photos[3:]
+
+
+def test_jpeg_is_decoded_in_draft_mode(make_photo, monkeypatch):
+    from PIL import JpegImagePlugin
+
+    decoded_sizes = []
+    draft = JpegImagePlugin.JpegImageFile.draft
+
+    def recording_draft(self, mode, size, *args, **kwargs):
+        result = draft(self, mode, size, *args, **kwargs)
+        decoded_sizes.append(self.size)
+        return result
+
+    monkeypatch.setattr(JpegImagePlugin.JpegImageFile, "draft", recording_draft)
+    file_path = make_photo("large.jpg", size=(1600, 1200))
+    preview = load_preview(file_path, 200, 150)
+
+    # 以 1/8 比例解碼, 再縮小到剛好放進預覽大小
+    assert decoded_sizes == [(200, 150)]
+    assert preview.size == (200, 150)
+    assert preview.mode == "RGB"
@@ -0,0 +1,93 @@
+import pytest
+from project_file import ProjectFile
+from project_store import ImageRecord
+
+
+def make_records(count):
+    return [
+        ImageRecord(
+            f"/photos/IMG_{i:04d}.jpg",
+            {"year": "108", "month": "09", "day": str(i + 1)},
+            use_image_time=i % 2 == 0,
+            rotate_image=i == 1,
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def project_path(tmp_path):
+    path = str(tmp_path / "project.rgproj")
+    project_file = ProjectFile(path)
+    project_file.replace(make_records(5))
+    project_file.set_title("測試報告")
+    project_file.close()
+    return path
+
+
+def test_round_trip(project_path):
+    project_file = ProjectFile(project_path)
+    try:
+        assert project_file.title == "測試報告"
+        assert [record.to_dict() for record in project_file] == [
+            record.to_dict() for record in make_records(5)
+        ]
+    finally:
+        project_file.close()
+
+
+def test_records_are_loaded_on_first_use(project_path):
+    project_file = ProjectFile(project_path)
+    try:
+        assert project_file.file_paths() == [
+            record.file_path for record in make_records(5)
+        ]
+        assert project_file._num_unloaded == 5
+        assert project_file["/photos/IMG_0001.jpg"].rotate_image
+        assert project_file._num_unloaded == 4
+    finally:
+        project_file.close()
+
+
+def test_edit_is_saved_at_once(project_path):
+    project_file = ProjectFile(project_path)
+    project_file.update("/photos/IMG_0002.jpg", "hour", "17")
+    project_file.set_all("rotate_image", True)
+    project_file.move("/photos/IMG_0004.jpg", 0)
+    project_file.remove("/photos/IMG_0003.jpg")
+    project_file.close()
+
+    project_file = ProjectFile(project_path)
+    try:
+        assert project_file.file_paths() == [
+            "/photos/IMG_0004.jpg",
+            "/photos/IMG_0000.jpg",
+            "/photos/IMG_0001.jpg",
+            "/photos/IMG_0002.jpg",
+        ]
+        assert project_file["/photos/IMG_0002.jpg"].hour == "17"
+        assert project_file["/photos/IMG_0000.jpg"].hour == ""
+        assert all(record.rotate_image for record in project_file)
+    finally:
+        project_file.close()
+
+
+def test_replace_overwrites_content(project_path):
+    project_file = ProjectFile(project_path)
+    project_file.replace(make_records(2))
+    project_file.close()
+
+    project_file = ProjectFile(project_path)
+    try:
+        assert len(project_file) == 2
+        assert [record.day for record in project_file] == ["1", "2"]
+    finally:
+        project_file.close()
+
+
+def test_not_a_project_file(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(b"\xff\xd8 not a database" * 100)
+
+    with pytest.raises(ValueError):
+        ProjectFile(str(path))
@@ -0,0 +1,105 @@
+import random
+import pytest
+from image_manager import ImageManager
+from project_store import ImageRecord, ImageStore
+
+
+def make_records(count):
+    return [ImageRecord(f"/photos/IMG_{i:04d}.jpg") for i in range(count)]
+
+
+def test_record_dict_round_trip():
+    data = {
+        "time": {
+            "year": "108",
+            "month": "09",
+            "day": "30",
+            "hour": "",
+            "minute": "",
+            "second": "",
+        },
+        "use_image_time": True,
+        "rotate_image": True,
+        "file_path": "/photos/IMG_0001.jpg",
+    }
+    assert ImageRecord.from_dict(data).to_dict() == data
+
+    # 舊格式未存的欄位使用預設值
+    record = ImageRecord.from_dict({"file_path": "/photos/IMG_0002.jpg"})
+    assert record.time == dict.fromkeys(record.time, "")
+    assert not record.use_image_time
+    assert not record.rotate_image
+
+
+def test_store_keeps_order_and_skips_duplicates():
+    records = make_records(3)
+    store = ImageStore(records + [ImageRecord(records[0].file_path)], "標題")
+    assert store.title == "標題"
+    assert store.file_paths() == [record.file_path for record in records]
+    assert store[records[0].file_path] is records[0]
+    assert not store.append(ImageRecord(records[1].file_path))
+    assert store.append(ImageRecord("/photos/new.jpg"))
+    assert list(store)[-1].file_path == "/photos/new.jpg"
+    assert len(store) == 4
+
+    with pytest.raises(ValueError):
+        store.index("/photos/missing.jpg")
+    with pytest.raises(KeyError):
+        store.remove("/photos/missing.jpg")
+
+
+def test_index_follows_removes_and_moves():
+    records = make_records(50)
+    store = ImageStore(records)
+    expected = [record.file_path for record in records]
+    rng = random.Random(0)
+    for i in range(500):
+        operation = rng.random()
+        file_path = rng.choice(expected)
+        if operation < 0.1 and len(expected) > 10:
+            store.remove(file_path)
+            expected.remove(file_path)
+        elif operation < 0.2:
+            record = ImageRecord(f"/photos/added_{i}.jpg")
+            store.append(record)
+            expected.append(record.file_path)
+        elif operation < 0.6:
+            index = rng.randint(-len(expected) - 2, len(expected) + 2)
+            store.move(file_path, index)
+            expected.remove(file_path)
+            expected.insert(index, file_path)
+        # 每次變動後檢查一個位置, 其餘的在後續操作中逐步補上
+        file_path = rng.choice(expected)
+        assert store.index(file_path) == expected.index(file_path)
+
+    assert store.file_paths() == expected
+    for index, file_path in enumerate(expected):
+        assert store.index(file_path) == index
+        assert store.file_path_at(index) == file_path
+
+
+def test_update_and_set_all():
+    store = ImageStore(make_records(3))
+    file_path = store.file_path_at(1)
+    store.update(file_path, "year", "109")
+    assert store[file_path].year == "109"
+    store.set_all("rotate_image", True)
+    assert all(record.rotate_image for record in store)
+    with pytest.raises(AttributeError):
+        store.set_all("file_path", "")
+    with pytest.raises(AttributeError):
+        store.update(file_path, "unknown", 1)
+
+
+def test_export_import_round_trip(photos):
+    image_manager = ImageManager()
+    image_manager.add_image(photos)
+    image_manager.update_time(photos[0], "year", "108")
+    image_manager.update_rotate_image(photos[1], True)
+    image_manager.update_all_use_image_time(True)
+    exported = image_manager.export_data()
+
+    other = ImageManager()
+    other.import_data(exported)
+    assert other.export_data() == exported
+    assert [data["file_path"] for data in exported] == photos
@@ -0,0 +1,114 @@
+import json
+import os
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from docx import Document
+import report_cli
+from image_manager import ImageManager
+from report_cli import main
+
+
+def export_json(json_path, file_paths):
+    image_manager = ImageManager()
+    image_manager.add_image(file_paths)
+    with open(json_path, "w", encoding="utf-8") as fp:
+        json.dump(image_manager.export_data(), fp)
+    return str(json_path)
+
+
+def test_generate_reports(tmp_path, photos, capsys):
+    json_paths = [
+        export_json(tmp_path / "first.json", photos[:3]),
+        export_json(tmp_path / "second.json", photos[3:]),
+    ]
+    output_dir = tmp_path / "reports"
+    assert main([*json_paths, "-o", str(output_dir), "-j", "2", "-t", "標題"]) == 0
+
+    assert sorted(os.listdir(output_dir)) == ["first.docx", "second.docx"]
+    document = Document(str(output_dir / "first.docx"))
+    assert len(document.inline_shapes) == 3
+    assert document.paragraphs[0].text == "標題"
+    assert "2 of 2 reports generated" in capsys.readouterr().out
+
+
+def test_generate_volumes_next_to_json(tmp_path, photos):
+    json_path = export_json(tmp_path / "report.json", photos)
+    assert main([json_path, "--max-pages", "1"]) == 0
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith(".docx")) == [
+        "report_01.docx",
+        "report_02.docx",
+        "report_03.docx",
+    ]
+
+
+def test_missing_photo_fails_only_its_report(tmp_path, photos, capsys):
+    good_json = export_json(tmp_path / "good.json", photos[:2])
+    bad_json = export_json(tmp_path / "bad.json", photos[2:4])
+    os.unlink(photos[3])
+    output_dir = tmp_path / "reports"
+    assert main([good_json, bad_json, "-o", str(output_dir), "-j", "1"]) == 1
+
+    # 失敗的報告不留下檔案, 也不留下暫存檔
+    assert os.listdir(output_dir) == ["good.docx"]
+    captured = capsys.readouterr()
+    assert f"FAILED {bad_json}" in captured.err
+    assert "1 of 2 reports generated" in captured.out
+
+
+def test_same_output_path_is_rejected(tmp_path, photos, capsys):
+    json_paths = []
+    for name in ("a", "b"):
+        os.mkdir(tmp_path / name)
+        json_paths.append(export_json(tmp_path / name / "report.json", photos))
+    output_dir = tmp_path / "reports"
+    with pytest.raises(SystemExit) as exc_info:
+        main([*json_paths, "-o", str(output_dir)])
+
+    assert exc_info.value.code == 2
+    assert "would both be written to" in capsys.readouterr().err
+    assert not output_dir.exists()
+
+
+def test_append_to_report(tmp_path, photos):
+    json_path = export_json(tmp_path / "report.json", photos[:3])
+    assert main([json_path]) == 0
+    export_json(json_path, photos[3:])
+    assert main([json_path, "--append"]) == 0
+
+    document = Document(str(tmp_path / "report.docx"))
+    assert len(document.inline_shapes) == len(photos)
+
+
+@pytest.mark.parametrize(
+    "jobs, workers, expected", [(1, 4, (4, 4)), (2, 4, (2, 2)), (4, 4, (1, 1))]
+)
+def test_jobs_share_cpus(tmp_path, monkeypatch, jobs, workers, expected):
+    job_options = []
+
+    def generate_report_from_json(
+        json_path, output_path, title, report_options, append=False
+    ):
+        job_options.append(report_options)
+        return 0.0
+
+    # 在執行緒中執行, 才能記錄各報告的選項
+    monkeypatch.setattr(
+        report_cli,
+        "ProcessPoolExecutor",
+        lambda max_workers, mp_context: ThreadPoolExecutor(max_workers),
+    )
+    monkeypatch.setattr(
+        report_cli, "generate_report_from_json", generate_report_from_json
+    )
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    json_paths = [str(tmp_path / f"{i}.json") for i in range(4)]
+    args = [*json_paths, "-j", str(jobs), "--workers", str(workers)]
+    assert main(args) == 0
+
+    assert len(job_options) == 4
+    for report_options in job_options:
+        workers_and_volumes = (
+            report_options["workers"],
+            report_options["volume_processes"],
+        )
+        assert workers_and_volumes == expected
@@ -0,0 +1,185 @@
+import io
+import os
+import pytest
+from docx import Document
+from docx.oxml.ns import qn
+from docx_stream import StreamingDocxWriter
+from docx_template import ReportTemplate
+from image_manager import ImageManager
+from metrics import Metrics
+from project_store import ImageRecord
+from report_controller import PICTURE_HEIGHT, OutputSizeExceeded, ReportController
+
+
+def test_rotate_in_xml_keeps_extent_of_shape(tmp_path, make_photo):
+    file_path = make_photo("landscape.jpg", size=(400, 300))
+    report_generator = ReportController(image_dpi=72, rotate_in_xml=True)
+    report_generator.set_data([ImageRecord(file_path, rotate_image=True)], "標題")
+    file_name = str(tmp_path / "report.docx")
+    report_generator.generate_streaming(file_name)
+
+    inline = Document(file_name).inline_shapes[0]._inline
+    extent = inline.extent
+    xfrm = inline.graphic.graphicData.pic.spPr.xfrm
+    assert (extent.cx, extent.cy) == (xfrm.ext.cx, xfrm.ext.cy)
+    assert xfrm.get("rot") == str(270 * 60000)
+
+    # 版面外框為旋轉後的大小: 寬為原圖高, 高為照片欄位高度
+    effect_extent = inline.find(qn("wp:effectExtent"))
+    assert effect_extent is not None
+    assert effect_extent.getprevious() is extent
+    left, right, top, bottom = (
+        int(effect_extent.get(side)) for side in ("l", "r", "t", "b")
+    )
+    assert extent.cx + left + right == extent.cy
+    assert extent.cy + top + bottom == extent.cx == PICTURE_HEIGHT
+    assert left == right and top == bottom == -left
+
+
+@pytest.fixture
+def noisy_photos(tmp_path):
+    # 雜訊照片的大小隨解析度及畫質明顯變化
+    from PIL import Image
+
+    file_paths = []
+    for i in range(6):
+        file_path = str(tmp_path / f"noise_{i}.jpg")
+        Image.effect_noise((640, 480), 60 + i * 5).convert("RGB").save(
+            file_path, quality=90
+        )
+        file_paths.append(file_path)
+    return file_paths
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("fraction", [0.7, 0.5, 0.25])
+def test_report_fits_max_output_bytes(
+    tmp_path, noisy_photos, monkeypatch, streaming, fraction
+):
+    image_manager = ImageManager()
+    image_manager.add_image(noisy_photos)
+    full_size = os.path.getsize(
+        image_manager.generate_report(str(tmp_path / "full.docx"))[0]
+    )
+    written_paths = []
+    init = StreamingDocxWriter.__init__
+
+    def recording_init(self, document, file, *args):
+        if isinstance(file, str):
+            written_paths.append(file)
+        init(self, document, file, *args)
+
+    monkeypatch.setattr(StreamingDocxWriter, "__init__", recording_init)
+
+    max_output_bytes = int(full_size * fraction)
+    metrics = Metrics()
+    (report,) = image_manager.generate_report(
+        str(tmp_path / "report.docx"),
+        streaming=streaming,
+        max_output_bytes=max_output_bytes,
+        metrics=metrics,
+    )
+    # 用到大部分的預算, 不停在第一個符合的設定
+    assert max_output_bytes * 0.7 < os.path.getsize(report) <= max_output_bytes
+    assert len(Document(report).inline_shapes) == len(noisy_photos)
+    # 檢查大小時寫出的報告直接寫入檔案, 不再產生一次
+    assert len(written_paths) == (metrics.counters["size_checks"] if streaming else 0)
+
+
+def test_many_images_fit_max_output_bytes(tmp_path):
+    # 圖片多時先以樣本找出設定
+    from PIL import Image
+
+    file_paths = []
+    for i in range(20):
+        file_path = str(tmp_path / f"noise_{i}.jpg")
+        Image.effect_noise((400, 300), 40 + i * 3).convert("RGB").save(
+            file_path, quality=90
+        )
+        file_paths.append(file_path)
+    image_manager = ImageManager()
+    image_manager.add_image(file_paths)
+    full_size = os.path.getsize(
+        image_manager.generate_report(str(tmp_path / "full.docx"))[0]
+    )
+
+    max_output_bytes = int(full_size * 0.4)
+    (report,) = image_manager.generate_report(
+        str(tmp_path / "report.docx"), max_output_bytes=max_output_bytes
+    )
+    assert max_output_bytes * 0.7 < os.path.getsize(report) <= max_output_bytes
+    assert len(Document(report).inline_shapes) == len(file_paths)
+
+
+def test_report_over_max_output_bytes_is_not_written(tmp_path, noisy_photos):
+    image_manager = ImageManager()
+    image_manager.add_image(noisy_photos)
+    file_name = str(tmp_path / "report.docx")
+    with pytest.raises(OutputSizeExceeded):
+        image_manager.generate_report(file_name, max_output_bytes=50000)
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        os.path.basename(file_path) for file_path in noisy_photos
+    )
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_report_written_over_limit_is_generated_again(
+    tmp_path, noisy_photos, monkeypatch, streaming
+):
+    image_manager = ImageManager()
+    image_manager.add_image(noisy_photos)
+    full_size = os.path.getsize(
+        image_manager.generate_report(str(tmp_path / "full.docx"))[0]
+    )
+    max_output_bytes = full_size // 2
+    # 範本大小估計錯誤時, 依預算準備的圖片寫出後會超過上限
+    monkeypatch.setattr(
+        ReportTemplate, "saved_size", lambda self: -max_output_bytes // 2
+    )
+
+    metrics = Metrics()
+    (report,) = image_manager.generate_report(
+        str(tmp_path / "report.docx"),
+        streaming=streaming,
+        max_output_bytes=max_output_bytes,
+        metrics=metrics,
+    )
+    assert os.path.getsize(report) <= max_output_bytes
+    assert metrics.counters["size_checks"] >= 2
+
+
+def test_rotate_image_keeps_jpeg_format_and_tables(tmp_path):
+    from PIL import Image, JpegImagePlugin
+
+    file_path = str(tmp_path / "photo.jpg")
+    img = Image.new("RGB", (64, 32), (200, 80, 40))
+    img.paste((20, 60, 220), (0, 0, 8, 32))
+    img.save(file_path, "jpeg", quality=60, subsampling=2)
+    source = Image.open(file_path)
+
+    picture = ReportController.rotate_image(file_path)
+    rotated = Image.open(io.BytesIO(picture))
+    assert rotated.format == "JPEG"
+    assert rotated.size == (32, 64)
+    assert rotated.quantization == source.quantization
+    assert JpegImagePlugin.get_sampling(rotated) == JpegImagePlugin.get_sampling(
+        source
+    )
+    # 逆時針轉 90 度: 左邊的藍色移到下方
+    red, _, blue = rotated.getpixel((16, 60))
+    assert blue > 150 and red < 100
+
+
+def test_rotate_image_keeps_png_format(tmp_path):
+    from PIL import Image
+
+    file_path = str(tmp_path / "drawing.png")
+    img = Image.new("RGBA", (64, 32), (200, 80, 40, 255))
+    img.paste((20, 60, 220, 128), (0, 0, 8, 32))
+    img.save(file_path, "png")
+
+    picture = ReportController.rotate_image(file_path)
+    rotated = Image.open(io.BytesIO(picture))
+    assert rotated.format == "PNG"
+    assert rotated.mode == "RGBA"
+    assert rotated.tobytes() == img.transpose(Image.ROTATE_90).tobytes()
@@ -0,0 +1,198 @@
+import http.client
+import json
+import threading
+import time
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from docx import Document
+from image_manager import ImageManager
+import report_service
+from report_service import ReportServer, ReportService
+
+
+@pytest.fixture
+def server(tmp_path):
+    service = ReportService(str(tmp_path / "reports"), workers=1)
+    server = ReportServer(("127.0.0.1", 0), service)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def request(server, method, path, body=None, headers=None):
+    """
+    Send a request, with exactly headers if given, instead of the headers
+    added by http.client.
+    """
+    host, port = server.server_address[:2]
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        if headers is None:
+            connection.request(method, path, body)
+        else:
+            connection.putrequest(method, path, skip_accept_encoding=True)
+            for name, value in headers.items():
+                connection.putheader(name, value)
+            connection.endheaders(body)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def export_data(file_paths):
+    image_manager = ImageManager()
+    image_manager.add_image(file_paths)
+    return json.dumps(image_manager.export_data()).encode("utf-8")
+
+
+def wait_for_job(server, location, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, _, body = request(server, "GET", location)
+        assert status == 200
+        job = json.loads(body)
+        if job["status"] in ("finished", "failed", "cancelled"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"{location} didn't finish")
+
+
+def test_submit_poll_and_download(server, photos, tmp_path):
+    status, headers, body = request(
+        server, "POST", "/jobs?title=Test&format=docx", export_data(photos)
+    )
+    assert status == 202
+    assert json.loads(body)["images"] == len(photos)
+    location = headers["Location"]
+
+    job = wait_for_job(server, location)
+    assert job["status"] == "finished"
+    assert job["latency"]["total"] >= 0
+
+    status, headers, body = request(server, "GET", location + "/report")
+    assert status == 200
+    assert headers["Content-Type"].startswith("application/vnd.openxmlformats")
+    report_path = tmp_path / "downloaded.docx"
+    report_path.write_bytes(body)
+    assert len(Document(str(report_path)).inline_shapes) == len(photos)
+
+    status, _, body = request(server, "GET", "/metrics")
+    assert status == 200
+    assert json.loads(body)["finished"] == 1
+
+
+@pytest.mark.parametrize(
+    "path, body, headers",
+    [
+        ("/jobs", b"not json", None),
+        ("/jobs", b'{"file_path": "a.jpg"}', None),
+        ("/jobs", b'[{"unknown": 1}]', None),
+        ("/jobs?format=odt", b"[]", None),
+        # 沒有或無效的 Content-Length
+        ("/jobs", None, {}),
+        ("/jobs", None, {"Content-Length": "abc"}),
+        ("/jobs", None, {"Content-Length": "-1"}),
+    ],
+)
+def test_bad_request(server, path, body, headers):
+    status, _, body = request(server, "POST", path, body, headers)
+
+    assert status == 400
+    assert json.loads(body)["error"]
+
+
+def test_unknown_job(server):
+    assert request(server, "GET", "/jobs/missing")[0] == 404
+    assert request(server, "GET", "/jobs/missing/report")[0] == 404
+    assert request(server, "DELETE", "/jobs/missing")[0] == 404
+
+
+def test_failed_job(server, tmp_path):
+    missing_photo = str(tmp_path / "missing.jpg")
+    status, headers, _ = request(server, "POST", "/jobs", export_data([missing_photo]))
+    assert status == 202
+
+    job = wait_for_job(server, headers["Location"])
+    assert job["status"] == "failed"
+    assert job["error"]
+
+    status, _, _ = request(server, "GET", headers["Location"] + "/report")
+    assert status == 409
+    status, _, body = request(server, "GET", "/metrics")
+    assert json.loads(body)["failed"] == 1
+
+
+def test_worker_forgets_image_metadata(tmp_path, photos, monkeypatch):
+    # 在目前的行程中執行工作行程的函式
+    monkeypatch.setattr(report_service, "_worker_image_manager", None)
+    report_service.init_worker()
+    image_manager = report_service._worker_image_manager
+    for i in range(2):
+        import_data = json.loads(export_data(photos[i * 2 : i * 2 + 2]))
+        file_name = str(tmp_path / f"report_{i}.docx")
+        report_service.render_report(import_data, "", file_name, "docx", {})
+        assert image_manager._metadata_index.snapshot() == {}
+    image_manager._metadata_index.wait()
+    assert image_manager._metadata_index.snapshot() == {}
+
+
+def test_failing_metrics_sink_frees_queue_slot(tmp_path, photos):
+    def failing_sink(record):
+        raise OSError("disk full")
+
+    service = ReportService(
+        str(tmp_path / "reports"), workers=1, max_queue=1, metrics_sink=failing_sink
+    )
+    try:
+        # 佇列只有一個位置, sink 失敗後仍能送出下一個工作
+        for i in range(2):
+            job = service.submit(json.loads(export_data(photos[:2])))
+            deadline = time.monotonic() + 60
+            while service.stats()["finished"] < i + 1:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            assert job.status == "finished"
+    finally:
+        service.close()
+
+
+def test_broken_pool_is_restarted_once(tmp_path, monkeypatch):
+    service = ReportService(str(tmp_path / "reports"), workers=1)
+    start_executor = service._start_executor
+    starts = []
+
+    class BrokenPool:
+        def submit(self, *args):
+            raise BrokenProcessPool()
+
+        def shutdown(self, *args, **kwargs):
+            pass
+
+    def counting_start_executor():
+        starts.append(1)
+        # 讓其他執行緒在重新建立期間送出工作
+        time.sleep(0.2)
+        return start_executor()
+
+    service._executor.shutdown()
+    service._executor = BrokenPool()
+    monkeypatch.setattr(service, "_start_executor", counting_start_executor)
+    try:
+        jobs = []
+        threads = [
+            threading.Thread(target=lambda: jobs.append(service.submit([])))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(starts) == 1
+        for job in jobs:
+            job.future.result(timeout=60)
+    finally:
+        service.close()